@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import sys
+
+from sqlalchemy import Date, Float, Integer, LargeBinary
+
+from database_manager import Base, DatabaseManager
+from protocol_timeline import _note
+
+DEFAULT_CHUNK_SIZE = 50000
+STATE_FILE = "_export_state.json"
+# (text column, compressed column) of notes that protocol_timeline compact may have moved,
+# they are exported as plain text
+COMPACTED = {"protocols": ("protocol", "protocol_compressed")}
+
+
+def export_columns(table):
+    # image BLOBs are never exported
+    return [column for column in table.columns if not isinstance(column.type, LargeBinary)]
+
+
+def iter_batches(engine, table, after_id=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    # keyset-paginated column batches: {column name: list of values}, no ORM instances involved
+    columns = export_columns(table)
+    names = [column.name for column in columns]
+    plain, compressed = COMPACTED.get(table.name, (None, None))
+    selected = names + ([compressed] if compressed else [])
+    sql = f"SELECT {', '.join(selected)} FROM {table.name} WHERE id > ? ORDER BY id LIMIT ?"
+    with engine.connect() as conn:
+        while True:
+            rows = conn.exec_driver_sql(sql, (after_id, chunk_size)).fetchall()
+            if not rows:
+                return
+            batch = dict(zip(selected, (list(values) for values in zip(*rows))))
+            if compressed:
+                batch[plain] = [_note(note, packed) for note, packed in zip(batch[plain], batch.pop(compressed))]
+            yield batch
+            after_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                return
+
+
+def to_numpy(table, batch):
+    # NumPy arrays per column; nullable integers become float64 with NaN, like pandas does
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("NumPy is required for columnar batches (pip install numpy)")
+
+    arrays = {}
+    for column in export_columns(table):
+        values = batch[column.name]
+        if isinstance(column.type, Integer):
+            if None in values:
+                arrays[column.name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            else:
+                arrays[column.name] = np.array(values, dtype=np.int64)
+        elif isinstance(column.type, Float):
+            arrays[column.name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        elif isinstance(column.type, Date):
+            # SQLite stores dates as ISO text
+            arrays[column.name] = np.array(["NaT" if v is None else v for v in values], dtype="datetime64[D]")
+        else:
+            arrays[column.name] = np.array(values, dtype=object)
+    return arrays
+
+
+def to_arrow(table, batch):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("pyarrow is required for Arrow/Parquet export (pip install pyarrow)")
+
+    fields, arrays = [], []
+    for column in export_columns(table):
+        values = batch[column.name]
+        if isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, Date):
+            arrow_type = pa.date32()
+            values = pa.array(values, pa.string()).cast(pa.date32())
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type, nullable=column.nullable))
+        arrays.append(values if isinstance(values, pa.Array) else pa.array(values, arrow_type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+class AnalyticsExporter:
+    # writes one Parquet/Arrow part file per chunk; with incremental=True only rows above the
+    # last exported id are written, so edits and deletes of older rows need a full export
+    def __init__(self, engine, out_dir, file_format="parquet", chunk_size=DEFAULT_CHUNK_SIZE):
+        if file_format not in ("parquet", "arrow"):
+            raise ValueError(f"Unknown format: {file_format}")
+        self.engine = engine
+        self.out_dir = out_dir
+        self.file_format = file_format
+        self.chunk_size = chunk_size
+
+    def _state_path(self):
+        return os.path.join(self.out_dir, STATE_FILE)
+
+    def load_state(self):
+        try:
+            with open(self._state_path(), encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return {}
+
+    def _save_state(self, state):
+        temp_path = self._state_path() + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(state, handle, indent=2, sort_keys=True)
+        os.replace(temp_path, self._state_path())
+
+    def export(self, tables=None, incremental=True):
+        os.makedirs(self.out_dir, exist_ok=True)
+        state = self.load_state()
+        exported = {}
+        for table in Base.metadata.sorted_tables:
+            if tables and table.name not in tables:
+                continue
+            table_dir = os.path.join(self.out_dir, table.name)
+            if not incremental:
+                if os.path.isdir(table_dir):
+                    for name in os.listdir(table_dir):
+                        os.remove(os.path.join(table_dir, name))
+                # also for tables that are empty now, a later incremental run starts from scratch
+                state.pop(table.name, None)
+                self._save_state(state)
+            os.makedirs(table_dir, exist_ok=True)
+
+            high_water = state.get(table.name, 0) if incremental else 0
+            exported[table.name] = 0
+            for batch in iter_batches(self.engine, table, high_water, self.chunk_size):
+                ids = batch["id"]
+                self._write(to_arrow(table, batch), os.path.join(table_dir, f"part-{ids[0]:010d}-{ids[-1]:010d}"))
+                exported[table.name] += len(ids)
+                # saved per part, an interrupted export resumes after the last written file
+                state[table.name] = high_water = ids[-1]
+                self._save_state(state)
+        return exported
+
+    def _write(self, arrow_table, base_path):
+        if self.file_format == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(arrow_table, base_path + ".parquet", compression="zstd")
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(arrow_table, base_path + ".arrow", compression="zstd")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the business tables as Parquet/Arrow files for analysis.")
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--out", default="exports")
+    parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--full", action="store_true", help="re-export everything instead of new rows only")
+    parser.add_argument("tables", nargs="*", help="limit the export to these tables")
+    args = parser.parse_args(argv)
+
+    exporter = AnalyticsExporter(DatabaseManager(args.db).engine, args.out, args.format, args.chunk_size)
+    try:
+        exported = exporter.export(args.tables or None, incremental=not args.full)
+    except RuntimeError as e:
+        print(f"Export failed: {e}", file=sys.stderr)
+        return 1
+    for table, count in exported.items():
+        print(f"{table}: {count} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
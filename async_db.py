@@ -0,0 +1,135 @@
+import time
+
+from PyQt5 import sip
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+
+from instrumentation import metrics
+
+# worker threads for database calls; SQLite serializes writers anyway, two threads let a read
+# run next to a write without piling up connections
+MAX_THREADS = 2
+
+
+def _name(function):
+    return getattr(function, "__qualname__", None) or repr(function)
+
+
+class RequestSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class DatabaseRequest(QRunnable):
+    # one call on a worker thread; any exception is reported as failed, an escaping one would
+    # abort the process. Results are delivered on the thread that submitted the request
+    def __init__(self, function, args, kwargs):
+        super().__init__()
+        # owned by Python so a request taken back with tryTake or still referenced stays valid
+        self.setAutoDelete(False)
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = RequestSignals()
+
+    def run(self):
+        try:
+            result = self.function(*self.args, **self.kwargs)
+        except (RuntimeError, OSError, ValueError) as e:
+            # what DatabaseManager raises, the message is meant for the user
+            self.signals.failed.emit(str(e))
+        except Exception as e:
+            self.signals.failed.emit(f"{type(e).__name__}: {e}")
+        else:
+            self.signals.finished.emit(result)
+
+
+class BusyIndicator:
+    # busy cursor on the widget and the given controls disabled while any of its requests runs
+    def __init__(self, widget, *controls):
+        self.widget = widget
+        self.controls = controls
+        self.running = 0
+
+    def started(self):
+        self.running += 1
+        if self.running == 1:
+            self._show(True)
+
+    def finished(self):
+        self.running = max(0, self.running - 1)
+        if self.running == 0 and not sip.isdeleted(self.widget):
+            self._show(False)
+
+    def _show(self, busy):
+        if busy:
+            self.widget.setCursor(Qt.BusyCursor)
+        else:
+            self.widget.unsetCursor()
+        for control in self.controls:
+            control.setEnabled(not busy)
+
+
+class AsyncDatabase(QObject):
+    # runs DatabaseManager calls off the GUI thread; callbacks are skipped once their context
+    # (the dialog or model that asked) has been deleted. Requests submitted with a key coalesce
+    # per context: a newer one replaces a queued one and makes a running one's result stale.
+    def __init__(self, database_manager, max_threads=MAX_THREADS, parent=None):
+        super().__init__(parent)
+        self.database_manager = database_manager
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max_threads)
+        self.latest = {}
+        self.running = set()
+
+    def call(self, context, method, *args, on_result=None, on_error=None, key=None, busy=None, **kwargs):
+        # DatabaseManager method by name
+        return self.submit(context, getattr(self.database_manager, method), *args, on_result=on_result,
+                           on_error=on_error, key=key, busy=busy, **kwargs)
+
+    def submit(self, context, function, *args, on_result=None, on_error=None, key=None, busy=None, **kwargs):
+        request = DatabaseRequest(function, args, kwargs)
+        submitted = time.perf_counter()
+        if key is not None:
+            key = (id(context), key)
+            previous = self.latest.get(key)
+            if previous is not None:
+                self._cancel(previous)
+            self.latest[key] = request
+
+        def done(callback, value):
+            self.running.discard(request)
+            if key is not None and self.latest.get(key) is request:
+                del self.latest[key]
+            if busy is not None:
+                busy.finished()
+            # what the user waits for: queueing, the call itself and delivery back to the GUI thread
+            metrics.record("async", _name(function), (time.perf_counter() - submitted) * 1000)
+            if callback is not None and not request.cancelled and not sip.isdeleted(context):
+                with metrics.timed("ui", _name(callback)):
+                    callback(value)
+
+        # connected before the request starts, results can not arrive unobserved
+        request.signals.finished.connect(lambda result: done(on_result, result))
+        request.signals.failed.connect(lambda message: done(on_error, message))
+        request.busy = busy
+        if busy is not None:
+            busy.started()
+        self.running.add(request)
+        self.thread_pool.start(request)
+        return request
+
+    def _cancel(self, request):
+        request.cancelled = True
+        # still queued: it never runs, so its completion has to be accounted for here
+        if self.thread_pool.tryTake(request):
+            self.running.discard(request)
+            if request.busy is not None:
+                request.busy.finished()
+
+    def cancel(self, request):
+        if request in self.running:
+            self._cancel(request)
+
+    def wait(self, msecs=-1):
+        return self.thread_pool.waitForDone(msecs)
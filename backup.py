@@ -0,0 +1,370 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from blob_store import BlobStore
+from instrumentation import metrics
+
+# pages copied per backup step
+PAGES_PER_STEP = 256
+KEEP_GENERATIONS = 7
+# snapshots are stored as chunks of this size, each compressed and stored once however many
+# generations contain it; a multiple of every SQLite page size, so a changed page changes one chunk
+CHUNK_SIZE = 1024 * 1024
+# gzip level 1 compresses about three times faster than 6 for a third more space
+COMPRESS_LEVEL = 1
+# columns holding blob store digests, those images are backed up next to the chunks
+IMAGE_COLUMNS = (("sales_receipts", "receipt_image_hash"), ("purchase_receipts", "receipt_image_hash"))
+NAME_FORMAT = "%Y%m%d-%H%M%S"
+MB = 1024 * 1024
+
+
+class BackupCancelled(Exception):
+    pass
+
+
+def default_backup_dir(database):
+    # sibling directory of the database file, e.g. PrimalArtDB.db -> PrimalArtDB_backups
+    return os.path.splitext(os.path.abspath(database))[0] + "_backups"
+
+
+def _remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _count_rows(conn):
+    tables = [name for name, in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+        "AND sql NOT LIKE 'CREATE VIRTUAL TABLE%' ORDER BY name"
+    )]
+    return {table: conn.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0] for table in tables}
+
+
+def _rate(size, seconds):
+    return round(size / MB / seconds, 1) if seconds > 0 else None
+
+
+@metrics.instrument_class("database")
+class BackupManager:
+    # online backups of the SQLite file. A snapshot is taken with the SQLite backup API in small
+    # page steps while a read transaction pins it, so with WAL the app keeps writing and the copy
+    # never restarts. A generation is a manifest listing the snapshot's chunks plus the receipt
+    # images it references; chunks and images are content addressed, so unchanged parts of the
+    # database and unchanged images are not stored again. Thumbnails are not backed up, they are
+    # made again from the images.
+    def __init__(self, database, blob_store, directory, keep=KEEP_GENERATIONS):
+        self.database = os.path.abspath(database)
+        self.blob_store = blob_store
+        self.directory = directory
+        self.chunk_dir = os.path.join(directory, "chunks")
+        self.image_dir = os.path.join(directory, "images")
+        self._images = None
+        self.keep = keep
+        self.stem = os.path.splitext(os.path.basename(self.database))[0]
+        self.cancelled = False
+
+    @property
+    def images(self):
+        # created on first use, opening the app must not create backup directories
+        if self._images is None:
+            self._images = BlobStore(self.image_dir)
+        return self._images
+
+    def cancel(self):
+        # stops a running backup at its next step, nothing of it is kept
+        self.cancelled = True
+
+    def generations(self):
+        # manifests, newest first
+        if not os.path.isdir(self.directory):
+            return []
+        manifests = []
+        for entry in sorted(os.listdir(self.directory), reverse=True):
+            if entry.startswith(self.stem + "-") and entry.endswith(".json"):
+                with open(os.path.join(self.directory, entry), encoding="utf-8") as f:
+                    manifests.append(json.load(f))
+        return manifests
+
+    def manifest(self, name):
+        path = os.path.join(self.directory, f"{name}.json")
+        if not os.path.exists(path):
+            raise ValueError(f"No backup named {name}")
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _chunk_path(self, digest):
+        return os.path.join(self.chunk_dir, digest[:2], f"{digest[2:]}.gz")
+
+    def backup(self, progress=None):
+        # progress(stage, done, total); returns the new generation's manifest
+        self.cancelled = False
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{self.stem}-{time.strftime(NAME_FORMAT)}"
+        # two backups within a second must not share a manifest
+        taken = 1
+        while os.path.exists(os.path.join(self.directory, f"{name}.json")):
+            taken += 1
+            name = f"{self.stem}-{time.strftime(NAME_FORMAT)}-{taken}"
+        fd, snapshot = tempfile.mkstemp(dir=self.directory, prefix=".snapshot-", suffix=".db")
+        os.close(fd)
+        try:
+            pages = self._snapshot(snapshot, progress)
+            snapshot_seconds = time.perf_counter() - started
+            size = os.path.getsize(snapshot)
+            # counts and images come from the snapshot, so they match it exactly
+            conn = sqlite3.connect(snapshot)
+            try:
+                tables = _count_rows(conn)
+                images = sorted({digest for table, column in IMAGE_COLUMNS if table in tables
+                                 for digest, in conn.execute(f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL")})
+            finally:
+                conn.close()
+
+            chunks, stored, compressed, sha256 = self._store_chunks(snapshot, progress)
+            images_started = time.perf_counter()
+            copied, copied_bytes, missing = self._store_images(images, progress)
+            seconds = time.perf_counter() - started
+            manifest = {
+                "name": name, "database": os.path.basename(self.database), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "size": size, "pages": pages, "sha256": sha256, "chunk_size": CHUNK_SIZE, "chunks": chunks,
+                "tables": tables, "images": images, "missing_images": missing,
+                "stats": {
+                    "new_chunks": stored, "new_chunk_bytes": compressed, "new_images": copied, "new_image_bytes": copied_bytes,
+                    "snapshot_seconds": round(snapshot_seconds, 3),
+                    "chunk_seconds": round(images_started - started - snapshot_seconds, 3),
+                    "image_seconds": round(time.perf_counter() - images_started, 3), "seconds": round(seconds, 3),
+                    "snapshot_mb_s": _rate(size, snapshot_seconds), "mb_s": _rate(size + copied_bytes, seconds),
+                },
+            }
+            # the manifest is written last, a generation without one does not exist
+            temp = os.path.join(self.directory, f".{name}.json")
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=1)
+            os.replace(temp, os.path.join(self.directory, f"{name}.json"))
+        finally:
+            _remove(snapshot, snapshot + "-journal", snapshot + "-wal", snapshot + "-shm")
+        manifest["stats"]["removed_generations"] = self.rotate()
+        return manifest
+
+    def _snapshot(self, path, progress):
+        source = sqlite3.connect(self.database, isolation_level=None, timeout=30)
+        try:
+            # the read transaction pins the snapshot: writes by the app go to the WAL meanwhile
+            # instead of restarting the copy
+            source.execute("BEGIN")
+            source.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            target = sqlite3.connect(path)
+            copied = []
+
+            def step(status, remaining, total):
+                copied[:] = [total]
+                if self.cancelled:
+                    raise BackupCancelled("Backup cancelled")
+                if progress:
+                    progress("snapshot", total - remaining, total)
+
+            try:
+                source.backup(target, pages=PAGES_PER_STEP, progress=step)
+                # a plain file, the app switches it back to WAL when it opens a restored copy
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+            source.execute("ROLLBACK")
+        finally:
+            source.close()
+        return copied[0] if copied else 0
+
+    def _store_chunks(self, path, progress):
+        digests = []
+        stored = compressed = 0
+        whole = hashlib.sha256()
+        total = os.path.getsize(path)
+        with open(path, "rb") as snapshot:
+            for chunk in iter(lambda: snapshot.read(CHUNK_SIZE), b""):
+                if self.cancelled:
+                    raise BackupCancelled("Backup cancelled")
+                whole.update(chunk)
+                digest = hashlib.sha256(chunk).hexdigest()
+                digests.append(digest)
+                target = self._chunk_path(digest)
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    data = gzip.compress(chunk, COMPRESS_LEVEL)
+                    fd, temp = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".incoming-")
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                    os.replace(temp, target)
+                    stored += 1
+                    compressed += len(data)
+                if progress:
+                    progress("chunks", min(len(digests) * CHUNK_SIZE, total), total)
+        return digests, stored, compressed, whole.hexdigest()
+
+    def _store_images(self, digests, progress):
+        copied = copied_bytes = 0
+        missing = []
+        for done, digest in enumerate(digests, 1):
+            if self.cancelled:
+                raise BackupCancelled("Backup cancelled")
+            if not self.images.exists(digest):
+                if not self.blob_store.exists(digest):
+                    missing.append(digest)
+                    continue
+                # hashed again on the way, a damaged image is not taken for the original
+                if self.images.put_file(self.blob_store.path_for(digest)) != digest:
+                    missing.append(digest)
+                    continue
+                copied += 1
+                copied_bytes += os.path.getsize(self.images.path_for(digest))
+            if progress:
+                progress("images", done, len(digests))
+        return copied, copied_bytes, missing
+
+    def rotate(self):
+        # keeps the newest generations, then drops chunks and images no kept generation uses
+        generations = self.generations()
+        removed = [manifest["name"] for manifest in generations[self.keep:]]
+        for name in removed:
+            _remove(os.path.join(self.directory, f"{name}.json"))
+        kept = generations[:self.keep]
+        chunks = {digest for manifest in kept for digest in manifest["chunks"]}
+        images = {digest for manifest in kept for digest in manifest["images"]}
+        for root, referenced, name_of in ((self.chunk_dir, chunks, lambda prefix, entry: prefix + entry[:-len(".gz")]),
+                                          (self.image_dir, images, lambda prefix, entry: prefix + entry)):
+            if not os.path.isdir(root):
+                continue
+            for prefix in os.listdir(root):
+                directory = os.path.join(root, prefix)
+                if not os.path.isdir(directory):
+                    continue
+                for entry in os.listdir(directory):
+                    if not entry.startswith(".") and name_of(prefix, entry) not in referenced:
+                        os.remove(os.path.join(directory, entry))
+        return removed
+
+    def restore(self, name, target=None, check_only=False, progress=None):
+        # rebuilds the database of a generation next to the target, checks it with
+        # PRAGMA integrity_check and the row counts taken at backup time, then puts it in place
+        # together with its images. Only while the app is closed. check_only leaves everything as is.
+        manifest = self.manifest(name)
+        target = os.path.abspath(target or self.database)
+        started = time.perf_counter()
+        work_dir = self.directory if check_only else os.path.dirname(target)
+        fd, restored = tempfile.mkstemp(dir=work_dir, prefix=".restore-", suffix=".db")
+        try:
+            whole = hashlib.sha256()
+            with os.fdopen(fd, "wb") as f:
+                for done, digest in enumerate(manifest["chunks"], 1):
+                    path = self._chunk_path(digest)
+                    if not os.path.exists(path):
+                        raise RuntimeError(f"Chunk {digest} of backup {name} is missing")
+                    with open(path, "rb") as chunk_file:
+                        chunk = gzip.decompress(chunk_file.read())
+                    if hashlib.sha256(chunk).hexdigest() != digest:
+                        raise RuntimeError(f"Chunk {digest} of backup {name} is damaged")
+                    whole.update(chunk)
+                    f.write(chunk)
+                    if progress:
+                        progress("chunks", done, len(manifest["chunks"]))
+            if whole.hexdigest() != manifest["sha256"]:
+                raise RuntimeError(f"Backup {name} does not match its checksum")
+
+            conn = sqlite3.connect(restored)
+            try:
+                integrity = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+                tables = _count_rows(conn)
+            finally:
+                conn.close()
+            problems = [] if integrity == ["ok"] else [f"integrity_check: {message}" for message in integrity[:10]]
+            for table in sorted(set(manifest["tables"]) | set(tables)):
+                expected, found = manifest["tables"].get(table), tables.get(table)
+                if expected != found:
+                    problems.append(f"{table}: {found} rows, {expected} at backup time")
+            missing = [digest for digest in manifest["images"] if not self.images.exists(digest)]
+            if problems:
+                raise RuntimeError(f"Backup {name} failed its checks: " + "; ".join(problems))
+
+            moved_aside = None
+            images_restored = 0
+            if not check_only:
+                for digest in manifest["images"]:
+                    if self.images.exists(digest) and not self.blob_store.exists(digest):
+                        self.blob_store.put_file(self.images.path_for(digest))
+                        images_restored += 1
+                if os.path.exists(target):
+                    # the current file and its WAL are kept, a WAL must never meet another database file
+                    moved_aside = f"{target}.before-restore-{time.strftime(NAME_FORMAT)}"
+                    os.replace(target, moved_aside)
+                    for suffix in ("-wal", "-shm"):
+                        if os.path.exists(target + suffix):
+                            os.replace(target + suffix, moved_aside + suffix)
+                os.replace(restored, target)
+            seconds = time.perf_counter() - started
+            return {"name": name, "target": None if check_only else target, "moved_aside": moved_aside,
+                    "integrity": "ok", "tables": len(tables), "rows": sum(tables.values()),
+                    "images": len(manifest["images"]), "images_restored": images_restored, "missing_images": missing,
+                    "seconds": round(seconds, 3), "mb_s": _rate(manifest["size"], seconds)}
+        finally:
+            _remove(restored, restored + "-journal", restored + "-wal", restored + "-shm")
+
+
+def describe(manifest):
+    stats = manifest["stats"]
+    return (f"{manifest['name']}: {manifest['size'] / MB:.1f} MB in {stats['seconds']:.1f} s ({stats['mb_s']} MB/s, "
+            f"snapshot {stats['snapshot_mb_s']} MB/s), {stats['new_chunks']}/{len(manifest['chunks'])} chunks new "
+            f"({stats['new_chunk_bytes'] / MB:.1f} MB), {stats['new_images']}/{len(manifest['images'])} images new "
+            f"({stats['new_image_bytes'] / MB:.1f} MB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backups of the practice database.")
+    parser.add_argument("--db", default="PrimalArtDB.db", help="database file")
+    parser.add_argument("--dir", help="backup directory, next to the database by default")
+    parser.add_argument("--keep", type=int, default=KEEP_GENERATIONS)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("backup", help="take a backup now")
+    commands.add_parser("list", help="list the generations, newest first")
+    check = commands.add_parser("check", help="rebuild a generation in the backup directory and check it")
+    check.add_argument("name")
+    restore = commands.add_parser("restore", help="replace the database by a generation; close the app first")
+    restore.add_argument("name")
+    restore.add_argument("--target", help="write the restored database here instead")
+    args = parser.parse_args(argv)
+
+    from blob_store import default_blob_dir
+
+    manager = BackupManager(args.db, BlobStore(default_blob_dir(args.db)), args.dir or default_backup_dir(args.db), args.keep)
+    if args.command == "backup":
+        if not os.path.exists(args.db):
+            parser.error(f"{args.db} does not exist")
+        manifest = manager.backup(progress=lambda stage, done, total: print(f"{stage}: {done}/{total}".ljust(40), end="\r"))
+        print()
+        print(describe(manifest))
+        if manifest["missing_images"]:
+            print(f"{len(manifest['missing_images'])} receipt images were missing in {manager.blob_store.root}")
+    elif args.command == "list":
+        for manifest in manager.generations():
+            print(f"{manifest['name']}  {manifest['size'] / MB:8.1f} MB  {sum(manifest['tables'].values()):9} rows  "
+                  f"{len(manifest['images']):6} images")
+    else:
+        report = manager.restore(args.name, getattr(args, "target", None), check_only=args.command == "check")
+        print(f"{report['name']}: integrity ok, {report['rows']} rows in {report['tables']} tables match, "
+              f"{report['seconds']:.1f} s ({report['mb_s']} MB/s)")
+        if report["missing_images"]:
+            print(f"{len(report['missing_images'])} receipt images are not in the backup")
+        if report["target"]:
+            print(f"restored to {report['target']}" + (f", the previous file is {report['moved_aside']}" if report["moved_aside"] else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
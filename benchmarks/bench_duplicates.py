@@ -0,0 +1,99 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_search import seed  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+
+
+def typo(rng, value):
+    # one dropped, doubled or swapped character
+    while True:
+        i = rng.randrange(1, len(value) - 1)
+        kind = rng.randrange(3)
+        if kind == 0:
+            changed = value[:i] + value[i + 1:]
+        elif kind == 1:
+            changed = value[:i] + value[i] + value[i:]
+        else:
+            changed = value[:i - 1] + value[i] + value[i - 1] + value[i + 1:]
+        if changed != value:
+            return changed
+
+
+def plant(database_manager, rng, clients, count):
+    # clients entered a second time: a typo in the e-mail or the name, the phone number written differently
+    with database_manager.engine.begin() as conn:
+        originals = conn.exec_driver_sql(
+            f"SELECT id, first_name, last_name, email, phone_number FROM clients WHERE id IN "
+            f"({', '.join(str(i) for i in rng.sample(range(1, clients + 1), count))})"
+        ).all()
+        rows = []
+        for client_id, first, last, email, phone in originals:
+            local, domain = email.split("@")
+            digits = phone.replace("+49 (0)", "0").replace(" ", "")
+            variant = rng.randrange(3)
+            if variant == 0:
+                rows.append((first, last, typo(rng, local) + "@" + domain, digits[:4] + "/" + digits[4:]))
+            elif variant == 1:
+                rows.append((typo(rng, first), last, local + "@gmx.de", "+49 " + digits[1:]))
+            else:
+                rows.append((first, typo(rng, last), email.replace("@", ".x@"), digits))
+        conn.exec_driver_sql("INSERT INTO clients (first_name, last_name, email, phone_number, address) "
+                             "VALUES (?, ?, ?, ?, 'Doppelt 1')", rows)
+        planted = conn.exec_driver_sql("SELECT id FROM clients WHERE address = 'Doppelt 1' ORDER BY id").all()
+    return {(original[0], copy[0]) for original, copy in zip(originals, planted)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Duplicate detection: live check latency and batch report at scale.")
+    parser.add_argument("--clients", type=int, nargs="*", default=[10000, 100000])
+    parser.add_argument("--duplicates", type=int, default=200)
+    parser.add_argument("--checks", type=int, default=200)
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        rng = random.Random(5)
+        with tempfile.TemporaryDirectory() as directory:
+            database_manager = DatabaseManager(f"sqlite:///{os.path.join(directory, 'duplicates.db')}")
+            seed(database_manager, clients)
+            planted = plant(database_manager, rng, clients, args.duplicates)
+            duplicates = database_manager.duplicates
+
+            start = time.perf_counter()
+            refreshed = duplicates.refresh()
+            refresh = time.perf_counter() - start
+
+            # the live check for a new client that is a typo'd copy of an existing one
+            with database_manager.engine.connect() as conn:
+                probes = conn.exec_driver_sql(
+                    "SELECT first_name, last_name, email, phone_number FROM clients ORDER BY random() LIMIT ?", (args.checks,)
+                ).all()
+            timings = []
+            hits = 0
+            for first, last, email, phone in probes:
+                start = time.perf_counter()
+                found = database_manager.find_duplicates(first, typo(rng, last), typo(rng, email), phone.replace(" ", ""))
+                timings.append((time.perf_counter() - start) * 1000)
+                hits += any(match.client.email == email for match in found)
+            timings.sort()
+
+            start = time.perf_counter()
+            pairs = duplicates.report()
+            report = time.perf_counter() - start
+            found = {(pair.first.id, pair.second.id) for pair in pairs}
+
+            print(f"{clients:>7} clients: keys for {refreshed} rows {refresh:5.1f} s   "
+                  f"check median {timings[len(timings) // 2]:5.2f} ms p95 {timings[int(len(timings) * 0.95) - 1]:5.2f} ms "
+                  f"found {hits}/{len(probes)}   report {report:5.1f} s, {len(pairs)} pairs, "
+                  f"{len(planted & found)}/{len(planted)} planted duplicates found")
+            database_manager.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
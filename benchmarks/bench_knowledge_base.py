@@ -0,0 +1,110 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database_manager import DatabaseManager  # noqa: E402
+from knowledge_base import make_server  # noqa: E402
+
+TOPICS = ("therapie malen farbe gefühl angst kind familie sitzung bild ausdruck trauer wut ruhe körper "
+          "atem gruppe eltern schule schlaf traum erinnerung vertrauen grenze stärke hoffnung wandel "
+          "ton papier kreide pinsel form linie fläche raum stille bewegung musik rhythmus spiel").split()
+SYLLABLES = ["an", "be", "ge", "ver", "zu", "ein", "lich", "keit", "ung", "ten", "der", "stand", "halt", "sam"]
+QUERIES = ["angst", "malen kind", "farb", "trauer familie", "schlaf traum", "pinsel", "gruppe sitzung eltern", "ruhe"]
+
+
+def _vocabulary(rng, size=3000):
+    # topic words among generated filler words, drawn with Zipf-like frequencies as in real text
+    words = list(dict.fromkeys("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)))
+    for i, topic in enumerate(TOPICS):
+        words.insert(20 + i * 15, topic)
+    return words, list(accumulate(1.0 / (rank + 1) for rank in range(len(words))))
+
+
+def _text(rng, vocabulary, words):
+    return " ".join(rng.choices(vocabulary[0], cum_weights=vocabulary[1], k=words))
+
+
+def seed(database_manager, articles, faqs):
+    rng = random.Random(3)
+    vocabulary = _vocabulary(rng)
+    with database_manager.engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO articles (title, body, author, published) VALUES (?, ?, ?, ?)",
+            [(_text(rng, vocabulary, 5).capitalize(), "\n\n".join(_text(rng, vocabulary, 60) for _ in range(5)), "Redaktion",
+              f"20{rng.randint(10, 24)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}") for _ in range(articles)]
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO faq (article_id, question, answers) VALUES (?, ?, ?)",
+            [(rng.randint(1, articles), _text(rng, vocabulary, 8).capitalize() + "?", _text(rng, vocabulary, 40)) for _ in range(faqs)]
+        )
+
+
+def rate(label, count, seconds):
+    print(f"{label:<36} {count / seconds:9,.0f} per second")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark knowledge base search and the HTTP endpoint.")
+    parser.add_argument("--articles", type=int, default=5000)
+    parser.add_argument("--faqs", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent HTTP clients")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_manager = DatabaseManager(f"sqlite:///{os.path.join(directory, 'kb.db')}")
+        start = time.perf_counter()
+        seed(database_manager, args.articles, args.faqs)
+        print(f"seeded {args.articles} articles and {args.faqs} FAQ entries in {time.perf_counter() - start:.1f} s")
+        knowledge_base = database_manager.knowledge_base
+
+        start = time.perf_counter()
+        for i in range(args.requests):
+            knowledge_base.search(QUERIES[i % len(QUERIES)])
+        rate("search, in process", args.requests, time.perf_counter() - start)
+
+        ids = list(range(1, args.articles + 1))
+        start = time.perf_counter()
+        for article_id in ids[:args.requests]:
+            knowledge_base.render_article(article_id)
+        rate("render_article, uncached", min(args.requests, len(ids)), time.perf_counter() - start)
+        hot = ids[:knowledge_base.cache_size]
+        start = time.perf_counter()
+        for i in range(args.requests):
+            knowledge_base.render_article(hot[i % len(hot)])
+        rate("render_article, cached", args.requests, time.perf_counter() - start)
+
+        server = make_server(knowledge_base, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        paths = [f"/search?q={urllib.parse.quote(QUERIES[i % len(QUERIES)])}" for i in range(args.requests)]
+
+        def fetch(path):
+            with urllib.request.urlopen(base + path) as response:
+                return len(response.read())
+
+        with ThreadPoolExecutor(args.clients) as pool:
+            start = time.perf_counter()
+            list(pool.map(fetch, paths))
+            rate(f"HTTP /search, {args.clients} clients", len(paths), time.perf_counter() - start)
+            paths = [f"/articles/{hot[i % len(hot)]}" for i in range(args.requests)]
+            start = time.perf_counter()
+            list(pool.map(fetch, paths))
+            rate(f"HTTP /articles cached, {args.clients} clients", len(paths), time.perf_counter() - start)
+        server.shutdown()
+        server.server_close()
+        database_manager.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
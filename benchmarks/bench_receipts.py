@@ -0,0 +1,73 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_search import seed  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+
+
+def day_of_receipts(rng, clients, products, count):
+    # an end-of-day batch: one to three product lines per receipt
+    return [
+        {"client_id": rng.randint(1, clients), "date": date(2024, 5, 17), "payment_method": rng.choice(["bar", "karte"]),
+         "lines": [(rng.randint(1, products), rng.randint(1, 3)) for _ in range(rng.randint(1, 3))]}
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receipt entry: one transaction per receipt against one per day, cached products.")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--receipts", type=int, default=200, help="receipts in the end-of-day batch")
+    parser.add_argument("--lookups", type=int, default=2000, help="product list reads")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    with tempfile.TemporaryDirectory() as directory:
+        # a file database, commits have to reach the disk like in the practice
+        database_manager = DatabaseManager(f"sqlite:///{os.path.join(directory, 'receipts.db')}")
+        seed(database_manager, args.clients)
+        with database_manager.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO products (service, price) VALUES (?, ?)",
+                                 [(f"Leistung {i}", rng.randint(20, 150)) for i in range(args.products)])
+        receipts = day_of_receipts(rng, args.clients, args.products, args.receipts)
+
+        start = time.perf_counter()
+        for receipt in receipts:
+            receipt = dict(receipt)
+            database_manager.create_receipt(receipt.pop("client_id"), receipt.pop("lines"), receipt.pop("date"), **receipt)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        database_manager.create_receipts(receipts)
+        batch = time.perf_counter() - start
+
+        print(f"{args.receipts} receipts, one transaction each   {single * 1000:8.1f} ms")
+        print(f"{args.receipts} receipts, one transaction        {batch * 1000:8.1f} ms   ({single / batch:.1f}x)")
+
+        # what opening AddReceiptDialog costs for the product list, cached and with a cold cache every time
+        reference = database_manager.reference
+        start = time.perf_counter()
+        for _ in range(args.lookups):
+            database_manager.get_products()
+        cached = time.perf_counter() - start
+        stats = reference.stats()["products"]
+        start = time.perf_counter()
+        for _ in range(args.lookups):
+            reference.invalidate("products")
+            database_manager.get_products()
+        uncached = time.perf_counter() - start
+        print(f"{args.lookups} product lists, reference cache   {cached * 1000:8.1f} ms   {stats}")
+        print(f"{args.lookups} product lists, from SQLite       {uncached * 1000:8.1f} ms   ({uncached / cached:.0f}x)")
+        database_manager.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import insert  # noqa: E402
+
+from database_manager import DatabaseManager, Client  # noqa: E402
+
+SYLLABLES = ["an", "be", "chri", "da", "el", "fe", "gün", "ha", "jo", "ka", "lu", "ma", "ni", "ol", "pe",
+             "ri", "sa", "sch", "ti", "ul", "ver", "wo", "zi", "mül", "ler", "ner", "mann", "berg", "stein"]
+
+
+def _name(rng, parts):
+    return "".join(rng.choice(SYLLABLES) for _ in range(parts)).capitalize()
+
+
+def seed(database_manager, count, batch_size=10000):
+    rng = random.Random(42)
+    with database_manager.engine.begin() as conn:
+        for start in range(0, count, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, count)):
+                first = _name(rng, rng.randint(2, 3))
+                last = _name(rng, rng.randint(2, 4))
+                rows.append({
+                    "first_name": first,
+                    "last_name": last,
+                    "email": f"{first}.{last}.{i}@example.com".lower(),
+                    "phone_number": f"+49 (0)30 {i:08d}",
+                    "address": f"Hauptstraße {i % 200}, Berlin",
+                })
+            conn.execute(insert(Client), rows)
+
+
+def bench(database_manager, label, repeat, **criteria):
+    database_manager.search_clients(**criteria)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = database_manager.search_clients(**criteria)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<28} median {timings[len(timings) // 2]:7.2f} ms   "
+          f"p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms   results {len(results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark client search latency.")
+    parser.add_argument("--clients", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_manager = DatabaseManager(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        start = time.perf_counter()
+        seed(database_manager, args.clients)
+        print(f"seeded {args.clients} clients in {time.perf_counter() - start:.1f} s")
+
+        bench(database_manager, "name prefix 'an'", args.repeat, name="an")
+        bench(database_manager, "name prefix 'mül'", args.repeat, name="mül")
+        bench(database_manager, "name prefix 'schma'", args.repeat, name="schma")
+        bench(database_manager, "full name 'anma mülberg'", args.repeat, name="anma mülberg")
+        bench(database_manager, "email prefix", args.repeat, email="ka")
+        bench(database_manager, "phone prefix", args.repeat, phone="+49 (0)30 0001")
+        bench(database_manager, "name + email", args.repeat, name="lu", email="lu")
+        database_manager.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# runs in a fresh interpreter so import costs are included
+CHILD = """
+import time
+start = time.perf_counter()
+import sys, json
+sys.path.insert(0, {repo!r})
+import main
+imported = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+window = main.MainWindow()
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+window.database_loader.finished.connect(app.quit)
+if window.database_loader.isRunning():
+    app.exec_()
+ready = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "window_shown_ms": (shown - start) * 1000,
+    "database_ready_ms": (ready - start) * 1000,
+    "connected": window.db_connected,
+}}))
+"""
+
+# the database layer alone, this is where the cached schema fingerprint shows
+CHILD_DATABASE = """
+import time
+start = time.perf_counter()
+import sys, json
+sys.path.insert(0, {repo!r})
+from database_manager import DatabaseManager
+imported = time.perf_counter()
+DatabaseManager("sqlite:///PrimalArtDB.db")
+opened = time.perf_counter()
+print(json.dumps({{
+    "sqlalchemy_import_ms": (imported - start) * 1000,
+    "open_ms": (opened - imported) * 1000,
+}}))
+"""
+
+
+def run_child(code, directory):
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    output = subprocess.run(
+        [sys.executable, "-c", code.format(repo=os.path.abspath(REPO))],
+        cwd=directory, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(label, samples):
+    line = f"{label:<6}"
+    for key in samples[0]:
+        if key.endswith("_ms"):
+            line += f"  {key} {statistics.median(sample[key] for sample in samples):7.0f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold and warm application startup.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for title, code in (("application", CHILD), ("database layer", CHILD_DATABASE)):
+        cold, warm = [], []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as directory:
+                # cold: the database file does not exist yet and the schema is created
+                cold.append(run_child(code, directory))
+                # warm: same database, schema fingerprint matches
+                warm.append(run_child(code, directory))
+        print(title)
+        summarize("cold", cold)
+        summarize("warm", warm)
+
+
+if __name__ == "__main__":
+    main()
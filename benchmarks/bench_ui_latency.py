@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QTimer  # noqa: E402
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from async_db import AsyncDatabase  # noqa: E402
+from bench_search import seed  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+from dialogs import ClientTableModel, SearchClientDialog  # noqa: E402
+
+
+class SlowDatabaseManager:
+    # every DatabaseManager method sleeps first, like a slow disk or a locked database would
+    def __init__(self, database_manager, delay):
+        self.database_manager = database_manager
+        self.delay = delay
+
+    def __getattr__(self, name):
+        attribute = getattr(self.database_manager, name)
+        if not callable(attribute):
+            return attribute
+
+        def slow(*args, **kwargs):
+            time.sleep(self.delay)
+            return attribute(*args, **kwargs)
+        return slow
+
+
+def measure(app, database, operations):
+    # largest gap between 5 ms ticks of the GUI event loop until every request has been delivered
+    gaps = []
+    last = [time.perf_counter()]
+
+    def tick():
+        now = time.perf_counter()
+        gaps.append(now - last[0])
+        last[0] = now
+
+    timer = QTimer()
+    timer.timeout.connect(tick)
+    timer.start(5)
+    start = time.perf_counter()
+    operations()
+    while database.running:
+        app.processEvents()
+        time.sleep(0.001)
+    timer.stop()
+    return max(gaps) * 1000 if gaps else 0.0, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI event loop stalls while dialogs wait on a slow database.")
+    parser.add_argument("--clients", type=int, default=20000)
+    parser.add_argument("--delays", default="0,0.2,1.0", help="seconds added to every database call")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    database_manager = DatabaseManager("sqlite://")
+    seed(database_manager, args.clients)
+
+    for delay in (float(value) for value in args.delays.split(",")):
+        database = AsyncDatabase(SlowDatabaseManager(database_manager, delay))
+        model = ClientTableModel(database)
+        search = SearchClientDialog(database)
+
+        def operations():
+            model.fetchMore()
+            for text in ("a", "an", "anm", "anma"):
+                search.name_input.setText(text)
+                search.perform_search()
+            database.call(database, "get_client_detail", 1)
+
+        stall, elapsed = measure(app, database, operations)
+        print(f"database delay {delay * 1000:6.0f} ms   worst GUI stall {stall:6.1f} ms   all results after {elapsed:5.2f} s   "
+              f"rows {len(model.rows)}   search results {len(search.last_results)}")
+
+
+if __name__ == "__main__":
+    main()
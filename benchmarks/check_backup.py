@@ -0,0 +1,143 @@
+import argparse
+import gzip
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backup import BackupCancelled, BackupManager, describe  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+from generate_dataset import SCALES, generate  # noqa: E402
+
+# backups of a generated practice while the app keeps writing: the snapshot must finish and be
+# consistent, the next generation must only store what changed, restore must catch damage
+
+
+def writer(path, stop, written):
+    # the front desk entering clients during the backup
+    conn = sqlite3.connect(path, timeout=30)
+    while not stop.is_set():
+        with conn:
+            conn.execute("INSERT INTO clients (first_name, last_name, email, phone_number, address) VALUES (?, ?, ?, ?, ?)",
+                         ("Während", "Sicherung", f"backup.{len(written)}@example.com", f"+49 1 {len(written)}", "Backupweg 1"))
+        written.append(1)
+        time.sleep(0.005)
+    conn.close()
+
+
+def expect_failure(manager, name, label):
+    try:
+        manager.restore(name, check_only=True)
+    except RuntimeError as e:
+        print(f"  {label}: rejected ({e})")
+        return 0
+    print(f"  {label}: NOT rejected")
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online backup under writes, incremental generations and verified restore.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--clients", type=int, help="override the number of clients of the scale")
+    args = parser.parse_args()
+
+    counts = dict(SCALES[args.scale])
+    if args.clients:
+        counts.update(clients=args.clients, receipts=args.clients * 5, protocols=args.clients * 10)
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "practice.db")
+        database_manager = DatabaseManager(f"sqlite:///{path}")
+        generate(database_manager, counts, progress=lambda line: None)
+        manager = database_manager.backups
+        print(f"database {os.path.getsize(path) / 1024 / 1024:.1f} MB, backups in {manager.directory}")
+
+        print("first backup while a writer inserts clients")
+        stop, written = threading.Event(), []
+        thread = threading.Thread(target=writer, args=(path, stop, written))
+        thread.start()
+        try:
+            first = manager.backup()
+        finally:
+            stop.set()
+            thread.join()
+        print(f"  {describe(first)}")
+        print(f"  {len(written)} clients written meanwhile")
+        failures += first["stats"]["new_chunks"] != len(set(first["chunks"]))
+        failures += first["stats"]["new_images"] != len(first["images"]) or not first["images"]
+
+        print("second backup after a few changes")
+        database_manager.add_client("Neu", "Nachsicherung", "neu.backup@example.com", "+49 2", "Neuweg 2")
+        second = manager.backup()
+        print(f"  {describe(second)}")
+        failures += second["stats"]["new_images"] != 0
+        failures += second["stats"]["new_chunks"] > len(second["chunks"]) // 2
+        # the first snapshot was pinned when it started, everything written meanwhile is in the second one
+        with database_manager.engine.connect() as conn:
+            clients = conn.exec_driver_sql("SELECT count(*) FROM clients").scalar()
+        failures += second["tables"]["clients"] != clients or first["tables"]["clients"] > clients - len(written) - 1
+
+        print("check and restore")
+        report = manager.restore(first["name"], check_only=True)
+        print(f"  check {first['name']}: {report['rows']} rows in {report['tables']} tables, "
+              f"{report['seconds']:.2f} s ({report['mb_s']} MB/s)")
+        target = os.path.join(directory, "restored.db")
+        report = manager.restore(second["name"], target=target)
+        restored = DatabaseManager(f"sqlite:///{target}", blob_dir=database_manager.blob_store.root)
+        found = restored.search_clients(email="neu.backup@example.com")
+        print(f"  restore {second['name']}: {report['rows']} rows, {report['seconds']:.2f} s ({report['mb_s']} MB/s), "
+              f"new client {'found' if found else 'MISSING'}")
+        failures += not found
+        restored.engine.dispose()
+
+        print("damaged backups")
+        chunk = manager._chunk_path(second["chunks"][-1])
+        with open(chunk, "rb") as f:
+            original = f.read()
+        with open(chunk, "wb") as f:
+            f.write(gzip.compress(b"\0" * len(gzip.decompress(original))))
+        failures += expect_failure(manager, second["name"], "damaged chunk")
+        with open(chunk, "wb") as f:
+            f.write(original)
+        # counts that do not match what the snapshot holds
+        third = manager.backup()
+        manifest_path = os.path.join(manager.directory, f"{third['name']}.json")
+        with open(manifest_path, encoding="utf-8") as f:
+            text = f.read()
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            f.write(text.replace(f'"clients": {third["tables"]["clients"]}', f'"clients": {third["tables"]["clients"] + 1}'))
+        failures += expect_failure(manager, third["name"], "wrong row count")
+
+        print("cancel")
+        cancelled = BackupManager(path, database_manager.blob_store, manager.directory)
+        try:
+            cancelled.backup(progress=lambda stage, done, total: cancelled.cancel())
+            print("  NOT cancelled")
+            failures += 1
+        except BackupCancelled:
+            print(f"  cancelled, {len(manager.generations())} generations kept")
+        failures += len(manager.generations()) != 3
+        failures += any(entry.startswith(".") for entry in os.listdir(manager.directory))
+
+        print("rotation")
+        manager.keep = 1
+        for client in range(3):
+            database_manager.add_client("Rotation", str(client), f"rotation.{client}@example.com", f"+49 3 {client}", "Rundweg 3")
+            manager.backup()
+        newest = manager.generations()
+        stored = sum(len(files) for _, _, files in os.walk(manager.chunk_dir))
+        print(f"  {len(newest)} generation kept, {stored} chunk files for {len(set(newest[0]['chunks']))} chunks")
+        failures += len(newest) != 1 or stored != len(set(newest[0]["chunks"]))
+        manager.restore(newest[0]["name"], check_only=True)
+        database_manager.engine.dispose()
+
+    print(f"{failures} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
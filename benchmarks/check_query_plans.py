@@ -0,0 +1,146 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_search import seed as seed_clients  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+from instrumentation import StatementCounter  # noqa: E402
+
+# runs every query DatabaseManager issues against a seeded database and fails when
+# EXPLAIN QUERY PLAN shows a full table scan that the case does not explicitly allow,
+# or when a case repeats the same SELECT often enough to be an N+1 pattern
+SKIPPED = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+START = date(2020, 1, 1)
+
+
+def seed(database_manager, clients, receipts):
+    rng = random.Random(7)
+    seed_clients(database_manager, clients)
+    day = lambda: (START + timedelta(days=rng.randrange(5 * 365))).isoformat()  # noqa: E731
+    with database_manager.engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO articles (title, published) VALUES (?, ?)",
+                             [(f"Artikel {i}", day()) for i in range(1000)])
+        conn.exec_driver_sql("INSERT INTO faq (article_id, question) VALUES (?, ?)",
+                             [(rng.randint(1, 1000), f"Frage {i}") for i in range(5000)])
+        conn.exec_driver_sql("INSERT INTO products (service, price) VALUES (?, ?)",
+                             [(f"Leistung {i}", rng.randint(20, 200)) for i in range(200)])
+        conn.exec_driver_sql("INSERT INTO vendors (name) VALUES (?)", [(f"Lieferant {i}",) for i in range(500)])
+        conn.exec_driver_sql(
+            "INSERT INTO sales_receipts (customer_id, date, total_amount, tax_amount, payment_method, category) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(rng.randint(1, clients), day(), rng.randint(20, 400), rng.randint(3, 60),
+              rng.choice(["bar", "karte", "überweisung"]), rng.choice(["Einzel", "Gruppe", "Material"]))
+             for _ in range(receipts)]
+        )
+        conn.exec_driver_sql("INSERT INTO product_sales (receipt_id, product_id, quantity, price) VALUES (?, ?, ?, ?)",
+                             [(rng.randint(1, receipts), rng.randint(1, 200), 1, 50.0) for _ in range(receipts)])
+        conn.exec_driver_sql("INSERT INTO protocols (client_id, protocol, date) VALUES (?, ?, ?)",
+                             [(rng.randint(1, clients), "Sitzung", day()) for _ in range(receipts // 2)])
+        conn.exec_driver_sql(
+            "INSERT INTO purchase_receipts (vendor_id, date, total_amount, tax_amount, category) VALUES (?, ?, ?, ?, ?)",
+            [(rng.randint(1, 500), day(), rng.randint(5, 900), rng.randint(1, 150), "Material")
+             for _ in range(receipts // 2)]
+        )
+
+
+def cases(database_manager):
+    # (label, call, tables the plan may scan in full); allowed scans are bounded by a LIMIT or read everything on purpose
+    db = database_manager
+    client = db.get_clients_page(after_id=500, limit=1)[0]
+    year = (date(2023, 1, 1), date(2024, 1, 1))
+    # duplicate keys of the seeded clients, computed in batches on first use like install() does
+    db.duplicates.refresh()
+    return [
+        ("add_client", lambda: db.add_client("Plan", "Check", "plan.check@example.com", "+49 30 999999", "Teststraße 1"), ()),
+        ("search_clients name", lambda: db.search_clients(name="anma"), ()),
+        ("search_clients broad name", lambda: db.search_clients(name="a"), ()),
+        ("search_clients email", lambda: db.search_clients(email="ka"), ()),
+        ("search_clients phone", lambda: db.search_clients(phone="+49 (0)30 0001"), ()),
+        ("search_clients name + email", lambda: db.search_clients(name="lu", email="lu"), ()),
+        ("search_clients empty", lambda: db.search_clients(), ("clients",)),
+        ("get_client", lambda: db.get_client(client.id + 1), ()),
+        ("update_client", lambda: db.update_client(
+            client.id, client.first_name, client.last_name, client.email, client.phone_number, client.address, "geprüft"), ()),
+        ("find_duplicates", lambda: db.find_duplicates(client.first_name, client.last_name + "n", client.email, client.phone_number), ()),
+        ("get_clients_page first", lambda: db.get_clients_page(), ("clients",)),
+        ("get_clients_page next", lambda: db.get_clients_page(after_id=client.id), ()),
+        ("get_all_clients", lambda: db.get_all_clients(), ("clients",)),
+        ("get_client_detail", lambda: db.get_client_detail(client.id), ()),
+        ("list_receipts", lambda: db.list_receipts(client.id), ()),
+        ("get_products", lambda: db.get_products(), ("products",)),
+        ("add_receipt", lambda: db.add_receipt(client.id, 1, "49,90", "01.06.2023"), ()),
+        ("create_receipts end of day", lambda: db.create_receipts(
+            {"client_id": client.id + i, "date": date(2023, 6, 1), "lines": [(i + 1, 1), (i + 2, 2)]} for i in range(20)), ()),
+        ("reports.revenue", lambda: db.reports.revenue(*year), ()),
+        ("reports.revenue daily", lambda: db.reports.revenue(date(2023, 3, 5), date(2023, 4, 9), period="day"), ()),
+        ("reports.expenses_by_category", lambda: db.reports.expenses_by_category(*year), ()),
+        ("reports.vat_summary", lambda: db.reports.vat_summary(*year), ()),
+        ("knowledge_base.search", lambda: db.knowledge_base.search("artikel 12"), ()),
+        ("knowledge_base.render_article", lambda: db.knowledge_base.render_article(12), ()),
+        ("update_article", lambda: db.update_article(12, "Artikel 12", "Neu", "Redaktion"), ()),
+        ("protocols.add", lambda: db.protocols.add(client.id, "Plan check"), ()),
+        ("protocols.page", lambda: db.protocols.page(client.id), ()),
+        ("protocols.page next", lambda: db.protocols.page(client.id, (date(2023, 6, 1), 10**9), limit=2), ()),
+        ("protocols.page undated", lambda: db.protocols.page(client.id, (None, 10**9), limit=2), ()),
+        ("protocols.stream year", lambda: list(db.protocols.stream(client.id, *year)), ()),
+        ("delete_client", lambda: db.delete_client(
+            db.search_clients(email="plan.check@example.com")[0].id), ()),
+    ]
+
+
+def full_scans(plan):
+    for _, _, _, detail in plan:
+        if not detail.startswith("SCAN ") or "VIRTUAL TABLE" in detail:
+            continue
+        table = detail.split()[1]
+        if not table.startswith("(") and table != "CONSTANT":
+            yield table, detail
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that DatabaseManager queries use indexes.")
+    parser.add_argument("--clients", type=int, default=20000)
+    parser.add_argument("--receipts", type=int, default=100000)
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every statement and its plan")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_manager = DatabaseManager(f"sqlite:///{os.path.join(directory, 'plans.db')}")
+        seed(database_manager, args.clients, args.receipts)
+
+        failures = 0
+        counter = StatementCounter(database_manager.engine)
+        raw = database_manager.engine.raw_connection()
+        for label, call, allowed in cases(database_manager):
+            with counter, counter.operation(label):
+                call()
+            statements = counter.recorded(label)
+            problems = [f"N+1: {times}x {statement}" for _, statement, times in counter.n_plus_one()]
+            counter.reset()
+            for statement, parameters in statements:
+                if statement.lstrip().upper().startswith(SKIPPED):
+                    continue
+                plan = raw.cursor().execute("EXPLAIN QUERY PLAN " + statement, parameters or ()).fetchall()
+                if args.verbose:
+                    print(f"  {' '.join(statement.split())}")
+                    for row in plan:
+                        print(f"      {row[3]}")
+                problems.extend(detail for table, detail in full_scans(plan) if table not in allowed)
+            failures += bool(problems)
+            print(f"{'FAIL' if problems else 'ok  '} {label} ({len(statements)} statements)")
+            for detail in problems:
+                print(f"       {detail}")
+        raw.close()
+        database_manager.engine.dispose()
+
+    print(f"{failures} cases with full table scans or N+1 queries")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
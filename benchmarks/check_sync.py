@@ -0,0 +1,162 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database_manager import DatabaseManager  # noqa: E402
+from generate_dataset import SCALES, generate  # noqa: E402
+
+# two database files synced through delta files like the front desk PC and the laptop would be:
+# initial full export, edits on both sides including conflicting ones, then a check that both
+# hold the same data and that the delta for a fixed number of changes does not grow with the database
+
+
+def contents(database_manager):
+    # comparable content independent of the local ids
+    with database_manager.engine.connect() as conn:
+        return {
+            "clients": sorted(conn.exec_driver_sql(
+                "SELECT first_name, last_name, email, phone_number, address, coalesce(notes, '') FROM clients")),
+            "receipts": sorted(conn.exec_driver_sql(
+                "SELECT c.email, r.date, r.total_amount, coalesce(r.description, ''), coalesce(r.receipt_image_hash, '') "
+                "FROM sales_receipts r JOIN clients c ON c.id = r.customer_id")),
+            "lines": sorted(conn.exec_driver_sql(
+                "SELECT c.email, r.date, r.total_amount, p.service, s.quantity, s.price FROM product_sales s "
+                "JOIN sales_receipts r ON r.id = s.receipt_id JOIN clients c ON c.id = r.customer_id "
+                "JOIN products p ON p.id = s.product_id")),
+            "protocols": sorted(conn.exec_driver_sql(
+                "SELECT c.email, p.date, p.protocol FROM protocols p JOIN clients c ON c.id = p.client_id")),
+            "images": sorted(
+                (digest, database_manager.blob_store.exists(digest)) for digest, in conn.exec_driver_sql(
+                    "SELECT DISTINCT receipt_image_hash FROM sales_receipts WHERE receipt_image_hash IS NOT NULL")),
+        }
+
+
+def exchange(directory, source, target, name, prefer="local"):
+    path = os.path.join(directory, name)
+    start = time.perf_counter()
+    manifest = source.sync.export(path, target.sync.site())
+    exported = time.perf_counter() - start
+    start = time.perf_counter()
+    stats = target.apply_sync(path, prefer)
+    applied = time.perf_counter() - start
+    print(f"  {name:<24} {manifest['rows']:7} rows {manifest['blobs']:4} images {os.path.getsize(path) / 1024:9.1f} KiB   "
+          f"export {exported * 1000:7.1f} ms   apply {applied * 1000:7.1f} ms   {stats}")
+    return manifest, stats
+
+
+def setup_pair(directory, counts, label):
+    front_desk = DatabaseManager(f"sqlite:///{os.path.join(directory, label + '_front_desk.db')}")
+    laptop = DatabaseManager(f"sqlite:///{os.path.join(directory, label + '_laptop.db')}")
+    generate(front_desk, counts, progress=lambda line: None)
+    path = os.path.join(directory, label + "_full.zip")
+    start = time.perf_counter()
+    manifest = front_desk.sync.export(path, laptop.sync.site(), full=True)
+    laptop.apply_sync(path)
+    print(f"  {label + '_full.zip':<24} {manifest['rows']:7} rows {manifest['blobs']:4} images {os.path.getsize(path) / 1024:9.1f} KiB   "
+          f"export and apply {(time.perf_counter() - start) * 1000:7.1f} ms")
+    # the laptop's acknowledgement, the front desk will only send new changes from now on
+    exchange(directory, laptop, front_desk, label + "_ack.zip")
+    return front_desk, laptop
+
+
+def edit(database_manager, count, tag):
+    # count changes of the everyday kind: new clients, receipts with lines, protocol entries
+    ids = []
+    for i in range(count // 3):
+        database_manager.add_client("Sync", f"{tag}{i}", f"sync.{tag}.{i}@example.com", f"+49 {tag} {i}", "Syncweg 1")
+        ids.append(database_manager.search_clients(email=f"sync.{tag}.{i}@example.com")[0].id)
+    database_manager.create_receipts({"client_id": client_id, "date": date(2025, 1, 2), "lines": [(1, 1), (2, 2)]} for client_id in ids)
+    for client_id in ids:
+        database_manager.protocols.add(client_id, f"Erstgespräch {tag}", date(2025, 1, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync two database files and check that they converge.")
+    parser.add_argument("--changes", type=int, default=300)
+    parser.add_argument("--large-clients", type=int, default=50000)
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        print("initial full sync and acknowledgement (small practice)")
+        front_desk, laptop = setup_pair(directory, SCALES["small"], "conflicts")
+        # a client without receipts, so it can be deleted later
+        front_desk.add_client("Bert", "Ohnebeleg", "bert@example.com", "+49 333", "Alt 3")
+        exchange(directory, front_desk, laptop, "bert.zip")
+        failures += contents(front_desk) != contents(laptop)
+
+        print("edits on both machines")
+        edit(front_desk, 30, "fd")
+        edit(laptop, 30, "lt")
+        with front_desk.engine.connect() as conn:
+            client = conn.exec_driver_sql("SELECT id, email FROM clients ORDER BY id LIMIT 1 OFFSET 5").one()
+        laptop_client = laptop.search_clients(email=client.email)[0]
+        doomed = front_desk.search_clients(email="bert@example.com")[0]
+        laptop_doomed = laptop.search_clients(email=doomed.email)[0]
+        # the same client changed on both machines
+        front_desk.update_client(client.id, "Anna", "Vorn", client.email, "+49 111", "Empfang 1")
+        laptop.update_client(laptop_client.id, "Anna", "Laptop", client.email, "+49 222", "Laptopweg 2")
+        # changed on the laptop, deleted at the front desk
+        laptop.update_client(laptop_doomed.id, "Bert", "Geändert", doomed.email, "+49 333", "Neu 3")
+        front_desk.delete_client(doomed.id)
+        # the same new client entered on both machines
+        front_desk.add_client("Carla", "Doppelt", "carla@example.com", "+49 444", "Zweimal 1")
+        laptop.add_client("Carla", "Doppelt", "carla@example.com", "+49 444", "Zweimal 1", notes="vom Laptop")
+
+        exchange(directory, front_desk, laptop, "front_desk_to_laptop.zip")
+        exchange(directory, laptop, front_desk, "laptop_to_front_desk.zip", prefer="remote")
+        exchange(directory, front_desk, laptop, "front_desk_to_laptop_2.zip")
+        for name, database_manager in (("front desk", front_desk), ("laptop", laptop)):
+            for conflict in database_manager.sync.conflicts():
+                print(f"  conflict on {name}: {conflict['table_name']} {conflict['row_key']} {conflict['reason']}, kept {conflict['kept']}")
+        first, second = contents(front_desk), contents(laptop)
+        for table in first:
+            same = first[table] == second[table]
+            failures += not same
+            print(f"  {table:<10} {len(first[table]):7} / {len(second[table]):7} rows  {'same' if same else 'DIFFERENT'}")
+        # nothing left to send either way
+        for source, target, name in ((front_desk, laptop, "idle_1.zip"), (laptop, front_desk, "idle_2.zip")):
+            manifest, stats = exchange(directory, source, target, name)
+            failures += stats["applied"] + stats["conflicts"] > 0
+
+        print("client deleted on one machine while the other adds a protocol for it")
+        for name, address in (("Dora", "Vorn 4"), ("Emil", "Laptop 5")):
+            front_desk.add_client(name, "Ohnebeleg", f"{name.lower()}@example.com", f"+49 {address}", address)
+        exchange(directory, front_desk, laptop, "orphans_setup.zip")
+        for deleting, adding, email in ((front_desk, laptop, "dora@example.com"), (laptop, front_desk, "emil@example.com")):
+            deleting.delete_client(deleting.search_clients(email=email)[0].id)
+            adding.protocols.add(adding.search_clients(email=email)[0].id, "Termin nach dem Löschen", date(2025, 2, 3))
+        # both directions must go through, the orphaned protocols are recorded as conflicts
+        before = {database_manager: len(database_manager.sync.conflicts()) for database_manager in (front_desk, laptop)}
+        _, first = exchange(directory, front_desk, laptop, "orphans_1.zip")
+        _, second = exchange(directory, laptop, front_desk, "orphans_2.zip")
+        for database_manager in (front_desk, laptop):
+            for conflict in database_manager.sync.conflicts()[before[database_manager]:]:
+                print(f"  conflict: {conflict['table_name']} {conflict['row_key']} {conflict['reason']}, kept {conflict['kept']}")
+        failures += first["conflicts"] + second["conflicts"] < 3
+        for source, target, name in ((front_desk, laptop, "orphans_idle_1.zip"), (laptop, front_desk, "orphans_idle_2.zip")):
+            manifest, stats = exchange(directory, source, target, name)
+            failures += stats["applied"] + stats["conflicts"] > 0
+
+        print(f"{args.changes} changes on a small and on a large practice")
+        sizes = []
+        for label, clients in (("small", SCALES["small"]["clients"]), ("large", args.large_clients)):
+            counts = dict(SCALES["small"], clients=clients, receipts=clients * 3, protocols=clients * 3, images=0)
+            front_desk, laptop = setup_pair(directory, counts, label)
+            edit(front_desk, args.changes, label)
+            manifest, _ = exchange(directory, front_desk, laptop, f"{label}_delta.zip")
+            sizes.append(manifest["rows"])
+            failures += contents(front_desk) != contents(laptop)
+        failures += sizes[0] != sizes[1]
+
+    print(f"{failures} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
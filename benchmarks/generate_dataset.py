@@ -0,0 +1,166 @@
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_search import seed as seed_clients  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+
+# a practice of a given size; every count can be overridden on the command line
+SCALES = {
+    "small": {"clients": 1000, "receipts": 5000, "protocols": 10000, "products": 40, "vendors": 30,
+              "purchases": 1000, "images": 50, "articles": 100, "faqs": 300},
+    "medium": {"clients": 100000, "receipts": 300000, "protocols": 300000, "products": 120, "vendors": 200,
+               "purchases": 30000, "images": 500, "articles": 1000, "faqs": 3000},
+    "large": {"clients": 1000000, "receipts": 3000000, "protocols": 3000000, "products": 300, "vendors": 1000,
+              "purchases": 300000, "images": 2000, "articles": 5000, "faqs": 20000},
+}
+END = date(2024, 12, 31)
+DAYS = 10 * 365
+BATCH_SIZE = 20000
+WORDS = ("sitzung malen farbe gefühl angst kind familie bild ausdruck trauer wut ruhe körper atem gruppe eltern "
+         "schule schlaf traum erinnerung vertrauen grenze stärke hoffnung ton papier kreide pinsel form linie "
+         "fläche raum stille bewegung musik rhythmus spiel heute wieder deutlich ruhiger offen müde").split()
+# 16 gray levels
+GRAY_LEVELS = bytes(value & 0xf0 for value in range(256))
+SERVICES = ("Einzelsitzung", "Gruppensitzung", "Erstgespräch", "Elterngespräch", "Materialpauschale", "Atelier")
+
+
+def _day(rng):
+    return (END - timedelta(days=rng.randrange(DAYS))).isoformat()
+
+
+def _sentence(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + "."
+
+
+def png(rng, width, height):
+    # a valid grayscale PNG with noisy rows, so scans compress like real ones do (not much)
+    rows = b"".join(b"\x00" + rng.randbytes(width).translate(GRAY_LEVELS) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b""))
+
+
+def _batches(count, make):
+    for start in range(0, count, BATCH_SIZE):
+        yield [make(i) for i in range(start, min(start + BATCH_SIZE, count))]
+
+
+def generate(database_manager, counts, seed=1, progress=print):
+    # deterministic for the same counts and seed; goes through the regular schema so all
+    # triggers (search index, report totals, knowledge base) see the data
+    rng = random.Random(seed)
+    clients = counts["clients"]
+    started = time.perf_counter()
+
+    def done(label, count):
+        progress(f"{label:<12} {count:>9,}  {time.perf_counter() - started:6.1f} s")
+
+    seed_clients(database_manager, clients)
+    done("clients", clients)
+
+    image_hashes = [database_manager.store_receipt_image(png(rng, rng.randint(200, 600), rng.randint(200, 800)))
+                    for _ in range(counts["images"])]
+    done("images", len(image_hashes))
+
+    prices = [float(rng.randrange(15, 160, 5)) for _ in range(counts["products"])]
+    with database_manager.engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO products (service, details, price) VALUES (?, ?, ?)", [
+            (f"{rng.choice(SERVICES)} {i}", _sentence(rng, 3, 8), price) for i, price in enumerate(prices)
+        ])
+        conn.exec_driver_sql("INSERT INTO vendors (name, address, email) VALUES (?, ?, ?)", [
+            (f"Lieferant {i}", f"Industriestraße {i}, Berlin", f"lieferant{i}@example.com") for i in range(counts["vendors"])
+        ])
+        conn.exec_driver_sql("INSERT INTO articles (title, body, author, published) VALUES (?, ?, ?, ?)", [
+            (_sentence(rng, 2, 6), "\n\n".join(_sentence(rng, 30, 80) for _ in range(4)), "Redaktion", _day(rng))
+            for _ in range(counts["articles"])
+        ])
+        if counts["articles"]:
+            conn.exec_driver_sql("INSERT INTO faq (article_id, question, answers) VALUES (?, ?, ?)", [
+                (rng.randint(1, counts["articles"]), _sentence(rng, 4, 10)[:-1] + "?", _sentence(rng, 15, 50))
+                for _ in range(counts["faqs"])
+            ])
+    done("reference", counts["products"] + counts["vendors"] + counts["articles"] + counts["faqs"])
+
+    lines = 0
+    for batch in _batches(counts["receipts"], lambda i: i):
+        receipts, sales = [], []
+        for i in batch:
+            items = [(rng.randrange(counts["products"]), rng.randint(1, 3)) for _ in range(rng.choice((1, 1, 2, 3)))]
+            total = round(sum(prices[product] * quantity for product, quantity in items), 2)
+            receipts.append((i + 1, rng.randint(1, clients), _day(rng), total, round(total * 0.19 / 1.19, 2),
+                             rng.choice(("bar", "karte", "überweisung")), f"Receipt #{i + 1}",
+                             image_hashes[i] if i < len(image_hashes) else None, rng.choice(("Einzel", "Gruppe", "Material"))))
+            sales.extend((i + 1, product + 1, quantity, prices[product]) for product, quantity in items)
+        with database_manager.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT INTO sales_receipts (id, customer_id, date, total_amount, tax_amount, payment_method, description, "
+                "receipt_image_hash, category) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", receipts)
+            conn.exec_driver_sql("INSERT INTO product_sales (receipt_id, product_id, quantity, price) VALUES (?, ?, ?, ?)", sales)
+        lines += len(sales)
+    done("receipts", counts["receipts"])
+    done("lines", lines)
+
+    for batch in _batches(counts["protocols"], lambda i: (rng.randint(1, clients), _sentence(rng, 20, 120), _day(rng))):
+        with database_manager.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO protocols (client_id, protocol, date) VALUES (?, ?, ?)", batch)
+    done("protocols", counts["protocols"])
+
+    def purchase(i):
+        total = float(rng.randint(5, 900))
+        return (rng.randint(1, counts["vendors"]), _day(rng), total, round(total * 0.19 / 1.19, 2),
+                rng.choice(("Material", "Miete", "Büro")))
+
+    for batch in _batches(counts["purchases"] if counts["vendors"] else 0, purchase):
+        with database_manager.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO purchase_receipts (vendor_id, date, total_amount, tax_amount, category) "
+                                 "VALUES (?, ?, ?, ?, ?)", batch)
+    done("purchases", counts["purchases"])
+
+    with database_manager.engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    # rows were written behind the ORM's back
+    database_manager.reference.invalidate()
+
+
+def counts_from(args):
+    counts = dict(SCALES[args.scale])
+    for name in counts:
+        value = getattr(args, name)
+        if value is not None:
+            counts[name] = value
+    return counts
+
+
+def add_arguments(parser):
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    for name in SCALES["small"]:
+        parser.add_argument(f"--{name}", type=int, help=f"overrides the number of {name} of the scale")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic practice database for benchmarks.")
+    parser.add_argument("path", help="database file to create, its blobs go next to it")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} exists already")
+    database_manager = DatabaseManager(f"sqlite:///{os.path.abspath(args.path)}")
+    generate(database_manager, counts_from(args), args.seed)
+    database_manager.engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from async_db import AsyncDatabase  # noqa: E402
+from database_manager import DatabaseManager  # noqa: E402
+from dialogs import SearchClientDialog, ViewClientsDialog  # noqa: E402
+from generate_dataset import add_arguments, counts_from, generate  # noqa: E402
+
+# the suite: name -> (setup(context) returning the timed call, repetitions); setup work is not timed
+SUITE = {}
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+# slower than the baseline by more than this share and more than MIN_DELTA_MS is a regression
+TOLERANCE = 0.25
+MIN_DELTA_MS = 0.5
+TIMEOUT = 30
+
+
+def benchmark(name, repeat=30):
+    def register(setup):
+        SUITE[name] = (setup, repeat)
+        return setup
+    return register
+
+
+class Context:
+    def __init__(self, app, database_manager, counts):
+        self.app = app
+        self.database_manager = database_manager
+        self.database = AsyncDatabase(database_manager)
+        self.counts = counts
+        self.added = []
+
+    def wait(self, done):
+        # runs the event loop until done() holds, like the user waiting in front of the dialog
+        deadline = time.perf_counter() + TIMEOUT
+        while not done():
+            if time.perf_counter() > deadline:
+                raise RuntimeError("Timed out waiting for the dialog")
+            self.app.processEvents()
+            time.sleep(0.0005)
+
+
+def _new_client(context, i):
+    context.database_manager.add_client("Bench", f"Mark{i}", f"bench.mark.{i}@example.com", f"+49 0 bench {i}", "Benchstraße 1")
+
+
+@benchmark("add_client")
+def add_client(context):
+    def run(i):
+        _new_client(context, i)
+        context.added.append(i)
+    return run
+
+
+@benchmark("search_clients name")
+def search_name(context):
+    names = ["anma", "lu", "ka", "mül", "stein", "ber"]
+    return lambda i: context.database_manager.search_clients(name=names[i % len(names)])
+
+
+@benchmark("search_clients email")
+def search_email(context):
+    return lambda i: context.database_manager.search_clients(email=f"{i % 9}@example")
+
+
+@benchmark("search_clients phone")
+def search_phone(context):
+    return lambda i: context.database_manager.search_clients(phone=f"+49 (0)30 000{i % 10}")
+
+
+@benchmark("get_clients_page", repeat=50)
+def clients_page(context):
+    step = max(context.counts["clients"] // 50, 1)
+    return lambda i: context.database_manager.get_clients_page(after_id=i * step)
+
+
+@benchmark("get_all_clients", repeat=5)
+def all_clients(context):
+    return lambda i: context.database_manager.get_all_clients()
+
+
+@benchmark("get_client_detail", repeat=50)
+def client_detail(context):
+    return lambda i: context.database_manager.get_client_detail(1 + i * 7 % context.counts["clients"])
+
+
+@benchmark("delete_client")
+def delete_client(context):
+    # the clients add_client created, or fresh ones when it was skipped
+    database_manager = context.database_manager
+    emails = [f"bench.mark.{i}@example.com" for i in context.added]
+    if not emails:
+        for i in range(SUITE["delete_client"][1]):
+            _new_client(context, 100000 + i)
+            emails.append(f"bench.mark.{100000 + i}@example.com")
+    ids = [database_manager.search_clients(email=email)[0].id for email in emails]
+    return lambda i: database_manager.delete_client(ids[i])
+
+
+@benchmark("create_receipt")
+def create_receipt(context):
+    products = context.counts["products"]
+    return lambda i: context.database_manager.create_receipt(
+        1 + i % context.counts["clients"], [(1 + i % products, 1), (1 + (i * 3) % products, 2)], date(2024, 6, 1))
+
+
+@benchmark("create_receipts 50", repeat=10)
+def create_receipts(context):
+    products = context.counts["products"]
+    return lambda i: context.database_manager.create_receipts(
+        {"client_id": 1 + (i * 50 + j) % context.counts["clients"], "date": date(2024, 6, 1),
+         "lines": [(1 + j % products, 1)]} for j in range(50))
+
+
+@benchmark("ViewClientsDialog first page", repeat=15)
+def view_clients(context):
+    def run(i):
+        dialog = ViewClientsDialog(context.database)
+        dialog.show()
+        context.wait(lambda: dialog.model.rows and not dialog.model.fetching)
+        context.app.processEvents()
+        dialog.close()
+        dialog.deleteLater()
+    return run
+
+
+@benchmark("SearchClientDialog results", repeat=15)
+def search_dialog(context):
+    names = ["anma", "lu", "ka", "mül", "stein", "ber"]
+
+    def run(i):
+        dialog = SearchClientDialog(context.database)
+        dialog.show()
+        dialog.name_input.setText(names[i % len(names)])
+        dialog.perform_search()
+        context.wait(lambda: dialog.pending_request is None)
+        context.app.processEvents()
+        dialog.close()
+        dialog.deleteLater()
+    return run
+
+
+def run_suite(context, selected):
+    results = {}
+    for name, (setup, repeat) in SUITE.items():
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        call = setup(context)
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            call(i)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = {"median_ms": round(timings[len(timings) // 2], 3),
+                         "p95_ms": round(timings[max(int(len(timings) * 0.95) - 1, 0)], 3), "repeat": repeat}
+        print(f"{name:<32} median {results[name]['median_ms']:9.2f} ms   p95 {results[name]['p95_ms']:9.2f} ms")
+    return results
+
+
+def machine():
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def compare(results, baseline):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        limit = previous["median_ms"] * (1 + TOLERANCE)
+        if result["median_ms"] > limit and result["median_ms"] - previous["median_ms"] > MIN_DELTA_MS:
+            regressions.append(f"{name}: {result['median_ms']:.2f} ms, baseline {previous['median_ms']:.2f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite with stored baselines.")
+    add_arguments(parser)
+    parser.add_argument("--dataset", help="database made by generate_dataset.py with the same scale, used on a copy")
+    parser.add_argument("--only", nargs="*", default=[], help="run benchmarks whose name contains one of these")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline of the scale")
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    counts = counts_from(args)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        if args.dataset:
+            shutil.copyfile(args.dataset, path)
+            blob_dir = os.path.splitext(os.path.abspath(args.dataset))[0] + "_blobs"
+            database_manager = DatabaseManager(f"sqlite:///{path}", blob_dir=blob_dir)
+        else:
+            database_manager = DatabaseManager(f"sqlite:///{path}")
+            generate(database_manager, counts, args.seed)
+
+        context = Context(app, database_manager, counts)
+        results = run_suite(context, args.only)
+        context.database.wait()
+        database_manager.engine.dispose()
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, encoding="utf-8") as f:
+            baselines = json.load(f)
+    key = f"{args.scale}-seed{args.seed}"
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"dataset": key, "machine": machine(), "results": results}, f, indent=2)
+
+    if args.save_baseline:
+        baseline = baselines.setdefault(key, {"results": {}})
+        baseline["machine"] = machine()
+        baseline["recorded"] = time.strftime("%Y-%m-%d")
+        baseline["results"].update(results)
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline {key} saved to {args.baselines}")
+        return 0
+
+    if key not in baselines:
+        print(f"no baseline for {key}, record one with --save-baseline")
+        return 0
+    if baselines[key].get("machine") != machine():
+        print(f"note: the baseline was recorded on {baselines[key].get('machine')}")
+    regressions = compare(results, baselines[key])
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions against baseline {key}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
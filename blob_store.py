@@ -0,0 +1,132 @@
+import argparse
+import hashlib
+import mmap
+import os
+import sys
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    # content-addressed files: <root>/<first two hex digits>/<rest of the sha256>,
+    # identical images are stored once
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def put(self, data):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            digest = hashlib.sha256(data).hexdigest()
+            if not self.exists(digest):
+                self._write(digest, [data])
+            return digest
+        return self.put_stream(data)
+
+    def put_file(self, path):
+        with open(path, "rb") as handle:
+            return self.put_stream(handle)
+
+    def put_stream(self, stream):
+        # hash while copying into a temp file, so large scans are never held in memory
+        hasher = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix=".incoming-")
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+                    temp.write(chunk)
+            digest = hasher.hexdigest()
+            if self.exists(digest):
+                os.remove(temp_path)
+            else:
+                self._publish(temp_path, digest)
+            return digest
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _write(self, digest, chunks):
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix=".incoming-")
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in chunks:
+                    temp.write(chunk)
+            self._publish(temp_path, digest)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _publish(self, temp_path, digest):
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # atomic, readers never see a half written file
+        os.replace(temp_path, path)
+
+    def open(self, digest):
+        return open(self.path_for(digest), "rb")
+
+    def map(self, digest):
+        # read-only memory map, pages are loaded on access and nothing is copied
+        with self.open(digest) as handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                return memoryview(b"")
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, digest):
+        with self.open(digest) as handle:
+            return handle.read()
+
+
+def default_blob_dir(database):
+    # sibling directory of the database file, e.g. PrimalArtDB.db -> PrimalArtDB_blobs
+    if database in (None, "", ":memory:"):
+        return tempfile.mkdtemp(prefix="primalart-blobs-")
+    return os.path.splitext(os.path.abspath(database))[0] + "_blobs"
+
+
+def move_inline_images(conn, blob_store, table, ids):
+    # moves the inline receipt_image BLOBs of the given rows into the blob store,
+    # used by the batched backfill in migrations.py
+    rows = conn.exec_driver_sql(
+        f"SELECT id, receipt_image FROM {table} WHERE receipt_image IS NOT NULL "
+        f"AND id IN ({', '.join('?' for _ in ids)})", tuple(ids)
+    ).all()
+    for receipt_id, image in rows:
+        conn.exec_driver_sql(
+            f"UPDATE {table} SET receipt_image_hash = ?, receipt_image = NULL WHERE id = ?",
+            (blob_store.put(image), receipt_id)
+        )
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receipt image blob store maintenance.")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--vacuum", action="store_true", help="reclaim the freed space afterwards")
+    args = parser.parse_args(argv)
+
+    from database_manager import DatabaseManager
+
+    # moving the images is a migration, opening the database applies it
+    database_manager = DatabaseManager(
+        args.db, progress=lambda label, done, total: print(f"{label}: {done}/{total}", end="\r")
+    )
+    print(f"\nreceipt images are in {database_manager.blob_store.root}")
+    if args.vacuum:
+        with database_manager.engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
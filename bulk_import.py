@@ -0,0 +1,222 @@
+import argparse
+import csv
+import sys
+import time
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database_manager import DatabaseManager, Client, SalesReceipt, parse_date, parse_amount
+
+DEFAULT_BATCH_SIZE = 5000
+
+CLIENT_REQUIRED = ("first_name", "last_name", "email", "phone_number", "address")
+CLIENT_OPTIONAL = ("notes",)
+RECEIPT_REQUIRED = ("customer_id", "date", "total_amount")
+RECEIPT_OPTIONAL = ("tax_amount", "payment_method", "description", "category", "notes")
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.rejected = []
+        self.seconds = 0.0
+
+    def reject(self, line, reason):
+        self.rejected.append((line, reason))
+
+    @property
+    def rows_per_second(self):
+        total = self.inserted + len(self.rejected)
+        return total / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.inserted} rows inserted, {len(self.rejected)} rejected "
+                f"in {self.seconds:.2f} s ({self.rows_per_second:,.0f} rows/s)")
+
+
+def read_chunks(path, fields, required, batch_size=DEFAULT_BATCH_SIZE):
+    # streams chunks of (line number, dict of stripped values) limited to the given fields;
+    # spreadsheet exports use either ',' or ';'
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        sample = handle.read(4096)
+        handle.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(handle, dialect)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [field for field in required if field not in header]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        positions = [(field, header.index(field)) for field in fields if field in header]
+        width = len(header)
+
+        chunk = []
+        for record in reader:
+            if len(record) < width:
+                record += [""] * (width - len(record))
+            chunk.append((reader.line_num, {field: record[index].strip() or None for field, index in positions}))
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _check_required(values, required):
+    for field in required:
+        if values.get(field) is None:
+            raise ValueError(f"Missing {field}")
+
+
+class BulkImporter:
+    # inserts rows with one executemany per batch and one transaction per batch,
+    # rejected rows are reported instead of aborting the load
+    def __init__(self, database_manager, batch_size=DEFAULT_BATCH_SIZE):
+        self.engine = database_manager.engine
+        self.search_index = database_manager.search_index
+        self.batch_size = batch_size
+
+    def import_clients(self, path):
+        report = ImportReport()
+        start = time.perf_counter()
+        seen_emails = set()
+        seen_phones = set()
+
+        def screen(conn, batch):
+            emails = self._existing(conn, Client.email, [values["email"] for _, values in batch])
+            phones = self._existing(conn, Client.phone_number, [values["phone_number"] for _, values in batch])
+            accepted = []
+            for line, values in batch:
+                if values["email"] in emails or values["email"] in seen_emails:
+                    report.reject(line, f"Duplicate email {values['email']}")
+                elif values["phone_number"] in phones or values["phone_number"] in seen_phones:
+                    report.reject(line, f"Duplicate phone number {values['phone_number']}")
+                else:
+                    seen_emails.add(values["email"])
+                    seen_phones.add(values["phone_number"])
+                    accepted.append((line, values))
+            return accepted
+
+        with self.search_index.suspended():
+            for chunk in read_chunks(path, CLIENT_REQUIRED + CLIENT_OPTIONAL, CLIENT_REQUIRED, self.batch_size):
+                batch = []
+                for line, values in chunk:
+                    try:
+                        _check_required(values, CLIENT_REQUIRED)
+                        batch.append((line, values))
+                    except ValueError as e:
+                        report.reject(line, str(e))
+
+                self._load(Client.__table__, batch, report, screen)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def import_receipts(self, path):
+        report = ImportReport()
+        start = time.perf_counter()
+
+        def screen(conn, batch):
+            customers = self._existing(conn, Client.id, [values["customer_id"] for _, values in batch])
+            accepted = []
+            for line, values in batch:
+                if values["customer_id"] in customers:
+                    accepted.append((line, values))
+                else:
+                    report.reject(line, f"Unknown client id {values['customer_id']}")
+            return accepted
+
+        for chunk in read_chunks(path, RECEIPT_REQUIRED + RECEIPT_OPTIONAL, RECEIPT_REQUIRED, self.batch_size):
+            batch = []
+            for line, values in chunk:
+                try:
+                    _check_required(values, RECEIPT_REQUIRED)
+                    values["customer_id"] = int(values["customer_id"])
+                    # stored the way SQLAlchemy's sqlite Date type stores it
+                    values["date"] = parse_date(values["date"]).isoformat()
+                    values["total_amount"] = parse_amount(values["total_amount"])
+                    # optional column, absent from some exports
+                    values["tax_amount"] = values.get("tax_amount")
+                    if values["tax_amount"] is not None:
+                        values["tax_amount"] = parse_amount(values["tax_amount"])
+                    batch.append((line, values))
+                except ValueError as e:
+                    report.reject(line, str(e))
+
+            self._load(SalesReceipt.__table__, batch, report, screen)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def _existing(self, conn, column, values):
+        found = set()
+        values = list(set(values))
+        # stay below SQLite's bound parameter limit
+        for start in range(0, len(values), 500):
+            found.update(conn.execute(select(column).where(column.in_(values[start:start + 500]))).scalars())
+        return found
+
+    def _load(self, table, batch, report, screen):
+        # screening and the executemany share one transaction per batch
+        accepted = []
+        try:
+            with self.engine.begin() as conn:
+                accepted = screen(conn, batch)
+                if accepted:
+                    # plain DBAPI executemany, the values are already in their storage format
+                    sql, columns = self._insert_sql(table, accepted[0][1])
+                    conn.exec_driver_sql(sql, [tuple(values[column] for column in columns) for _, values in accepted])
+            report.inserted += len(accepted)
+        except IntegrityError:
+            # conflicting rows were written meanwhile, retry row by row to isolate them
+            for line, values in accepted:
+                try:
+                    with self.engine.begin() as conn:
+                        sql, columns = self._insert_sql(table, values)
+                        conn.exec_driver_sql(sql, tuple(values[column] for column in columns))
+                    report.inserted += 1
+                except IntegrityError as e:
+                    report.reject(line, str(e.orig))
+
+    def _insert_sql(self, table, values):
+        columns = [column.name for column in table.columns if column.name in values]
+        sql = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+        return sql, columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import clients or sales receipts from a CSV export.")
+    parser.add_argument("kind", choices=["clients", "receipts"])
+    parser.add_argument("path")
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--rejects", help="write rejected rows (line, reason) to this CSV file")
+    args = parser.parse_args(argv)
+
+    try:
+        importer = BulkImporter(DatabaseManager(args.db), args.batch_size)
+        if args.kind == "clients":
+            report = importer.import_clients(args.path)
+        else:
+            report = importer.import_receipts(args.path)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        return 1
+
+    print(report)
+    if args.rejects:
+        with open(args.rejects, "w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(["line", "reason"])
+            writer.writerows(report.rejected)
+    else:
+        for line, reason in report.rejected[:20]:
+            print(f"  line {line}: {reason}", file=sys.stderr)
+        if len(report.rejected) > 20:
+            print(f"  ... {len(report.rejected) - 20} more, use --rejects to write them all", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import re
+import unicodedata
+from contextlib import contextmanager
+
+from sqlalchemy import bindparam, event, text
+
+# characters stripped from phone numbers, shared by the SQL triggers and the python side
+PHONE_SEPARATORS = " -/().+"
+
+DEFAULT_LIMIT = 50
+
+# dropped while a bulk load runs, see ClientSearchIndex.suspended
+TRIGGERS = ("clients_search_ai", "clients_search_au", "clients_search_ad")
+
+# bm25 is evaluated per matching row, so broad prefixes are returned unranked
+RANK_THRESHOLD = 2000
+
+
+def normalize_phone(phone):
+    return "".join(ch for ch in (phone or "") if ch not in PHONE_SEPARATORS)
+
+
+def normalize_email(email):
+    return (email or "").lower()
+
+
+def _fold_case(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def register_functions(dbapi_connection, connection_record=None):
+    # SQLite's own lower() folds ASCII only: a stored ÄRZTE@ would be keyed Ärzte@ while
+    # normalize_email looks up ärzte@. Our connections use str.lower() instead.
+    dbapi_connection.create_function("lower", 1, _fold_case, deterministic=True)
+
+
+def _sql_normalize_phone(expression):
+    for ch in PHONE_SEPARATORS:
+        expression = f"replace({expression}, '{ch}', '')"
+    return expression
+
+
+def search_tokens(value):
+    # mirrors the unicode61 tokenizer with remove_diacritics
+    value = unicodedata.normalize("NFKD", value or "")
+    value = "".join(ch for ch in value if not unicodedata.combining(ch))
+    return re.findall(r"\w+", value.lower())
+
+
+def prefix_query(terms):
+    # FTS5 query matching rows that contain every term as a word prefix
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _prefix_after(prefix):
+    # smallest string greater than every string starting with prefix
+    return prefix + "\U0010ffff"
+
+
+def matches(row, name=None, email=None, phone=None):
+    # python equivalent of the index lookup, used to narrow previous results
+    if name:
+        row_tokens = search_tokens(row.first_name) + search_tokens(row.last_name)
+        for term in search_tokens(name):
+            if not any(token.startswith(term) for token in row_tokens):
+                return False
+    if email and not normalize_email(row.email).startswith(normalize_email(email)):
+        return False
+    if phone and not normalize_phone(row.phone_number).startswith(normalize_phone(phone)):
+        return False
+    return True
+
+
+def refines(previous, current):
+    # True when every (name, email, phone) term of current extends the previous one,
+    # i.e. current can only match a subset of what previous matched
+    (old_name, old_email, old_phone), (name, email, phone) = previous, current
+    return (
+        (name or "").lower().startswith((old_name or "").lower())
+        and normalize_email(email).startswith(normalize_email(old_email))
+        and normalize_phone(phone).startswith(normalize_phone(old_phone))
+    )
+
+
+class ClientSearchIndex:
+    # FTS5 index over client names plus indexed lower-cased email and digits-only phone keys,
+    # kept in sync with the clients table through triggers
+    def __init__(self, engine):
+        self.engine = engine
+        self.available = False
+        event.listen(engine, "connect", register_functions)
+
+    def install(self):
+        with self.engine.begin() as conn:
+            if not self._fts5_supported(conn):
+                return False
+            created = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'clients_fts'"
+            )).first() is None
+            for statement in self.ddl():
+                conn.execute(text(statement))
+            # keys written with SQLite's ASCII-only lower() by an older version are redone
+            if created or conn.execute(text(
+                "SELECT 1 FROM client_search_keys k JOIN clients c ON c.id = k.client_id "
+                "WHERE k.email_lower IS NOT lower(c.email) LIMIT 1"
+            )).first() is not None:
+                self._rebuild(conn)
+        self.available = True
+        return True
+
+    def check_installed(self):
+        # used when the schema is known to be current and install() is skipped; a bulk load
+        # that was killed leaves the triggers dropped, they are put back and the index rebuilt
+        names = ("clients_fts",) + TRIGGERS
+        with self.engine.connect() as conn:
+            found = {name for name, in conn.execute(
+                text("SELECT name FROM sqlite_master WHERE name IN :names").bindparams(bindparam("names", expanding=True)),
+                {"names": list(names)}
+            )}
+        self.available = "clients_fts" in found
+        if self.available and not found.issuperset(TRIGGERS):
+            self._restore()
+        return self.available
+
+    def rebuild(self):
+        with self.engine.begin() as conn:
+            self._rebuild(conn)
+
+    @contextmanager
+    def suspended(self):
+        # for bulk loads: per-row trigger maintenance is far slower than one rebuild afterwards
+        if not self.available:
+            yield
+            return
+        with self.engine.begin() as conn:
+            for trigger in TRIGGERS:
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        try:
+            yield
+        finally:
+            self._restore()
+
+    def _restore(self):
+        with self.engine.begin() as conn:
+            for statement in self.ddl():
+                conn.execute(text(statement))
+            self._rebuild(conn)
+
+    def _fts5_supported(self, conn):
+        options = [row[0] for row in conn.execute(text("PRAGMA compile_options"))]
+        return "ENABLE_FTS5" in options
+
+    def ddl(self):
+        phone_new = _sql_normalize_phone("new.phone_number")
+        return [
+            """CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(
+                first_name, last_name,
+                content='clients', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+            )""",
+            """CREATE TABLE IF NOT EXISTS client_search_keys (
+                client_id INTEGER PRIMARY KEY,
+                email_lower TEXT,
+                phone_digits TEXT
+            )""",
+            "CREATE INDEX IF NOT EXISTS ix_client_search_keys_email ON client_search_keys(email_lower)",
+            "CREATE INDEX IF NOT EXISTS ix_client_search_keys_phone ON client_search_keys(phone_digits)",
+            f"""CREATE TRIGGER IF NOT EXISTS clients_search_ai AFTER INSERT ON clients BEGIN
+                -- lower() folds unicode, see register_functions
+                INSERT INTO clients_fts(rowid, first_name, last_name)
+                VALUES (new.id, new.first_name, new.last_name);
+                INSERT INTO client_search_keys(client_id, email_lower, phone_digits)
+                VALUES (new.id, lower(new.email), {phone_new});
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS clients_search_ad AFTER DELETE ON clients BEGIN
+                INSERT INTO clients_fts(clients_fts, rowid, first_name, last_name)
+                VALUES ('delete', old.id, old.first_name, old.last_name);
+                DELETE FROM client_search_keys WHERE client_id = old.id;
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS clients_search_au AFTER UPDATE ON clients BEGIN
+                INSERT INTO clients_fts(clients_fts, rowid, first_name, last_name)
+                VALUES ('delete', old.id, old.first_name, old.last_name);
+                INSERT INTO clients_fts(rowid, first_name, last_name)
+                VALUES (new.id, new.first_name, new.last_name);
+                INSERT OR REPLACE INTO client_search_keys(client_id, email_lower, phone_digits)
+                VALUES (new.id, lower(new.email), {phone_new});
+            END""",
+        ]
+
+    def _rebuild(self, conn):
+        conn.execute(text("INSERT INTO clients_fts(clients_fts) VALUES ('rebuild')"))
+        conn.execute(text("DELETE FROM client_search_keys"))
+        conn.execute(text(
+            "INSERT INTO client_search_keys(client_id, email_lower, phone_digits) "
+            f"SELECT id, lower(email), {_sql_normalize_phone('phone_number')} FROM clients"
+        ))
+
+    def search(self, conn, name=None, email=None, phone=None, limit=DEFAULT_LIMIT):
+        # returns ids ordered by relevance when a name is given, otherwise in index order
+        params = {"limit": limit}
+        where = []
+        order = []
+        if email:
+            params["email_lo"] = normalize_email(email)
+            params["email_hi"] = _prefix_after(params["email_lo"])
+            where.append("k.email_lower >= :email_lo AND k.email_lower < :email_hi")
+            order.append("k.email_lower")
+        if phone:
+            params["phone_lo"] = normalize_phone(phone)
+            params["phone_hi"] = _prefix_after(params["phone_lo"])
+            where.append("k.phone_digits >= :phone_lo AND k.phone_digits < :phone_hi")
+            order.append("k.phone_digits")
+
+        terms = search_tokens(name)
+        if not terms:
+            if where:
+                sql = f"SELECT k.client_id FROM client_search_keys k WHERE {' AND '.join(where)} ORDER BY {order[0]}"
+            else:
+                sql = "SELECT id FROM clients ORDER BY id"
+            return [row[0] for row in conn.execute(text(sql + " LIMIT :limit"), params)]
+
+        params["match"] = prefix_query(terms)
+        params["threshold"] = RANK_THRESHOLD + 1
+        broad = conn.execute(text(
+            "SELECT count(*) FROM (SELECT rowid FROM clients_fts WHERE clients_fts MATCH :match LIMIT :threshold)"
+        ), params).scalar() > RANK_THRESHOLD
+
+        if not broad:
+            sql = (
+                "SELECT f.rowid FROM clients_fts f JOIN client_search_keys k ON k.client_id = f.rowid "
+                "WHERE f.clients_fts MATCH :match"
+                + "".join(f" AND {clause}" for clause in where)
+                + " ORDER BY f.rank"
+            )
+        elif where:
+            # broad name prefix: let the email/phone range drive and filter by the match set
+            sql = (
+                f"SELECT k.client_id FROM client_search_keys k WHERE {' AND '.join(where)} "
+                "AND k.client_id IN (SELECT rowid FROM clients_fts WHERE clients_fts MATCH :match)"
+            )
+        else:
+            sql = "SELECT rowid FROM clients_fts WHERE clients_fts MATCH :match"
+        return [row[0] for row in conn.execute(text(sql + " LIMIT :limit"), params)]
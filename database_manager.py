@@ -1,12 +1,35 @@
-from sqlalchemy import create_engine, BLOB, Column, Integer, String, Float, Date, ForeignKey
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import create_engine, event, BLOB, Column, Integer, String, Float, Date, ForeignKey, Index, func
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred, selectinload
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from backup import BackupManager, default_backup_dir
+from blob_store import BlobStore, default_blob_dir
+from client_search import ClientSearchIndex, DEFAULT_LIMIT as SEARCH_LIMIT
+from duplicates import DuplicateIndex, REPORT_THRESHOLD
+from instrumentation import metrics
+from knowledge_base import KnowledgeBase
+from migrations import Migrator, head as migration_head
+from protocol_timeline import ProtocolTimeline
+from reference_cache import ReferenceCache
+from reporting import ReportingEngine
+from sync import SyncLog
 
 Base = declarative_base()
 
 
 class Articles(Base):
     __tablename__ = 'articles'
+    __table_args__ = (
+        Index("ix_articles_published", "published"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String)
@@ -18,6 +41,9 @@ class Articles(Base):
 
 class FAQ(Base):
     __tablename__ = 'faq'
+    __table_args__ = (
+        Index("ix_faq_article_id", "article_id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     article_id = Column(Integer, ForeignKey('articles.id'))
@@ -35,16 +61,24 @@ class Client(Base):
     phone_number = Column(String, unique=True, nullable=False)
     address = Column(String, nullable=False)
     notes = Column(String)
+    # receipts are bookkeeping records and block the delete, protocols go with the client
     receipts = relationship("SalesReceipt", backref="client")
+    protocols = relationship("Protocols", cascade="all, delete-orphan")
 
 
 class Protocols(Base):
     __tablename__ = 'protocols'
+    __table_args__ = (
+        Index("ix_protocols_client_date", "client_id", "date"),
+        Index("ix_protocols_date", "date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     client_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
-    protcol = Column(String)
+    protocol = Column(String)
     date = Column(Date)
+    # zlib-compressed note of an old entry, protocol is NULL then; see protocol_timeline.py
+    protocol_compressed = deferred(Column(BLOB))
 
 
 class Products(Base):
@@ -58,6 +92,10 @@ class Products(Base):
 
 class ProductSales(Base):
     __tablename__ = 'product_sales'
+    __table_args__ = (
+        Index("ix_product_sales_receipt_id", "receipt_id"),
+        Index("ix_product_sales_product_id", "product_id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     receipt_id = Column(Integer, ForeignKey('sales_receipts.id'), nullable=False)
@@ -68,6 +106,10 @@ class ProductSales(Base):
 
 class SalesReceipt(Base):
     __tablename__ = 'sales_receipts'
+    __table_args__ = (
+        Index("ix_sales_receipts_customer_date", "customer_id", "date"),
+        Index("ix_sales_receipts_date", "date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     customer_id = Column(Integer, ForeignKey('clients.id'), nullable=False)
@@ -76,7 +118,9 @@ class SalesReceipt(Base):
     tax_amount = Column(Float)
     payment_method = Column(String)
     description = Column(String)
-    receipt_image = Column(BLOB)
+    # legacy inline image, moved to the blob store by migration 3 and never loaded by default
+    receipt_image = deferred(Column(BLOB))
+    receipt_image_hash = Column(String(64))
     category = Column(String)
     notes = Column(String)
     products = relationship("ProductSales", backref="receipt")
@@ -96,6 +140,10 @@ class Vendors(Base):
 
 class PurchaseReceipts(Base):
     __tablename__ = 'purchase_receipts'
+    __table_args__ = (
+        Index("ix_purchase_receipts_vendor_date", "vendor_id", "date"),
+        Index("ix_purchase_receipts_date", "date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     vendor_id = Column(Integer, ForeignKey('vendors.id'), nullable=False)
@@ -104,107 +152,550 @@ class PurchaseReceipts(Base):
     tax_amount = Column(Float)
     payment_method = Column(String)
     description = Column(String)
-    receipt_image = Column(BLOB)
+    # legacy inline image, moved to the blob store by migration 3 and never loaded by default
+    receipt_image = deferred(Column(BLOB))
+    receipt_image_hash = Column(String(64))
     category = Column(String)
     notes = Column(String)
 
 
+def parse_date(value):
+    # accepts ISO dates and the German dd.mm.yyyy format used by our exports
+    if isinstance(value, date):
+        return value
+    value = (value or "").strip()
+    try:
+        if "." in value:
+            day, month, year = value.split(".")
+            return date(int(year), int(month), int(day))
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r}")
+
+
+def parse_amount(value):
+    # accepts 12.50 as well as 12,50
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = (value or "").strip()
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Invalid amount: {value!r}")
+
+
+# lightweight row used by list views instead of full ORM objects
+ClientRow = namedtuple("ClientRow", ["id", "first_name", "last_name", "email", "phone_number", "address", "notes"])
+
+CLIENT_ROW_COLUMNS = (
+    Client.id, Client.first_name, Client.last_name, Client.email,
+    Client.phone_number, Client.address, Client.notes
+)
+
+ReceiptRow = namedtuple("ReceiptRow", ["id", "date", "total_amount", "tax_amount", "payment_method", "category", "description", "receipt_image_hash"])
+
+RECEIPT_ROW_COLUMNS = (
+    SalesReceipt.id, SalesReceipt.date, SalesReceipt.total_amount, SalesReceipt.tax_amount,
+    SalesReceipt.payment_method, SalesReceipt.category, SalesReceipt.description, SalesReceipt.receipt_image_hash
+)
+
+ProductRow = namedtuple("ProductRow", ["id", "service", "details", "price"])
+
+VendorRow = namedtuple("VendorRow", ["id", "name", "address", "contact_person", "contact_number", "email", "notes"])
+
+# prices are gross, the VAT contained in a receipt total is derived from it
+def vat_included(total, rate):
+    return round(total * rate / (1 + rate), 2)
+
+
+def receipt_tax(total, tax_amount=None, vat_rate=None):
+    # the tax amount as given, else derived from the given rate (0.19 for 19 %); receipts
+    # without either have no tax amount, many treatments are VAT exempt
+    if tax_amount is not None:
+        return parse_amount(tax_amount)
+    if vat_rate is not None:
+        rate = parse_amount(vat_rate)
+        if not 0 <= rate < 1:
+            raise ValueError(f"Invalid VAT rate: {vat_rate!r}")
+        return vat_included(total, rate)
+    return None
+
+
+# client -> receipts -> product lines in three queries, whatever the number of receipts;
+# selectinload rather than joinedload so the client row is not repeated per line item
+CLIENT_DETAIL_OPTIONS = (
+    selectinload(Client.receipts).selectinload(SalesReceipt.products),
+)
+
+
+class EngineProfile:
+    # connection settings applied to every pooled SQLite connection
+    default_pragmas = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "foreign_keys": "ON",
+        "temp_store": "MEMORY",
+        "cache_size": -64000,  # negative means KiB, so ~64 MB
+        "mmap_size": 256 * 1024 * 1024,
+        "busy_timeout": 5000,
+    }
+
+    def __init__(self, pragmas=None, pool_size=5, max_overflow=5, pool_timeout=30, cached_statements=256):
+        self.pragmas = dict(self.default_pragmas)
+        self.pragmas.update(pragmas or {})
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.cached_statements = cached_statements
+
+    def create_engine(self, db_url):
+        url = make_url(db_url)
+        if not url.drivername.startswith("sqlite"):
+            return create_engine(db_url, pool_size=self.pool_size, max_overflow=self.max_overflow,
+                                 pool_timeout=self.pool_timeout)
+
+        connect_args = {
+            # connections are handed between the GUI thread and background workers by the pool
+            "check_same_thread": False,
+            # per-connection prepared statement cache, kept alive by pooling
+            "cached_statements": self.cached_statements,
+        }
+        if url.database in (None, "", ":memory:"):
+            # a private in-memory database only exists on its one connection
+            engine = create_engine(db_url, connect_args=connect_args, poolclass=StaticPool)
+        else:
+            engine = create_engine(db_url, connect_args=connect_args, poolclass=QueuePool,
+                                   pool_size=self.pool_size, max_overflow=self.max_overflow,
+                                   pool_timeout=self.pool_timeout)
+        event.listen(engine, "connect", self._apply_pragmas)
+        return engine
+
+    def _apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self.pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+
+@metrics.instrument_class("database")
 class DatabaseManager:
-    def __init__(self, db_url):
-        self.engine = create_engine(db_url)
-        self.Session = sessionmaker(bind=self.engine)
-        self.__initialize_database()
+    def __init__(self, db_url, profile=None, blob_dir=None, progress=None, backup_dir=None):
+        self.profile = profile or EngineProfile()
+        self.engine = self.profile.create_engine(db_url)
+        # SQL latency and statement counts per operation, see the diagnostics dialog
+        metrics.attach(self.engine)
+        self.blob_store = BlobStore(blob_dir or default_blob_dir(self.engine.url.database))
+        database = self.engine.url.database
+        # online backups of the database file and its images, see backup.py
+        self.backups = (BackupManager(database, self.blob_store, backup_dir or default_backup_dir(database))
+                        if database not in (None, "", ":memory:") else None)
+        # returned objects stay readable after commit, they are detached by session_scope
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.search_index = ClientSearchIndex(self.engine)
+        self.duplicates = DuplicateIndex(self.engine)
+        self.reports = ReportingEngine(self.engine)
+        self.knowledge_base = KnowledgeBase(self.engine)
+        self.protocols = ProtocolTimeline(self.engine)
+        self.reference = ReferenceCache(self.Session)
+        self.reference.register("products", Products, lambda session: tuple(
+            ProductRow(*row) for row in session.query(Products.id, Products.service, Products.details, Products.price)
+            .order_by(Products.service, Products.id)
+        ))
+        self.reference.register("vendors", Vendors, lambda session: tuple(
+            VendorRow(*row) for row in session.query(Vendors.id, Vendors.name, Vendors.address, Vendors.contact_person,
+                                                     Vendors.contact_number, Vendors.email, Vendors.notes)
+            .order_by(Vendors.name, Vendors.id)
+        ))
+        self.sync = SyncLog(self.engine, Base.metadata, self.blob_store)
+        self.migrator = Migrator(self.engine, Base.metadata, self.blob_store, progress=progress)
+        with metrics.timed("database", "DatabaseManager.open"):
+            self.__initialize_database()
 
     def __initialize_database(self):
         try:
-            Base.metadata.create_all(self.engine)
+            # PRAGMA user_version caches a fingerprint of the schema this code expects,
+            # when it matches the table reflection and DDL below can be skipped
+            fingerprint = self.schema_fingerprint()
+            with self.engine.connect() as conn:
+                if conn.exec_driver_sql("PRAGMA user_version").scalar() == fingerprint:
+                    self.search_index.check_installed()
+                    self.knowledge_base.check_installed()
+                    return
+
+            self.migrator.upgrade()
+            self.search_index.install()
+            self.duplicates.install()
+            self.reports.install()
+            self.knowledge_base.install()
+            self.protocols.install()
+            self.sync.install()
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f"PRAGMA user_version = {fingerprint}")
         except Exception as e:
             raise RuntimeError(f"Database initialization failed: {e}")
 
-    def add_client(self, first_name, last_name, email, phone_number, address, notes=None):
+    def schema_fingerprint(self):
+        dialect = self.engine.dialect
+        parts = []
+        for table in Base.metadata.sorted_tables:
+            parts.append(str(CreateTable(table).compile(dialect=dialect)))
+            parts.extend(str(CreateIndex(index).compile(dialect=dialect)) for index in table.indexes)
+        parts.extend(self.search_index.ddl())
+        parts.extend(self.duplicates.ddl())
+        parts.extend(self.reports.ddl())
+        parts.extend(self.knowledge_base.ddl())
+        parts.extend(self.protocols.ddl())
+        parts.extend(self.sync.ddl())
+        parts.append(f"migration {migration_head()}")
+        # user_version is a signed 32 bit integer, 0 means never initialized
+        return zlib.crc32("\n".join(parts).encode("utf-8")) & 0x7fffffff or 1
+
+    @contextmanager
+    def session_scope(self):
         session = self.Session()
         try:
-            client = Client(
-                first_name=first_name,
-                last_name=last_name,
-                email=email,
-                phone_number=phone_number,
-                address=address,
-                notes=notes
-            )
-            session.add(client)
+            yield session
             session.commit()
-        except Exception as e:
+        except Exception:
             session.rollback()
-            raise RuntimeError(f"Failed to add client: {e}")
+            raise
         finally:
             session.close()
 
-    def search_clients(self, name=None, email=None, phone=None):
-        session = self.Session()
+    def add_client(self, first_name, last_name, email, phone_number, address, notes=None):
         try:
-            query = session.query(Client)
-            if name:
-                query = query.filter((Client.first_name.like(f"%{name}%")) | (Client.last_name.like(f"%{name}%")))
-            if email:
-                query = query.filter(Client.email.like(f"%{email}%"))
-            if phone:
-                query = query.filter(Client.phone_number.like(f"%{phone}%"))
-            return query.all()
+            with self.session_scope() as session:
+                session.add(Client(
+                    first_name=first_name,
+                    last_name=last_name,
+                    email=email,
+                    phone_number=phone_number,
+                    address=address,
+                    notes=notes
+                ))
+        except Exception as e:
+            raise RuntimeError(f"Failed to add client: {e}")
+
+    def search_clients(self, name=None, email=None, phone=None, limit=SEARCH_LIMIT):
+        try:
+            with self.session_scope() as session:
+                if not self.search_index.available:
+                    return self.__scan_clients(session, name, email, phone, limit)
+                ids = self.search_index.search(session.connection(), name, email, phone, limit)
+                if not ids:
+                    return []
+                rows = {row.id: ClientRow(*row) for row in session.query(*CLIENT_ROW_COLUMNS).filter(Client.id.in_(ids))}
+                return [rows[client_id] for client_id in ids if client_id in rows]
         except Exception as e:
             raise RuntimeError(f"Failed to search clients: {e}")
-        finally:
-            session.close()
+
+    def __scan_clients(self, session, name, email, phone, limit):
+        # fallback for sqlite builds without FTS5
+        query = session.query(*CLIENT_ROW_COLUMNS)
+        if name:
+            query = query.filter((Client.first_name.like(f"%{name}%")) | (Client.last_name.like(f"%{name}%")))
+        if email:
+            query = query.filter(Client.email.like(f"%{email}%"))
+        if phone:
+            query = query.filter(Client.phone_number.like(f"%{phone}%"))
+        return [ClientRow(*row) for row in query.order_by(Client.id).limit(limit)]
 
     def delete_client(self, client_id):
-        session = self.Session()
         try:
-            client = session.query(Client).get(client_id)
-            if client:
+            with self.session_scope() as session:
+                client = session.get(Client, client_id)
+                if client is None:
+                    raise RuntimeError("Client not found.")
+                receipts = session.query(func.count(SalesReceipt.id)).filter(SalesReceipt.customer_id == client_id).scalar()
+                if receipts:
+                    raise RuntimeError(f"Client has {receipts} receipts, which have to be kept.")
                 session.delete(client)
-                session.commit()
-            else:
-                raise RuntimeError("Client not found.")
         except Exception as e:
-            session.rollback()
             raise RuntimeError(f"Failed to delete client: {e}")
-        finally:
-            session.close()
 
-    def update_client(self):
-        pass
+    def update_client(self, client_id, first_name, last_name, email, phone_number, address, notes=None):
+        try:
+            with self.session_scope() as session:
+                client = session.get(Client, client_id)
+                if client is None:
+                    raise RuntimeError("Client not found.")
+                client.first_name = first_name
+                client.last_name = last_name
+                client.email = email
+                client.phone_number = phone_number
+                client.address = address
+                client.notes = notes
+        except Exception as e:
+            raise RuntimeError(f"Failed to update client: {e}")
 
-    def get_client_by_details(self, first_name, last_name, email, phone_number, address, notes):
-        session = self.Session()
+    def find_duplicates(self, first_name, last_name, email, phone_number, exclude_id=None):
+        # clients that may be the same person, checked before adding or changing one
         try:
-            return session.query(Client).filter_by(first_name=first_name, last_name=last_name, email=email, phone_number=phone_number, address=address, notes=notes).first()
+            return self.duplicates.check(first_name, last_name, email, phone_number, exclude_id)
         except Exception as e:
-            raise RuntimeError(f"Failed to get client by details: {e}")
-        finally:
-            session.close()
+            raise RuntimeError(f"Failed to check for duplicate clients: {e}")
+
+    def duplicate_report(self, threshold=REPORT_THRESHOLD):
+        try:
+            return self.duplicates.report(threshold)
+        except Exception as e:
+            raise RuntimeError(f"Failed to build the duplicate report: {e}")
+
+    def get_client(self, client_id):
+        try:
+            with self.session_scope() as session:
+                client = session.get(Client, client_id)
+        except Exception as e:
+            raise RuntimeError(f"Failed to get client: {e}")
+        if client is None:
+            raise RuntimeError("Client not found.")
+        return client
+
+    def get_client_detail(self, client_id):
+        # detached client with receipts and their product lines loaded; anything not loaded
+        # here raises DetachedInstanceError instead of querying
+        try:
+            with self.session_scope() as session:
+                client = session.query(Client).options(*CLIENT_DETAIL_OPTIONS).filter(Client.id == client_id).one_or_none()
+        except Exception as e:
+            raise RuntimeError(f"Failed to get client details: {e}")
+        if client is None:
+            raise RuntimeError("Client not found.")
+        return client
 
     def get_all_clients(self):
-        session = self.Session()
         try:
-            return session.query(Client).all()
+            with self.session_scope() as session:
+                return session.query(Client).all()
         except Exception as e:
             raise RuntimeError(f"Failed to fetch clients: {e}")
-        finally:
-            session.close()
 
-    def add_receipt(self, client_id, receipt_number, amount, date):
-        session = self.Session()
+    def get_clients_page(self, after_id=None, limit=200):
+        # keyset pagination: seek past the last seen id instead of using OFFSET
         try:
-            receipt = SalesReceipt(
-                customer_id=client_id,
-                date=date,
-                total_amoint=float(amount),
-                description=f"Receipt #{receipt_number}"
-            )
-            session.add(receipt)
-            session.commit()
+            with self.session_scope() as session:
+                query = session.query(*CLIENT_ROW_COLUMNS)
+                if after_id is not None:
+                    query = query.filter(Client.id > after_id)
+                return [ClientRow(*row) for row in query.order_by(Client.id).limit(limit)]
+        except Exception as e:
+            raise RuntimeError(f"Failed to fetch clients page: {e}")
+
+    def add_article(self, title, body, author=None, published=None, link=None):
+        try:
+            with self.session_scope() as session:
+                article = Articles(title=title, body=body, author=author,
+                                   published=parse_date(published) if published else None, link=link)
+                session.add(article)
+                session.flush()
+                return article.id
+        except Exception as e:
+            raise RuntimeError(f"Failed to add article: {e}")
+
+    def update_article(self, article_id, title, body, author=None, published=None, link=None):
+        # the knowledge base triggers reindex the article and invalidate its rendered page
+        try:
+            with self.session_scope() as session:
+                article = session.get(Articles, article_id)
+                if article is None:
+                    raise RuntimeError("Article not found.")
+                article.title = title
+                article.body = body
+                article.author = author
+                article.published = parse_date(published) if published else None
+                article.link = link
+        except Exception as e:
+            raise RuntimeError(f"Failed to update article: {e}")
+
+    def add_faq(self, question, answers, article_id=None):
+        try:
+            with self.session_scope() as session:
+                faq = FAQ(question=question, answers=answers, article_id=article_id)
+                session.add(faq)
+                session.flush()
+                return faq.id
+        except Exception as e:
+            raise RuntimeError(f"Failed to add FAQ entry: {e}")
+
+    def store_receipt_image(self, image):
+        # bytes or a binary file object, returns the hash to pass to add_receipt
+        try:
+            return self.blob_store.put(image)
+        except OSError as e:
+            raise RuntimeError(f"Failed to store receipt image: {e}")
+
+    def get_products(self):
+        # served from the reference cache, see reference_cache.py
+        try:
+            return list(self.reference.get("products"))
+        except Exception as e:
+            raise RuntimeError(f"Failed to fetch products: {e}")
+
+    def add_product(self, service, price, details=None):
+        try:
+            with self.session_scope() as session:
+                product = Products(service=service, details=details, price=parse_amount(price))
+                session.add(product)
+                session.flush()
+                return product.id
+        except Exception as e:
+            raise RuntimeError(f"Failed to add product: {e}")
+
+    def update_product(self, product_id, service, price, details=None):
+        # existing receipts keep the price stored on their lines
+        try:
+            with self.session_scope() as session:
+                product = session.get(Products, product_id)
+                if product is None:
+                    raise RuntimeError("Product not found.")
+                product.service = service
+                product.details = details
+                product.price = parse_amount(price)
+        except Exception as e:
+            raise RuntimeError(f"Failed to update product: {e}")
+
+    def get_vendors(self):
+        # served from the reference cache, see reference_cache.py
+        try:
+            return list(self.reference.get("vendors"))
+        except Exception as e:
+            raise RuntimeError(f"Failed to fetch vendors: {e}")
+
+    def add_vendor(self, name, address=None, contact_person=None, contact_number=None, email=None, notes=None):
+        try:
+            with self.session_scope() as session:
+                vendor = Vendors(name=name, address=address, contact_person=contact_person,
+                                 contact_number=contact_number, email=email, notes=notes)
+                session.add(vendor)
+                session.flush()
+                return vendor.id
+        except Exception as e:
+            raise RuntimeError(f"Failed to add vendor: {e}")
+
+    def update_vendor(self, vendor_id, name, address=None, contact_person=None, contact_number=None, email=None, notes=None):
+        try:
+            with self.session_scope() as session:
+                vendor = session.get(Vendors, vendor_id)
+                if vendor is None:
+                    raise RuntimeError("Vendor not found.")
+                vendor.name = name
+                vendor.address = address
+                vendor.contact_person = contact_person
+                vendor.contact_number = contact_number
+                vendor.email = email
+                vendor.notes = notes
+        except Exception as e:
+            raise RuntimeError(f"Failed to update vendor: {e}")
+
+    def add_receipt(self, client_id, receipt_number, amount, date, image_hash=None, tax_amount=None, vat_rate=None):
+        # receipt with a single amount and no product lines; see receipt_tax for the tax amount
+        try:
+            total = parse_amount(amount)
+            with self.session_scope() as session:
+                receipt = SalesReceipt(
+                    customer_id=client_id,
+                    date=parse_date(date),
+                    total_amount=total,
+                    tax_amount=receipt_tax(total, tax_amount, vat_rate),
+                    description=f"Receipt #{receipt_number}",
+                    receipt_image_hash=image_hash
+                )
+                session.add(receipt)
+                session.flush()
+                return receipt.id
         except Exception as e:
-            session.rollback()
             raise RuntimeError(f"Failed to add receipt: {e}")
-        finally:
-            session.close()
+
+    def create_receipt(self, client_id, lines, date=None, **fields):
+        # lines are (product_id, quantity) or (product_id, quantity, price) when the price differs
+        # from the product's; fields: payment_method, category, description, notes, image_hash,
+        # tax_amount or vat_rate
+        return self.create_receipts([dict(fields, client_id=client_id, lines=lines, date=date)])[0]
+
+    def create_receipts(self, receipts):
+        # receipts with their product lines in one transaction, all or none of them are written;
+        # totals are computed from the lines, prices come from the reference cache; the tax amount
+        # is the given tax_amount or derived from the given vat_rate, see receipt_tax
+        try:
+            receipts = list(receipts)
+            prices = {product.id: product.price for product in self.reference.get("products")}
+            with self.session_scope() as session:
+                # products written behind the ORM's back are not in the cache yet
+                unknown = {line[0] for receipt in receipts for line in receipt["lines"]} - prices.keys()
+                if unknown:
+                    prices.update(session.query(Products.id, Products.price).filter(Products.id.in_(unknown)))
+                built = [self.__build_receipt(receipt, prices) for receipt in receipts]
+                session.add_all(row for row, _ in built)
+                session.flush()
+                # the lines need no generated ids back, so they go in as one executemany
+                session.bulk_insert_mappings(ProductSales, [
+                    dict(line, receipt_id=row.id) for row, lines in built for line in lines
+                ])
+                return [row.id for row, _ in built]
+        except Exception as e:
+            raise RuntimeError(f"Failed to create receipts: {e}")
+
+    @staticmethod
+    def __build_receipt(receipt, prices):
+        sales = []
+        for product_id, quantity, *price in receipt["lines"]:
+            if product_id not in prices:
+                raise ValueError(f"Unknown product: {product_id}")
+            if int(quantity) < 1:
+                raise ValueError(f"Invalid quantity: {quantity!r}")
+            price = parse_amount(price[0]) if price and price[0] is not None else prices[product_id]
+            if price is None:
+                raise ValueError(f"Product {product_id} has no price")
+            sales.append({"product_id": product_id, "quantity": int(quantity), "price": price})
+        if not sales:
+            raise ValueError("A receipt needs at least one product line")
+        total = round(sum(sale["price"] * sale["quantity"] for sale in sales), 2)
+        return SalesReceipt(
+            customer_id=receipt["client_id"],
+            date=parse_date(receipt["date"]) if receipt.get("date") else date.today(),
+            total_amount=total,
+            tax_amount=receipt_tax(total, receipt.get("tax_amount"), receipt.get("vat_rate")),
+            payment_method=receipt.get("payment_method"),
+            category=receipt.get("category"),
+            description=receipt.get("description"),
+            notes=receipt.get("notes"),
+            receipt_image_hash=receipt.get("image_hash")
+        ), sales
+
+    def list_receipts(self, client_id):
+        # never selects image bytes
+        try:
+            with self.session_scope() as session:
+                query = session.query(*RECEIPT_ROW_COLUMNS).filter(SalesReceipt.customer_id == client_id)
+                return [ReceiptRow(*row) for row in query.order_by(SalesReceipt.date.desc(), SalesReceipt.id.desc())]
+        except Exception as e:
+            raise RuntimeError(f"Failed to list receipts: {e}")
+
+    def apply_sync(self, path, prefer="local"):
+        # applies a delta file from another machine (see sync.py); the rows change behind the
+        # ORM's back, so the reference cache is dropped afterwards
+        try:
+            stats = self.sync.apply(path, prefer)
+        except Exception as e:
+            raise RuntimeError(f"Failed to apply sync delta: {e}")
+        self.reference.invalidate()
+        return stats
+
+    def diagnostics(self):
+        # in-memory cache statistics, never touches the database
+        return {
+            "reference_cache": self.reference.stats(),
+            "knowledge_base_cache": {"hits": self.knowledge_base.hits, "misses": self.knowledge_base.misses,
+                                     "size": len(self.knowledge_base.render_cache)},
+        }
+
+    def open_receipt_image(self, image_hash):
+        # read-only memory map of the stored image, close it (or use it as a context manager) when done
+        try:
+            return self.blob_store.map(image_hash)
+        except OSError as e:
+            raise RuntimeError(f"Failed to open receipt image: {e}")
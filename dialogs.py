@@ -0,0 +1,897 @@
+import os
+from PyQt5.QtWidgets import (
+    QMessageBox, QDialog, QFormLayout, QLineEdit, QDialogButtonBox, QPushButton, QVBoxLayout,
+    QTableWidget, QTableWidgetItem, QTableView, QAbstractItemView, QFileDialog, QListWidget,
+    QListWidgetItem, QTextEdit, QLabel, QComboBox, QSpinBox, QHBoxLayout, QTabWidget
+)
+from PyQt5.QtGui import QIcon
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal, QTimer, QSize
+from async_db import BusyIndicator
+from client_search import matches, refines, DEFAULT_LIMIT as SEARCH_LIMIT
+from instrumentation import metrics
+from receipt_previews import ThumbnailService
+
+# dialogs take an AsyncDatabase, no database call runs on the GUI thread
+
+
+class UpdateClientDialog(QDialog):
+    def __init__(self, database, client, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Update Client")
+        self.database = database
+        self.client = client
+        self.init_ui()
+
+    @metrics.instrument("ui")
+    def init_ui(self):
+        layout = QFormLayout(self)
+
+        # input fields
+        self.first_name_input = QLineEdit(self.client.first_name, self)
+        self.last_name_input = QLineEdit(self.client.last_name, self)
+        self.email_input = QLineEdit(self.client.email, self)
+        self.phone_input = QLineEdit(self.client.phone_number, self)
+        self.address_input = QLineEdit(self.client.address, self)
+        self.notes_input = QLineEdit(self.client.notes, self)
+        # read-only summary, the client comes from get_client_detail with its receipts loaded
+        total = sum(receipt.total_amount or 0 for receipt in self.client.receipts)
+        self.receipts_input = QLineEdit(f"{len(self.client.receipts)} Rechnungen, {total:.2f} €", self)
+        self.receipts_input.setReadOnly(True)
+        layout.addRow("Vorname:", self.first_name_input)
+        layout.addRow("Nachname:", self.last_name_input)
+        layout.addRow("E-Mail:", self.email_input)
+        layout.addRow("Telefonnummer:", self.phone_input)
+        layout.addRow("Adresse:", self.address_input)
+        layout.addRow("Notizen:", self.notes_input)
+        layout.addRow("Rechnungen:", self.receipts_input)
+
+        # dialog buttons
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+        self.busy = BusyIndicator(self, self.buttons)
+
+    def accept(self):
+        first_name = self.first_name_input.text().strip()
+        last_name = self.last_name_input.text().strip()
+        email = self.email_input.text().strip()
+        phone = self.phone_input.text().strip()
+        address = self.address_input.text().strip()
+        notes = self.notes_input.text().strip()
+
+        if not first_name or not last_name or not email:
+            QMessageBox.warning(self, "Input Error", "Please provide both name and email.")
+            return
+        self.database.call(
+            self, "update_client", self.client.id, first_name, last_name, email, phone, address, notes,
+            on_result=self.updated, on_error=lambda message: QMessageBox.critical(self, "Error", message), busy=self.busy
+        )
+
+    def updated(self, _):
+        QMessageBox.information(self, "Success", "Client updated successfully!")
+        super().accept()
+
+
+class SearchClientDialog(QDialog):
+    # search via client name, email, address
+    debounce_ms = 250
+
+    def __init__(self, database, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Klienten Suchen")
+        self.database = database
+
+        # searches share one coalescing key, a newer search replaces a queued one and
+        # makes the result of a running one stale
+        self.pending_criteria = None
+        self.pending_request = None
+
+        # last completed search, used to narrow results locally while the user keeps typing
+        self.last_criteria = None
+        self.last_results = []
+
+        self.init_ui()
+
+    @metrics.instrument("ui")
+    def init_ui(self):
+        layout = QFormLayout(self)
+
+        # input fields for search criteria
+        self.name_input = QLineEdit(self)
+        self.email_input = QLineEdit(self)
+        self.phone_input = QLineEdit(self)
+        layout.addRow("Name:", self.name_input)
+        layout.addRow("E-Mail:", self.email_input)
+        layout.addRow("Telefonnummer:", self.phone_input)
+
+        # debounce keystrokes before searching
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(self.debounce_ms)
+        self.debounce_timer.timeout.connect(self.perform_search)
+        for line_edit in (self.name_input, self.email_input, self.phone_input):
+            line_edit.textChanged.connect(self.debounce_timer.start)
+
+        # search button
+        self.search_button = QPushButton("Suche", self)
+        self.search_button.clicked.connect(self.perform_search)
+        layout.addWidget(self.search_button)
+
+        # table to display results
+        self.results_table = QTableWidget(self)
+        self.results_table.setColumnCount(5)
+        self.results_table.setHorizontalHeaderLabels(["Vorname", "Nachname", "E-Mail", "Telefon", "Adresse"])
+        layout.addWidget(self.results_table)
+
+    @metrics.instrument("ui")
+    def perform_search(self):
+        self.debounce_timer.stop()
+        name = self.name_input.text().strip()
+        email = self.email_input.text().strip()
+        phone = self.phone_input.text().strip()
+        criteria = (name, email, phone)
+
+        if criteria == self.pending_criteria:
+            return
+        if criteria == self.last_criteria:
+            # back to what is shown, e.g. after a backspace: a newer search still running is stale
+            if self.pending_request is not None:
+                self.database.cancel(self.pending_request)
+                self.pending_request = None
+                self.pending_criteria = None
+            return
+
+        # the previous result set was complete and the new terms only extend it: filter locally
+        if self.last_criteria is not None and len(self.last_results) < SEARCH_LIMIT and refines(self.last_criteria, criteria):
+            if self.pending_request is not None:
+                self.database.cancel(self.pending_request)
+                self.pending_request = None
+                self.pending_criteria = None
+            self.last_criteria = criteria
+            self.last_results = [client for client in self.last_results if matches(client, name, email, phone)]
+            self.show_results(self.last_results)
+            return
+
+        self.pending_criteria = criteria
+        self.pending_request = self.database.call(
+            self, "search_clients", name, email, phone, limit=SEARCH_LIMIT, key="search",
+            on_result=self.search_finished, on_error=self.search_failed
+        )
+
+    def search_finished(self, results):
+        self.last_criteria = self.pending_criteria
+        self.last_results = results
+        self.pending_request = None
+        self.pending_criteria = None
+        self.show_results(results)
+
+    def search_failed(self, message):
+        self.pending_request = None
+        self.pending_criteria = None
+        QMessageBox.critical(self, "Error", message)
+
+    def show_results(self, results):
+        self.results_table.setRowCount(len(results))
+        for row, client in enumerate(results):
+            self.results_table.setItem(row, 0, QTableWidgetItem(client.first_name))
+            self.results_table.setItem(row, 1, QTableWidgetItem(client.last_name))
+            self.results_table.setItem(row, 2, QTableWidgetItem(client.email))
+            self.results_table.setItem(row, 3, QTableWidgetItem(client.phone_number))
+            self.results_table.setItem(row, 4, QTableWidgetItem(client.address))
+
+
+class AddReceiptDialog(QDialog):
+    def __init__(self, database, client, parent=None, preview_service=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Add Receipt for {client.first_name} {client.last_name} Client ID: {client.id}")
+        self.database = database
+        self.client = client
+        self.preview_service = preview_service
+        self.image_path = None
+        self.products = {}
+        self.lines = []
+        self.init_ui()
+
+    @metrics.instrument("ui")
+    def init_ui(self):
+        layout = QFormLayout(self)
+
+        # input fields
+        self.receipt_number_input = QLineEdit(self)
+        self.amount_input = QLineEdit(self)
+        self.date_input = QLineEdit(self)
+        layout.addRow("Receipt Number:", self.receipt_number_input)
+        layout.addRow("Amount:", self.amount_input)
+        layout.addRow("Date:", self.date_input)
+        # empty for VAT exempt treatments, the receipt then has no tax amount
+        self.vat_rate_input = QLineEdit(self)
+        self.vat_rate_input.setPlaceholderText("optional, z. B. 19")
+        layout.addRow("USt-Satz (%):", self.vat_rate_input)
+
+        # product lines; with at least one line the amount is their sum
+        self.product_input = QComboBox(self)
+        self.quantity_input = QSpinBox(self)
+        self.quantity_input.setRange(1, 999)
+        self.add_line_button = QPushButton("Position hinzufügen", self)
+        self.add_line_button.clicked.connect(self.add_line)
+        line_row = QHBoxLayout()
+        line_row.addWidget(self.product_input, 1)
+        line_row.addWidget(self.quantity_input)
+        line_row.addWidget(self.add_line_button)
+        layout.addRow("Leistung:", line_row)
+
+        self.lines_table = QTableWidget(0, 3, self)
+        self.lines_table.setHorizontalHeaderLabels(["Leistung", "Menge", "Summe"])
+        self.lines_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.lines_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.lines_table.horizontalHeader().setStretchLastSection(True)
+        layout.addRow(self.lines_table)
+        self.remove_line_button = QPushButton("Position entfernen", self)
+        self.remove_line_button.clicked.connect(self.remove_line)
+        layout.addRow(self.remove_line_button)
+
+        # optional scan of the receipt
+        self.image_button = QPushButton("Bild auswählen...", self)
+        self.image_button.clicked.connect(self.choose_image)
+        layout.addRow("Bild:", self.image_button)
+
+        # dialog buttons
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+        self.busy = BusyIndicator(self, self.buttons, self.image_button)
+
+        self.add_line_button.setEnabled(False)
+        self.database.call(self, "get_products", key="products", on_result=self.show_products,
+                           on_error=lambda message: QMessageBox.critical(self, "Error", message))
+
+    def show_products(self, products):
+        # products without a price can not be billed by line
+        self.products = {product.id: product for product in products if product.price is not None}
+        for product in self.products.values():
+            self.product_input.addItem(f"{product.service} ({product.price:.2f} €)", product.id)
+        self.add_line_button.setEnabled(bool(self.products))
+
+    def add_line(self):
+        product_id = self.product_input.currentData()
+        if product_id is None:
+            return
+        self.lines.append((product_id, self.quantity_input.value()))
+        self.show_lines()
+
+    def remove_line(self):
+        row = self.lines_table.currentRow()
+        if row >= 0:
+            del self.lines[row]
+            self.show_lines()
+
+    @metrics.instrument("ui")
+    def show_lines(self):
+        self.lines_table.setRowCount(len(self.lines))
+        total = 0.0
+        for row, (product_id, quantity) in enumerate(self.lines):
+            product = self.products[product_id]
+            total += product.price * quantity
+            self.lines_table.setItem(row, 0, QTableWidgetItem(product.service))
+            self.lines_table.setItem(row, 1, QTableWidgetItem(str(quantity)))
+            self.lines_table.setItem(row, 2, QTableWidgetItem(f"{product.price * quantity:.2f} €"))
+        self.amount_input.setReadOnly(bool(self.lines))
+        if self.lines:
+            self.amount_input.setText(f"{total:.2f}")
+
+    def choose_image(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Bild auswählen", "", "Bilder (*.png *.jpg *.jpeg *.tif *.tiff *.bmp)")
+        if path:
+            self.image_path = path
+            self.image_button.setText(os.path.basename(path))
+
+    def accept(self):
+        receipt_number = self.receipt_number_input.text().strip()
+        amount = self.amount_input.text().strip()
+        date = self.date_input.text().strip()
+        vat_percent = self.vat_rate_input.text().strip()
+
+        if not receipt_number or not amount or not date:
+            QMessageBox.warning(self, "Input Error", "All fields are required")
+            return
+        try:
+            vat_rate = float(vat_percent.replace(",", ".")) / 100 if vat_percent else None
+        except ValueError:
+            QMessageBox.warning(self, "Input Error", "Bitte einen gültigen USt-Satz eingeben.")
+            return
+
+        self.database.submit(
+            self, self.store_receipt, self.database.database_manager, self.client.id, receipt_number, amount, date, self.image_path,
+            list(self.lines), vat_rate, on_result=self.receipt_stored, on_error=lambda message: QMessageBox.critical(self, "Error", message),
+            busy=self.busy
+        )
+
+    @staticmethod
+    def store_receipt(database_manager, client_id, receipt_number, amount, date, image_path, lines=(), vat_rate=None):
+        # runs on a worker thread, hashing and copying a large scan takes a while
+        image_hash = None
+        if image_path:
+            with open(image_path, "rb") as image:
+                image_hash = database_manager.store_receipt_image(image)
+        if lines:
+            database_manager.create_receipt(client_id, lines, date, description=f"Receipt #{receipt_number}", image_hash=image_hash,
+                                            vat_rate=vat_rate)
+        else:
+            database_manager.add_receipt(client_id, receipt_number, amount, date, image_hash, vat_rate=vat_rate)
+        return image_hash
+
+    def receipt_stored(self, image_hash):
+        # generate the thumbnail now so the receipt list shows it right away
+        if image_hash and self.preview_service:
+            self.preview_service.request(image_hash, retry=True)
+        QMessageBox.information(self, "Success", "Receipt added successfully!")
+        super().accept()
+
+
+class ClientReceiptsDialog(QDialog):
+    # receipt list with thumbnails; rows never load image bytes, thumbnails arrive asynchronously
+    def __init__(self, database, preview_service, client, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Receipts for {client.first_name} {client.last_name}")
+        self.database = database
+        self.preview_service = preview_service
+        self.client = client
+        self.items_by_hash = {}
+        self.init_ui()
+
+    @metrics.instrument("ui")
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+
+        self.receipt_list = QListWidget(self)
+        self.receipt_list.setIconSize(QSize(96, 96))
+        self.receipt_list.setUniformItemSizes(True)
+        layout.addWidget(self.receipt_list)
+
+        self.add_button = QPushButton("Add Receipt", self)
+        self.add_button.clicked.connect(self.add_receipt)
+        layout.addWidget(self.add_button)
+
+        self.preview_service.thumbnail_ready.connect(self.thumbnail_ready)
+        self.busy = BusyIndicator(self, self.add_button)
+        self.populate_list()
+
+    def populate_list(self):
+        self.database.call(
+            self, "list_receipts", self.client.id, key="receipts", busy=self.busy,
+            on_result=self.show_receipts, on_error=lambda message: QMessageBox.critical(self, "Error", message)
+        )
+
+    def show_receipts(self, receipts):
+        self.receipt_list.clear()
+        self.items_by_hash = {}
+        for receipt in receipts:
+            item = QListWidgetItem(f"{receipt.date}  {receipt.total_amount or 0:.2f} €  {receipt.description or ''}")
+            self.receipt_list.addItem(item)
+            if receipt.receipt_image_hash:
+                self.items_by_hash.setdefault(receipt.receipt_image_hash, []).append(item)
+                pixmap = self.preview_service.pixmap(receipt.receipt_image_hash)
+                if pixmap is not None:
+                    item.setIcon(QIcon(pixmap))
+
+    def thumbnail_ready(self, digest):
+        pixmap = self.preview_service.pixmap(digest)
+        for item in self.items_by_hash.get(digest, []):
+            item.setIcon(QIcon(pixmap))
+
+    def add_receipt(self):
+        dialog = AddReceiptDialog(self.database, self.client, self, self.preview_service)
+        if dialog.exec_():
+            self.populate_list()
+
+
+class NewClientDialog(QDialog):
+    debounce_ms = 400
+
+    def __init__(self, database, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Neuen Klienten Hinzufügen")
+        self.database = database
+        self.init_ui()
+
+    @metrics.instrument("ui")
+    def init_ui(self):
+        layout = QFormLayout(self)
+
+        # input fields
+        self.first_name_input = QLineEdit(self)
+        self.last_name_input = QLineEdit(self)
+        self.email_input = QLineEdit(self)
+        self.phone_number = QLineEdit(self)
+        self.address = QLineEdit(self)
+        self.notes = QLineEdit(self)
+        # requires a function to add receipts to a client.
+        layout.addRow("Vorname:", self.first_name_input)
+        layout.addRow("Nachname:", self.last_name_input)
+        layout.addRow("E-Mail:", self.email_input)
+        layout.addRow("Telefonnummer:", self.phone_number)
+        layout.addRow("Wohnadresse:", self.address)
+        layout.addRow("Notizen:", self.notes)
+
+        # possible duplicates, checked while typing
+        self.duplicate_label = QLabel(self)
+        self.duplicate_label.setWordWrap(True)
+        self.duplicate_label.hide()
+        layout.addRow(self.duplicate_label)
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(self.debounce_ms)
+        self.debounce_timer.timeout.connect(self.check_duplicates)
+        for line_edit in (self.first_name_input, self.last_name_input, self.email_input, self.phone_number):
+            line_edit.textChanged.connect(self.debounce_timer.start)
+
+        # Dialog buttons
+        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+        layout.addWidget(self.buttons)
+        self.busy = BusyIndicator(self, self.buttons)
+
+    def client_values(self):
+        return (self.first_name_input.text().strip(), self.last_name_input.text().strip(), self.email_input.text().strip(),
+                self.phone_number.text().strip(), self.address.text().strip(), self.notes.text().strip())
+
+    def check_duplicates(self):
+        first_name, last_name, email, phone_number, _, _ = self.client_values()
+        if not last_name and not email and not phone_number:
+            self.show_duplicates([])
+            return
+        self.database.call(self, "find_duplicates", first_name, last_name, email, phone_number, key="duplicates",
+                           on_result=self.show_duplicates, on_error=lambda message: self.show_duplicates([]))
+
+    @staticmethod
+    def describe(match):
+        client = match.client
+        return f"{client.first_name} {client.last_name}, {client.email}, {client.phone_number} ({match.score:.0%})"
+
+    def show_duplicates(self, found):
+        self.duplicate_label.setText("Möglicherweise schon angelegt:\n" + "\n".join(self.describe(match) for match in found))
+        self.duplicate_label.setVisible(bool(found))
+
+    def accept(self):
+        values = self.client_values()
+        first_name, last_name, email, phone_number, address, _ = values
+
+        if not first_name or not last_name or not email or not phone_number or not address:
+            QMessageBox.warning(self, "Input Error", "Please fill in name, email, phone number and address.")
+            return
+
+        # checked again with the final input, the live check may still be pending
+        self.debounce_timer.stop()
+        self.database.call(
+            self, "find_duplicates", first_name, last_name, email, phone_number, key="duplicates", busy=self.busy,
+            on_result=lambda found: self.store_client(values, found),
+            on_error=lambda message: QMessageBox.critical(self, "Error", message)
+        )
+
+    def store_client(self, values, found):
+        self.show_duplicates(found)
+        if found:
+            confirm = QMessageBox.question(
+                self, "Mögliches Duplikat",
+                "Dieser Klient ist vielleicht schon angelegt:\n\n" + "\n".join(self.describe(match) for match in found)
+                + "\n\nTrotzdem anlegen?", QMessageBox.Yes | QMessageBox.No
+            )
+            if confirm != QMessageBox.Yes:
+                return
+        self.database.call(
+            self, "add_client", *values, busy=self.busy,
+            on_result=lambda _: QMessageBox.information(self, "Success", "Client added successfully!"),
+            on_error=lambda message: QMessageBox.critical(self, "Error", message)
+        )
+
+
+class ClientTableModel(QAbstractTableModel):
+    # rows are pulled from the database in keyset-paginated windows as the view scrolls,
+    # one page request at a time and off the GUI thread
+    columns = [
+        ("Vorname", "first_name"),
+        ("Nachname", "last_name"),
+        ("E-Mail", "email"),
+        ("Adresse", "address"),
+        ("Telefonnummer", "phone_number"),
+        ("Notizen", "notes"),
+    ]
+    fetch_failed = pyqtSignal(str)
+
+    def __init__(self, database, page_size=200, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.page_size = page_size
+        self.rows = []
+        self.exhausted = False
+        self.fetching = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section][0]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        field = self.columns[index.column()][1]
+        value = getattr(self.rows[index.row()], field)
+        if field == "notes":
+            return value or "empty"
+        return value
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.fetching:
+            return
+        after_id = self.rows[-1].id if self.rows else None
+        self.fetching = True
+        # keyed, so a refresh makes the page still in flight stale
+        self.database.call(self, "get_clients_page", after_id, self.page_size, key="page",
+                           on_result=self.page_fetched, on_error=self.page_failed)
+
+    def page_fetched(self, page):
+        self.fetching = False
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def page_failed(self, message):
+        # stop asking for more, otherwise the view retries on every scroll
+        self.fetching = False
+        self.exhausted = True
+        self.fetch_failed.emit(message)
+
+    def refresh(self):
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.fetching = False
+        self.endResetModel()
+
+    def row_at(self, row):
+        return self.rows[row]
+
+
+class ProtocolTimelineModel(QAbstractTableModel):
+    # a client's protocol entries, newest first, fetched page by page as the view scrolls
+    columns = ["Datum", "Notiz"]
+    fetch_failed = pyqtSignal(str)
+
+    def __init__(self, database, client_id, page_size=50, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.client_id = client_id
+        self.page_size = page_size
+        self.rows = []
+        self.cursor = None
+        self.exhausted = False
+        self.fetching = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        entry = self.rows[index.row()]
+        if index.column() == 0:
+            return entry.date.strftime("%d.%m.%Y") if entry.date else ""
+        # first line only, the full note is shown below the table
+        return (entry.note or "").split("\n", 1)[0][:120]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.fetching:
+            return
+        self.fetching = True
+        protocols = self.database.database_manager.protocols
+        self.database.submit(self, protocols.page, self.client_id, self.cursor, limit=self.page_size, key="page",
+                             on_result=self.page_fetched, on_error=self.page_failed)
+
+    def page_fetched(self, result):
+        page, self.cursor = result
+        self.fetching = False
+        self.exhausted = self.cursor is None
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def page_failed(self, message):
+        self.fetching = False
+        self.exhausted = True
+        self.fetch_failed.emit(message)
+
+    def refresh(self):
+        self.beginResetModel()
+        self.rows = []
+        self.cursor = None
+        self.exhausted = False
+        self.fetching = False
+        self.endResetModel()
+
+    def row_at(self, row):
+        return self.rows[row]
+
+
+class ClientProtocolsDialog(QDialog):
+    # protocol timeline of one client; entries can only be added, never edited
+    def __init__(self, database, client, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Protokolle: {client.first_name} {client.last_name}")
+        self.database = database
+        self.client = client
+        self.init_ui()
+
+    @metrics.instrument("ui")
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+
+        self.model = ProtocolTimelineModel(self.database, self.client.id, parent=self)
+        self.model.fetch_failed.connect(self.show_error)
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.selectionModel().currentRowChanged.connect(self.show_entry)
+        layout.addWidget(self.table)
+
+        self.entry_view = QTextEdit(self)
+        self.entry_view.setReadOnly(True)
+        layout.addWidget(self.entry_view)
+
+        layout.addWidget(QLabel("Neuer Eintrag:", self))
+        self.note_input = QTextEdit(self)
+        self.note_input.setAcceptRichText(False)
+        layout.addWidget(self.note_input)
+
+        self.add_button = QPushButton("Eintrag hinzufügen", self)
+        self.add_button.clicked.connect(self.add_entry)
+        layout.addWidget(self.add_button)
+
+        self.busy = BusyIndicator(self, self.add_button)
+        self.model.fetchMore()
+
+    def show_entry(self, current, _previous):
+        if current.isValid():
+            self.entry_view.setPlainText(self.model.row_at(current.row()).note or "")
+
+    def add_entry(self):
+        note = self.note_input.toPlainText().strip()
+        if not note:
+            QMessageBox.warning(self, "Input Error", "Bitte einen Text eingeben.")
+            return
+        protocols = self.database.database_manager.protocols
+        self.database.submit(self, protocols.add, self.client.id, note, busy=self.busy,
+                             on_result=self.entry_added, on_error=self.show_error)
+
+    def entry_added(self, _):
+        self.note_input.clear()
+        self.model.refresh()
+        self.model.fetchMore()
+
+    def show_error(self, message):
+        QMessageBox.critical(self, "Error", message)
+
+
+class ViewClientsDialog(QDialog):
+    def __init__(self, database, parent=None, preview_service=None):
+        super().__init__(parent)
+        self.setWindowTitle("View Clients")
+        self.database = database
+        self.preview_service = preview_service or ThumbnailService(database.database_manager.blob_store, parent=self)
+        self.init_ui()
+
+    @metrics.instrument("ui")
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+
+        # table view backed by a lazily fetched model
+        self.model = ClientTableModel(self.database, parent=self)
+        self.model.fetch_failed.connect(lambda message: QMessageBox.critical(self, "Error", message))
+        self.table = QTableView(self)
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        layout.addWidget(self.table)
+
+        # update and del buttons
+        self.update_button = QPushButton("Update Selected Client", self)
+        self.update_button.clicked.connect(self.update_selected_client)
+        layout.addWidget(self.update_button)
+
+        self.delete_button = QPushButton("Delete Selected Client", self)
+        self.delete_button.clicked.connect(self.delete_selected_client)
+        layout.addWidget(self.delete_button)
+
+        self.receipts_button = QPushButton("Show Receipts", self)
+        self.receipts_button.clicked.connect(self.show_receipts)
+        layout.addWidget(self.receipts_button)
+
+        self.protocols_button = QPushButton("Protokolle", self)
+        self.protocols_button.clicked.connect(self.show_protocols)
+        layout.addWidget(self.protocols_button)
+
+        self.busy = BusyIndicator(self, self.update_button, self.delete_button, self.receipts_button, self.protocols_button)
+        self.populate_table()
+
+    def populate_table(self):
+        self.model.refresh()
+        # first window only, the view asks for more while scrolling
+        if self.model.canFetchMore():
+            self.model.fetchMore()
+
+    def get_selected_client(self):
+        # the list row, it carries everything the receipt dialog and the delete prompt need
+        selected_row = self.table.currentIndex().row()
+        if selected_row == -1:
+            QMessageBox.warning(self, "Selection Error", "Please select a client first")
+            return None
+        return self.model.row_at(selected_row)
+
+    def show_error(self, message):
+        QMessageBox.critical(self, "Error", message)
+
+    def update_selected_client(self):
+        client = self.get_selected_client()
+        if client:
+            # the update dialog shows receipt totals, so it gets the eagerly loaded client
+            self.database.call(self, "get_client_detail", client.id, busy=self.busy,
+                               on_result=self.open_update_dialog, on_error=self.show_error)
+
+    def open_update_dialog(self, client):
+        dialog = UpdateClientDialog(self.database, client, self)
+        if dialog.exec_():
+            self.populate_table()
+
+    def show_receipts(self):
+        client = self.get_selected_client()
+        if client:
+            dialog = ClientReceiptsDialog(self.database, self.preview_service, client, self)
+            dialog.exec_()
+
+    def show_protocols(self):
+        client = self.get_selected_client()
+        if client:
+            dialog = ClientProtocolsDialog(self.database, client, self)
+            dialog.exec_()
+
+    def delete_selected_client(self):
+        client = self.get_selected_client()
+        if client:
+            confirm = QMessageBox.question(self, "Confirm Delete", f"Are you sure you want to delete {client.first_name} {client.last_name} and their protocols?", QMessageBox.Yes | QMessageBox.No)
+            if confirm == QMessageBox.Yes:
+                self.database.call(self, "delete_client", client.id, busy=self.busy,
+                                   on_result=self.client_deleted, on_error=self.show_error)
+
+    def client_deleted(self, _):
+        QMessageBox.information(self, "Success", "Client deleted successfully!")
+        self.populate_table()
+
+
+class DiagnosticsDialog(QDialog):
+    # hidden (Ctrl+Shift+D in the main window): timings of database calls, dialog actions and
+    # SQL statements, cache statistics, a cProfile capture and a JSON export for support
+    operation_columns = ["Art", "Operation", "Aufrufe", "Mittel ms", "p95 ms", "Max ms", "SQL/Aufruf", "SQL-Anteil"]
+    statement_columns = ["Anweisung", "Anzahl", "Mittel ms", "p95 ms", "Max ms"]
+
+    def __init__(self, database_manager=None, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Diagnose")
+        self.database_manager = database_manager
+        self.init_ui()
+        self.refresh()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+
+        self.tabs = QTabWidget(self)
+        self.operations_table = self._table(self.operation_columns)
+        self.statements_table = self._table(self.statement_columns)
+        self.profile_view = QTextEdit(self)
+        self.profile_view.setReadOnly(True)
+        self.profile_view.setLineWrapMode(QTextEdit.NoWrap)
+        self.tabs.addTab(self.operations_table, "Operationen")
+        self.tabs.addTab(self.statements_table, "SQL")
+        self.tabs.addTab(self.profile_view, "Profil")
+        layout.addWidget(self.tabs)
+
+        self.caches_label = QLabel(self)
+        self.caches_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.caches_label)
+
+        buttons = QHBoxLayout()
+        for label, handler in (("Aktualisieren", self.refresh), ("Zurücksetzen", self.reset),
+                               ("Profil starten", self.toggle_profile), ("JSON exportieren...", self.export)):
+            button = QPushButton(label, self)
+            button.clicked.connect(handler)
+            buttons.addWidget(button)
+            if handler == self.toggle_profile:
+                self.profile_button = button
+        layout.addLayout(buttons)
+        self.resize(1000, 600)
+
+    def _table(self, columns):
+        table = QTableWidget(0, len(columns), self)
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        # no sort column until a header is clicked, rows start in snapshot order (most total time first)
+        table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        table.setSortingEnabled(True)
+        return table
+
+    @staticmethod
+    def _fill(table, rows):
+        table.setSortingEnabled(False)
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                # numbers as numbers so the columns sort numerically
+                item.setData(Qt.DisplayRole, round(value, 2) if isinstance(value, float) else value)
+                table.setItem(row, column, item)
+        table.setSortingEnabled(True)
+        table.resizeColumnsToContents()
+
+    def refresh(self):
+        snapshot = metrics.snapshot()
+        self._fill(self.operations_table, [
+            (entry["kind"], entry["name"], entry["count"], entry["mean_ms"], entry["p95_ms"], entry["max_ms"],
+             entry["statements_per_call"], f"{entry['sql_share']:.0%}")
+            for entry in snapshot["operations"]
+        ])
+        self._fill(self.statements_table, [
+            (entry["statement"], entry["count"], entry["mean_ms"], entry["p95_ms"], entry["max_ms"])
+            for entry in snapshot["statements"]
+        ])
+        if self.database_manager is not None:
+            self.caches_label.setText("  ".join(f"{name}: {stats}" for name, stats in self.database_manager.diagnostics().items()))
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+    def toggle_profile(self):
+        if metrics.profiling:
+            self.profile_view.setPlainText(metrics.stop_profile() or "Keine Operationen aufgezeichnet.")
+            self.profile_button.setText("Profil starten")
+            self.tabs.setCurrentWidget(self.profile_view)
+        else:
+            metrics.start_profile()
+            self.profile_button.setText("Profil stoppen")
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Diagnose exportieren", "diagnose.json", "JSON (*.json)")
+        if not path:
+            return
+        extra = {"caches": self.database_manager.diagnostics()} if self.database_manager is not None else None
+        try:
+            metrics.dump(path, extra)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Failed to export diagnostics: {e}")
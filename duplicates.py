@@ -0,0 +1,313 @@
+import argparse
+import re
+import sys
+import time
+import unicodedata
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from instrumentation import metrics
+
+# a new client at least this similar to an existing one is shown as a possible duplicate
+CHECK_THRESHOLD = 0.8
+REPORT_THRESHOLD = 0.85
+# share of name, e-mail and phone similarity in the score
+WEIGHTS = (0.5, 0.25, 0.25)
+# rows fetched per blocking key in the live check
+CANDIDATE_LIMIT = 100
+# the report compares each row of a block with the next WINDOW rows in (surname, first name
+# code) order, so a block of any size costs linear time; small blocks are compared completely
+WINDOW = 20
+REFRESH_BATCH = 5000
+# country code and trunk prefix are written in many ways, the subscriber number is not
+PHONE_KEY_DIGITS = 8
+MIN_PHONE_DIGITS = 6
+
+DuplicateClient = namedtuple("DuplicateClient", ["id", "first_name", "last_name", "email", "phone_number"])
+DuplicateMatch = namedtuple("DuplicateMatch", ["score", "client"])
+DuplicatePair = namedtuple("DuplicatePair", ["score", "first", "second"])
+
+UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+VOWELS = set("AEIJOUY")
+NON_DIGITS = re.compile(r"\D")
+
+
+def fold(value):
+    # lower case, umlauts spelled out, other accents dropped: "Müller" and "Mueller" compare equal
+    value = (value or "").lower()
+    if value.isascii():
+        return value.strip()
+    value = unicodedata.normalize("NFKD", value.translate(UMLAUTS))
+    return "".join(ch for ch in value if not unicodedata.combining(ch)).strip()
+
+
+def cologne(value):
+    # Kölner Phonetik, a phonetic code made for German names: "Meier", "Mayr" and "Maier" are all 67
+    letters = [ch for ch in fold(value).upper() if "A" <= ch <= "Z"]
+    digits = []
+    for i, ch in enumerate(letters):
+        before = letters[i - 1] if i else ""
+        after = letters[i + 1] if i + 1 < len(letters) else ""
+        if ch in VOWELS:
+            code = "0"
+        elif ch == "H":
+            continue
+        elif ch == "B" or (ch == "P" and after != "H"):
+            code = "1"
+        elif ch in "DT":
+            code = "8" if after and after in "CSZ" else "2"
+        elif ch in "FVWP":
+            code = "3"
+        elif ch in "GKQ":
+            code = "4"
+        elif ch == "C":
+            if i == 0:
+                code = "4" if after and after in "AHKLOQRUX" else "8"
+            else:
+                code = "4" if after and after in "AHKOQUX" and before not in ("S", "Z") else "8"
+        elif ch == "X":
+            code = "8" if before and before in "CKQ" else "48"
+        elif ch == "L":
+            code = "5"
+        elif ch in "MN":
+            code = "6"
+        elif ch == "R":
+            code = "7"
+        else:
+            code = "8"
+        for digit in code:
+            if not digits or digits[-1] != digit:
+                digits.append(digit)
+    if not digits:
+        return ""
+    return digits[0] + "".join(digit for digit in digits[1:] if digit != "0")
+
+
+def phone_digits(phone):
+    return NON_DIGITS.sub("", phone or "")
+
+
+def phone_key(phone):
+    digits = phone_digits(phone)
+    return digits[-PHONE_KEY_DIGITS:] if len(digits) >= MIN_PHONE_DIGITS else None
+
+
+def email_key(email):
+    # local part without dots and +tags, a typo in the domain still lands in the same block
+    local = fold(email).split("@", 1)[0].split("+", 1)[0].replace(".", "")
+    return local or None
+
+
+def blocking_keys(client):
+    # (phone key, surname code, first name code, e-mail key), None where there is nothing to compare
+    return (phone_key(client.phone_number), cologne(client.last_name) or None, cologne(client.first_name),
+            email_key(client.email))
+
+
+def grams(value):
+    # character bigrams of every word, padded so word starts and ends count; word order does not
+    return frozenset(padded[i:i + 2] for word in re.findall(r"\w+", value) for padded in (f" {word} ",)
+                     for i in range(len(padded) - 1))
+
+
+def _dice(a, b):
+    # 2 |a & b| / (|a| + |b|) of two bigram sets, 1.0 for equal strings
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class _Compared:
+    # the bigrams of a client's fields, computed once however many pairs it is part of
+    __slots__ = ("client", "name", "email", "phone", "phone_key")
+
+    def __init__(self, client):
+        self.client = client
+        self.name = grams(f"{fold(client.first_name)} {fold(client.last_name)}")
+        # the local part only, the same person moves between mail providers
+        self.email = grams(fold(client.email).split("@", 1)[0].replace(".", " "))
+        self.phone = grams(phone_digits(client.phone_number))
+        self.phone_key = phone_key(client.phone_number)
+
+
+def _score(a, b):
+    name = _dice(a.name, b.name)
+    email = _dice(a.email, b.email)
+    phone = 1.0 if a.phone_key and a.phone_key == b.phone_key else _dice(a.phone, b.phone)
+    return round(WEIGHTS[0] * name + WEIGHTS[1] * email + WEIGHTS[2] * phone, 3)
+
+
+def score(a, b):
+    return _score(_Compared(a), _Compared(b))
+
+
+@metrics.instrument_class("database")
+class DuplicateIndex:
+    # possible duplicate clients: the same person with a mistyped e-mail or a differently written
+    # phone number, which the UNIQUE constraints do not catch. Blocking keys (phone digits, Kölner
+    # Phonetik of the names, e-mail local part) live in an indexed side table and only clients
+    # sharing a key are scored. Triggers add and mark rows for every writer, the keys themselves
+    # are computed here before each check because SQLite has no phonetic function.
+    def __init__(self, engine):
+        self.engine = engine
+
+    def install(self):
+        with self.engine.begin() as conn:
+            created = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'client_dedup_keys'"
+            )).first() is None
+            for statement in self.ddl():
+                conn.execute(text(statement))
+            if created:
+                conn.execute(text("INSERT INTO client_dedup_keys (client_id) SELECT id FROM clients"))
+            self._refresh(conn)
+
+    def ddl(self):
+        return [
+            """CREATE TABLE IF NOT EXISTS client_dedup_keys (
+                client_id INTEGER PRIMARY KEY,
+                phone_key TEXT,
+                surname_code TEXT,
+                first_code TEXT,
+                email_key TEXT,
+                stale INTEGER NOT NULL DEFAULT 1
+            )""",
+            "CREATE INDEX IF NOT EXISTS ix_client_dedup_phone ON client_dedup_keys(phone_key)",
+            "CREATE INDEX IF NOT EXISTS ix_client_dedup_name ON client_dedup_keys(surname_code, first_code)",
+            "CREATE INDEX IF NOT EXISTS ix_client_dedup_email ON client_dedup_keys(email_key)",
+            "CREATE INDEX IF NOT EXISTS ix_client_dedup_stale ON client_dedup_keys(stale) WHERE stale = 1",
+            """CREATE TRIGGER IF NOT EXISTS clients_dedup_ai AFTER INSERT ON clients BEGIN
+                INSERT OR REPLACE INTO client_dedup_keys (client_id) VALUES (new.id);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS clients_dedup_au AFTER UPDATE OF first_name, last_name, email, phone_number ON clients BEGIN
+                UPDATE client_dedup_keys SET stale = 1 WHERE client_id = new.id;
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS clients_dedup_ad AFTER DELETE ON clients BEGIN
+                DELETE FROM client_dedup_keys WHERE client_id = old.id;
+            END""",
+        ]
+
+    def refresh(self):
+        with self.engine.begin() as conn:
+            return self._refresh(conn)
+
+    def _refresh(self, conn):
+        # keys of the clients added or changed since the last check; usually none or a few
+        refreshed = 0
+        while True:
+            rows = conn.execute(text(
+                "SELECT c.id, c.first_name, c.last_name, c.email, c.phone_number FROM client_dedup_keys k "
+                "JOIN clients c ON c.id = k.client_id WHERE k.stale = 1 LIMIT :limit"
+            ), {"limit": REFRESH_BATCH}).all()
+            if not rows:
+                return refreshed
+            conn.execute(text(
+                "UPDATE client_dedup_keys SET phone_key = :phone, surname_code = :surname, first_code = :first, "
+                "email_key = :email, stale = 0 WHERE client_id = :id"
+            ), [dict(zip(("phone", "surname", "first", "email"), blocking_keys(DuplicateClient(*row))), id=row[0])
+                for row in rows])
+            refreshed += len(rows)
+
+    def check(self, first_name, last_name, email, phone_number, exclude_id=None, threshold=CHECK_THRESHOLD, limit=5):
+        # existing clients that may be the one being entered, most similar first
+        probe = _Compared(DuplicateClient(None, first_name, last_name, email, phone_number))
+        phone, surname, first, email_local = blocking_keys(probe.client)
+        with self.engine.begin() as conn:
+            self._refresh(conn)
+            ids = set()
+            lookups = [("phone_key = :value", phone), ("email_key = :value", email_local)]
+            if surname:
+                # same surname code and first name codes sharing their start: a typo late in the
+                # first name still matches, a common surname does not flood the candidates
+                lookups.append(("surname_code = :surname AND first_code >= :value AND first_code < :value || ':'", first[:2]))
+            for where, value in lookups:
+                if value is None:
+                    continue
+                ids.update(row_id for row_id, in conn.execute(text(
+                    f"SELECT client_id FROM client_dedup_keys WHERE {where} LIMIT :limit"
+                ), {"value": value, "surname": surname, "limit": CANDIDATE_LIMIT}))
+            ids.discard(exclude_id)
+            if not ids:
+                return []
+            candidates = [DuplicateClient(*row) for row in conn.execute(text(
+                "SELECT id, first_name, last_name, email, phone_number FROM clients "
+                f"WHERE id IN ({', '.join(str(int(row_id)) for row_id in ids)})"
+            ))]
+        scored = [DuplicateMatch(_score(probe, _Compared(candidate)), candidate) for candidate in candidates]
+        scored = [match for match in scored if match.score >= threshold]
+        scored.sort(key=lambda match: (-match.score, match.client.id))
+        return scored[:limit]
+
+    def report(self, threshold=REPORT_THRESHOLD, window=WINDOW, progress=None):
+        # every pair of clients scoring at least threshold, best first. One pass over the table
+        # per blocking key in index order; a pair found through several keys is scored once.
+        with self.engine.begin() as conn:
+            self._refresh(conn)
+        seen = set()
+        pairs = []
+        compared = 0
+        for key, order in (("phone_key", "phone_key"), ("email_key", "email_key"),
+                           ("surname_code", "surname_code, first_code")):
+            block, current = [], None
+            with self.engine.connect() as conn:
+                # clients alone in their block are never read
+                rows = conn.execute(text(
+                    f"SELECT k.{key}, c.id, c.first_name, c.last_name, c.email, c.phone_number FROM client_dedup_keys k "
+                    f"JOIN clients c ON c.id = k.client_id WHERE k.{key} IN "
+                    f"(SELECT {key} FROM client_dedup_keys WHERE {key} IS NOT NULL GROUP BY {key} HAVING count(*) > 1) "
+                    f"ORDER BY {order}, k.client_id"
+                ))
+                for value, *client in rows:
+                    if value != current:
+                        compared += self._compare_block(block, window, threshold, seen, pairs)
+                        block, current = [], value
+                    block.append(DuplicateClient(*client))
+                compared += self._compare_block(block, window, threshold, seen, pairs)
+            if progress:
+                progress(key, compared, len(pairs))
+        pairs.sort(key=lambda pair: (-pair.score, pair.first.id, pair.second.id))
+        return pairs
+
+    @staticmethod
+    def _compare_block(block, window, threshold, seen, pairs):
+        compared = 0
+        block = [_Compared(client) for client in block]
+        for i, a in enumerate(block):
+            for b in block[i + 1:i + 1 + window]:
+                pair = (a.client.id, b.client.id) if a.client.id < b.client.id else (b.client.id, a.client.id)
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                compared += 1
+                similarity = _score(a, b)
+                if similarity >= threshold:
+                    first, second = (a, b) if a.client.id < b.client.id else (b, a)
+                    pairs.append(DuplicatePair(similarity, first.client, second.client))
+        return compared
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report clients that are probably entered twice.")
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--threshold", type=float, default=REPORT_THRESHOLD)
+    parser.add_argument("--limit", type=int, default=100, help="pairs to print, best first")
+    args = parser.parse_args(argv)
+
+    from database_manager import DatabaseManager
+
+    database_manager = DatabaseManager(args.db)
+    start = time.perf_counter()
+    pairs = database_manager.duplicates.report(
+        args.threshold, progress=lambda key, compared, found: print(f"{key:<14} {compared:10} pairs compared, {found} found")
+    )
+    for pair in pairs[:args.limit]:
+        print(f"{pair.score:.2f}  #{pair.first.id} {pair.first.first_name} {pair.first.last_name} <{pair.first.email}> "
+              f"{pair.first.phone_number}  |  #{pair.second.id} {pair.second.first_name} {pair.second.last_name} "
+              f"<{pair.second.email}> {pair.second.phone_number}")
+    print(f"{len(pairs)} possible duplicates in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+import cProfile
+import functools
+import inspect
+import io
+import json
+import pstats
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# identical SELECTs (ignoring parameter values) run more often than this within one operation
+# are reported as N+1 patterns, e.g. a lazy load per receipt
+N_PLUS_ONE_THRESHOLD = 5
+# upper bucket bounds of the latency histograms in milliseconds, the last bucket is open
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_IN_LIST = re.compile(r"\((\s*\?\s*,)+\s*\?\s*\)")
+# ids written into the SQL text, e.g. sync.py and duplicates.py
+_LITERAL_IN_LIST = re.compile(r"\bIN \((\s*-?\d+\s*,)*\s*-?\d+\s*\)", re.IGNORECASE)
+
+
+def normalize(statement):
+    # collapses whitespace and IN lists so statements differing only in their values compare equal
+    return _LITERAL_IN_LIST.sub("IN (?)", _IN_LIST.sub("(?)", " ".join(statement.split())))
+
+
+class StatementCounter:
+    # records every statement an engine executes while active (a context manager), grouped by
+    # the label of the operation() block that was current on the executing thread
+    def __init__(self, engine, threshold=N_PLUS_ONE_THRESHOLD):
+        self.engine = engine
+        self.threshold = threshold
+        self.statements = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        operation = getattr(self.local, "operation", None)
+        # executemany passes a list of parameter sets, except for the ORM's one-row-at-a-time
+        # inserts with RETURNING, which are flagged executemany but pass a single set
+        if executemany and isinstance(parameters, list):
+            parameters = parameters[0] if parameters else ()
+        with self.lock:
+            self.statements.append((operation, statement, parameters))
+
+    @contextmanager
+    def operation(self, label):
+        previous = getattr(self.local, "operation", None)
+        self.local.operation = label
+        try:
+            yield self
+        finally:
+            self.local.operation = previous
+
+    def reset(self):
+        with self.lock:
+            del self.statements[:]
+
+    def recorded(self, operation=None):
+        with self.lock:
+            return [(statement, parameters) for op, statement, parameters in self.statements
+                    if operation is None or op == operation]
+
+    def counts(self):
+        with self.lock:
+            return dict(Counter(operation for operation, _, _ in self.statements))
+
+    def n_plus_one(self, threshold=None):
+        threshold = self.threshold if threshold is None else threshold
+        with self.lock:
+            repeated = Counter(
+                (operation, normalize(statement)) for operation, statement, _ in self.statements
+                if statement.lstrip()[:6].upper() == "SELECT"
+            )
+        return [(operation, statement, times) for (operation, statement), times in repeated.items() if times > threshold]
+
+
+class Histogram:
+    # latency distribution in fixed buckets, cheap to record and small to dump
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.buckets[bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding that share of the samples, never above the maximum
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_MS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max_ms,
+            "buckets": {f"<={bound}" if i < len(HISTOGRAM_BOUNDS_MS) else f">{HISTOGRAM_BOUNDS_MS[-1]}": count
+                        for i, (bound, count) in enumerate(zip(HISTOGRAM_BOUNDS_MS + (None,), self.buckets)) if count},
+        }
+
+
+class Metrics:
+    # per-operation latency histograms with the SQL statements and SQL time spent inside each
+    # operation, so slow calls can be split into SQLite, ORM hydration and Qt work. Operations
+    # nest per thread; a statement counts towards every operation open on its thread.
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.operations = {}
+        self.statements = {}
+        self.engines = []
+        self.profiler_stats = None
+
+    def attach(self, engine):
+        if engine in self.engines:
+            return
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        self.engines.append(engine)
+
+    def detach(self, engine):
+        if engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._before_execute)
+            event.remove(engine, "after_cursor_execute", self._after_execute)
+            self.engines.remove(engine)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # kept on the execution context, a statement that raises leaves nothing behind
+        context.metrics_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "metrics_started", None)
+        if started is None:
+            return
+        ms = (time.perf_counter() - started) * 1000
+        if not self.enabled:
+            return
+        for frame in getattr(self.local, "stack", ()):
+            frame[1] += 1
+            frame[2] += ms
+        key = normalize(statement)
+        with self.lock:
+            histogram = self.statements.get(key)
+            if histogram is None:
+                histogram = self.statements[key] = Histogram()
+            histogram.add(ms)
+
+    @contextmanager
+    def timed(self, kind, name):
+        if not self.enabled:
+            yield
+            return
+        stack = self.local.__dict__.setdefault("stack", [])
+        # [name, statements, sql ms]
+        frame = [name, 0, 0.0]
+        profiler = self._start_profiler() if not stack else None
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            stack.pop()
+            if profiler is not None:
+                self._stop_profiler(profiler)
+            self.record(kind, name, ms, frame[1], frame[2])
+
+    def record(self, kind, name, ms, statements=0, sql_ms=0.0):
+        with self.lock:
+            entry = self.operations.get((kind, name))
+            if entry is None:
+                entry = self.operations[(kind, name)] = [Histogram(), 0, 0.0]
+            entry[0].add(ms)
+            entry[1] += statements
+            entry[2] += sql_ms
+
+    def instrument(self, kind, name=None):
+        # decorator; the operation is named after the function unless a name is given
+        def decorate(function):
+            label = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timed(kind, label):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def instrument_class(self, kind):
+        # class decorator timing every public method; generators and context managers
+        # (session_scope) are skipped, their time is spent after they return
+        def decorate(cls):
+            for attribute, function in list(vars(cls).items()):
+                if attribute.startswith("_") or not inspect.isfunction(function) or hasattr(function, "__wrapped__") \
+                        or inspect.isgeneratorfunction(function):
+                    continue
+                setattr(cls, attribute, self.instrument(kind)(function))
+            return cls
+        return decorate
+
+    def start_profile(self):
+        # cProfile works per thread, so every outermost operation on any thread gets its own
+        # profiler while capturing and the results are merged
+        with self.lock:
+            self.profiler_stats = pstats.Stats()
+
+    def stop_profile(self, path=None, limit=40):
+        # report of the slowest functions by cumulative time, the raw stats go to path if given
+        with self.lock:
+            stats, self.profiler_stats = self.profiler_stats, None
+        if stats is None or not stats.stats:
+            return ""
+        if path:
+            stats.dump_stats(path)
+        output = io.StringIO()
+        stats.stream = output
+        stats.sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
+
+    @property
+    def profiling(self):
+        return self.profiler_stats is not None
+
+    def _start_profiler(self):
+        if self.profiler_stats is None:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler or debugger is active on this thread
+            return None
+        return profiler
+
+    def _stop_profiler(self, profiler):
+        profiler.disable()
+        with self.lock:
+            if self.profiler_stats is not None:
+                self.profiler_stats.add(profiler)
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.statements = {}
+
+    def snapshot(self, slowest_statements=50):
+        with self.lock:
+            operations = [
+                dict(histogram.as_dict(), kind=kind, name=name, statements=statements,
+                     statements_per_call=statements / histogram.count, sql_ms=sql_ms,
+                     sql_share=sql_ms / histogram.total_ms if histogram.total_ms else 0.0)
+                for (kind, name), (histogram, statements, sql_ms) in self.operations.items()
+            ]
+            statements = [dict(histogram.as_dict(), statement=statement) for statement, histogram in self.statements.items()]
+        operations.sort(key=lambda entry: entry["count"] * entry["mean_ms"], reverse=True)
+        statements.sort(key=lambda entry: entry["count"] * entry["mean_ms"], reverse=True)
+        return {"operations": operations, "statements": statements[:slowest_statements]}
+
+    def dump(self, path, extra=None):
+        data = self.snapshot()
+        data["written"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        if extra:
+            data.update(extra)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+# shared by DatabaseManager, the dialogs and the diagnostics dialog
+metrics = Metrics()
@@ -0,0 +1,296 @@
+import argparse
+import html
+import json
+import sys
+import threading
+from collections import namedtuple, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from sqlalchemy import text
+
+from client_search import search_tokens, prefix_query
+from instrumentation import metrics
+
+DEFAULT_LIMIT = 20
+RENDER_CACHE_SIZE = 256
+# column weights for bm25, a hit in the title or question counts more than one in the body
+ARTICLE_WEIGHTS = (10.0, 1.0, 2.0)  # title, body, author
+FAQ_WEIGHTS = (5.0, 1.0)  # question, answers
+# snippet() markers, replaced by <mark> after escaping the text around them
+MARK_START, MARK_END = "\x02", "\x03"
+
+KnowledgeHit = namedtuple("KnowledgeHit", ["kind", "id", "article_id", "title", "snippet", "score"])
+
+
+def highlight(snippet):
+    # html-escaped snippet with the matched terms wrapped in <mark>
+    return html.escape(snippet or "").replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+@metrics.instrument_class("database")
+class KnowledgeBase:
+    # FTS5 search over articles and FAQ entries plus cached article pages; page versions are
+    # bumped by triggers, so edits made by any process invalidate the cache
+    def __init__(self, engine, cache_size=RENDER_CACHE_SIZE):
+        self.engine = engine
+        self.available = False
+        self.cache_size = cache_size
+        self.render_cache = OrderedDict()
+        self.render_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def install(self):
+        with self.engine.begin() as conn:
+            if "ENABLE_FTS5" not in [row[0] for row in conn.execute(text("PRAGMA compile_options"))]:
+                return False
+            created = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'articles_fts'"
+            )).first() is None
+            for statement in self.ddl():
+                conn.execute(text(statement))
+            if created:
+                self._rebuild(conn)
+        self.available = True
+        return True
+
+    def check_installed(self):
+        with self.engine.connect() as conn:
+            self.available = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'articles_fts'"
+            )).first() is not None
+        return self.available
+
+    def ddl(self):
+        bump = """INSERT INTO knowledge_base_versions (article_id, version) VALUES ({article}, 1)
+                ON CONFLICT (article_id) DO UPDATE SET version = version + 1;"""
+        return [
+            """CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+                title, body, author,
+                content='articles', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )""",
+            """CREATE VIRTUAL TABLE IF NOT EXISTS faq_fts USING fts5(
+                question, answers,
+                content='faq', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )""",
+            # ORDER BY rank lets FTS5 sort by these weights itself, so snippet() only runs for the rows returned
+            f"INSERT INTO articles_fts(articles_fts, rank) VALUES ('rank', 'bm25({', '.join(map(str, ARTICLE_WEIGHTS))})')",
+            f"INSERT INTO faq_fts(faq_fts, rank) VALUES ('rank', 'bm25({', '.join(map(str, FAQ_WEIGHTS))})')",
+            """CREATE TABLE IF NOT EXISTS knowledge_base_versions (
+                article_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            )""",
+            """CREATE TRIGGER IF NOT EXISTS articles_kb_ai AFTER INSERT ON articles BEGIN
+                INSERT INTO articles_fts(rowid, title, body, author) VALUES (new.id, new.title, new.body, new.author);
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS articles_kb_ad AFTER DELETE ON articles BEGIN
+                INSERT INTO articles_fts(articles_fts, rowid, title, body, author)
+                VALUES ('delete', old.id, old.title, old.body, old.author);
+                {bump.format(article="old.id")}
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS articles_kb_au AFTER UPDATE ON articles BEGIN
+                INSERT INTO articles_fts(articles_fts, rowid, title, body, author)
+                VALUES ('delete', old.id, old.title, old.body, old.author);
+                INSERT INTO articles_fts(rowid, title, body, author) VALUES (new.id, new.title, new.body, new.author);
+                {bump.format(article="old.id")}
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS faq_kb_ai AFTER INSERT ON faq BEGIN
+                INSERT INTO faq_fts(rowid, question, answers) VALUES (new.id, new.question, new.answers);
+                {bump.format(article="coalesce(new.article_id, 0)")}
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS faq_kb_ad AFTER DELETE ON faq BEGIN
+                INSERT INTO faq_fts(faq_fts, rowid, question, answers) VALUES ('delete', old.id, old.question, old.answers);
+                {bump.format(article="coalesce(old.article_id, 0)")}
+            END""",
+            f"""CREATE TRIGGER IF NOT EXISTS faq_kb_au AFTER UPDATE ON faq BEGIN
+                INSERT INTO faq_fts(faq_fts, rowid, question, answers) VALUES ('delete', old.id, old.question, old.answers);
+                INSERT INTO faq_fts(rowid, question, answers) VALUES (new.id, new.question, new.answers);
+                {bump.format(article="coalesce(old.article_id, 0)")}
+                {bump.format(article="coalesce(new.article_id, 0)")}
+            END""",
+        ]
+
+    def rebuild(self):
+        with self.engine.begin() as conn:
+            self._rebuild(conn)
+
+    def _rebuild(self, conn):
+        conn.execute(text("INSERT INTO articles_fts(articles_fts) VALUES ('rebuild')"))
+        conn.execute(text("INSERT INTO faq_fts(faq_fts) VALUES ('rebuild')"))
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        # articles and FAQ entries matching every term as a prefix, best first. bm25 scores of the
+        # two FTS tables are not comparable, each is scaled by its table's best match (1.0)
+        terms = search_tokens(query)
+        if not terms:
+            return []
+        params = {"match": prefix_query(terms), "limit": limit}
+        with self.engine.connect() as conn:
+            if not self.available:
+                return self._scan(conn, terms, limit)
+            articles = conn.execute(text(
+                f"SELECT 'article', f.rowid, f.rowid, a.title, "
+                f"snippet(articles_fts, -1, '{MARK_START}', '{MARK_END}', '…', 16), f.rank "
+                "FROM articles_fts f JOIN articles a ON a.id = f.rowid "
+                "WHERE articles_fts MATCH :match ORDER BY f.rank LIMIT :limit"
+            ), params).all()
+            faqs = conn.execute(text(
+                f"SELECT 'faq', f.rowid, q.article_id, q.question, "
+                f"snippet(faq_fts, 1, '{MARK_START}', '{MARK_END}', '…', 16), f.rank "
+                "FROM faq_fts f JOIN faq q ON q.id = f.rowid "
+                "WHERE faq_fts MATCH :match ORDER BY f.rank LIMIT :limit"
+            ), params).all()
+        hits = []
+        for rows in (articles, faqs):
+            # bm25 is negative and lower for better matches, rows are sorted best first
+            best = rows[0][5] if rows and rows[0][5] < 0 else None
+            hits.extend(KnowledgeHit(kind, id_, article_id, title, highlight(snippet), score / best if best else 0.0)
+                        for kind, id_, article_id, title, snippet, score in rows)
+        hits.sort(key=lambda hit: -hit.score)
+        return hits[:limit]
+
+    def _scan(self, conn, terms, limit):
+        # fallback for sqlite builds without FTS5: unranked LIKE scan
+        where = " AND ".join(f"(title LIKE :t{i} OR body LIKE :t{i})" for i in range(len(terms)))
+        params = {f"t{i}": f"%{term}%" for i, term in enumerate(terms)}
+        params["limit"] = limit
+        rows = conn.execute(text(f"SELECT id, title, substr(body, 1, 200) FROM articles WHERE {where} LIMIT :limit"), params)
+        return [KnowledgeHit("article", id_, id_, title, html.escape(body or ""), 0.0) for id_, title, body in rows]
+
+    def _version(self, conn, article_id):
+        return conn.execute(text(
+            "SELECT version FROM knowledge_base_versions WHERE article_id = :id"
+        ), {"id": article_id}).scalar() or 0
+
+    def render_article(self, article_id):
+        # the HTML page of an article with its FAQ; one primary key lookup when cached
+        with self.engine.connect() as conn:
+            version = self._version(conn, article_id)
+            with self.render_lock:
+                cached = self.render_cache.get(article_id)
+                if cached is not None and cached[0] == version:
+                    self.render_cache.move_to_end(article_id)
+                    self.hits += 1
+                    return cached[1]
+                self.misses += 1
+
+            article = conn.execute(text(
+                "SELECT title, body, author, published, link FROM articles WHERE id = :id"
+            ), {"id": article_id}).first()
+            if article is None:
+                return None
+            faqs = conn.execute(text(
+                "SELECT question, answers FROM faq WHERE article_id = :id ORDER BY id"
+            ), {"id": article_id}).all()
+
+        page = self._render(article, faqs)
+        with self.render_lock:
+            self.render_cache[article_id] = (version, page)
+            self.render_cache.move_to_end(article_id)
+            while len(self.render_cache) > self.cache_size:
+                self.render_cache.popitem(last=False)
+        return page
+
+    def _render(self, article, faqs):
+        title, body, author, published, link = article
+        parts = [
+            "<!DOCTYPE html>",
+            f"<html lang=\"de\"><head><meta charset=\"utf-8\"><title>{html.escape(title or '')}</title></head><body>",
+            f"<article><h1>{html.escape(title or '')}</h1>",
+        ]
+        byline = " · ".join(html.escape(str(value)) for value in (author, published) if value)
+        if byline:
+            parts.append(f"<p class=\"byline\">{byline}</p>")
+        for paragraph in (body or "").split("\n\n"):
+            if paragraph.strip():
+                parts.append(f"<p>{html.escape(paragraph.strip())}</p>")
+        if link:
+            parts.append(f"<p><a href=\"{html.escape(link, quote=True)}\">{html.escape(link)}</a></p>")
+        parts.append("</article>")
+        if faqs:
+            parts.append("<section class=\"faq\"><h2>Häufige Fragen</h2><dl>")
+            for question, answers in faqs:
+                parts.append(f"<dt>{html.escape(question or '')}</dt><dd>{html.escape(answers or '')}</dd>")
+            parts.append("</dl></section>")
+        parts.append("</body></html>")
+        return "\n".join(parts)
+
+
+class KnowledgeBaseHandler(BaseHTTPRequestHandler):
+    # read-only endpoints: GET /search?q=...&limit=..  (JSON) and GET /articles/<id> (HTML)
+    knowledge_base = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == "/search":
+                query = parse_qs(url.query)
+                limit = min(int(query.get("limit", [DEFAULT_LIMIT])[0]), 100)
+                hits = self.knowledge_base.search(query.get("q", [""])[0], limit)
+                self._send(200, "application/json", json.dumps([hit._asdict() for hit in hits], ensure_ascii=False))
+            elif url.path.startswith("/articles/") and url.path[len("/articles/"):].isdigit():
+                page = self.knowledge_base.render_article(int(url.path[len("/articles/"):]))
+                if page is None:
+                    self._send(404, "text/plain", "Not found")
+                else:
+                    self._send(200, "text/html", page)
+            else:
+                self._send(404, "text/plain", "Not found")
+        except ValueError:
+            self._send(400, "text/plain", "Bad request")
+        except Exception as e:
+            self._send(500, "text/plain", f"Failed to read knowledge base: {e}")
+
+    def _send(self, status, content_type, body):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # one line per request on stderr is too much under load
+        pass
+
+
+def make_server(knowledge_base, host="127.0.0.1", port=8765):
+    handler = type("Handler", (KnowledgeBaseHandler,), {"knowledge_base": knowledge_base})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Knowledge base search and local read endpoint.")
+    parser.add_argument("command", choices=["serve", "search", "rebuild"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    from database_manager import DatabaseManager
+
+    knowledge_base = DatabaseManager(args.db).knowledge_base
+    if args.command == "rebuild":
+        knowledge_base.rebuild()
+        print("knowledge base index rebuilt")
+    elif args.command == "search":
+        for hit in knowledge_base.search(args.query):
+            print(f"{hit.score:7.2f}  {hit.kind:<7} {hit.id:>6}  {hit.title}")
+            print(f"         {hit.snippet}")
+    else:
+        server = make_server(knowledge_base, args.host, args.port)
+        print(f"serving on http://{args.host}:{server.server_port}/search?q=...")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
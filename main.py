@@ -1,12 +1,20 @@
+import os
 import sys
+import time
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QLabel, QWidget, QVBoxLayout, QPushButton,
-    QMessageBox, QDialog, QFormLayout, QLineEdit, QDialogButtonBox, QHBoxLayout,
-    QTableWidget, QTableWidgetItem
+    QApplication, QMainWindow, QLabel, QWidget, QVBoxLayout, QPushButton, QMessageBox, QShortcut
 )
-from PyQt5.QtGui import QIcon, QFont
-from PyQt5.QtCore import Qt
-from database_manager import DatabaseManager
+from PyQt5.QtGui import QIcon, QFont, QKeySequence
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
+
+# the database layer and the dialogs are imported lazily, the window shows before either is loaded
+DATABASE_URL = "sqlite:///PrimalArtDB.db"
+# when set, performance metrics are written to this JSON file on exit
+METRICS_DUMP_ENV = "PRIMAL_ART_METRICS"
+# backup directory, next to the database file when not set
+BACKUP_DIR_ENV = "PRIMAL_ART_BACKUP_DIR"
+# a backup is taken after start when the newest one is older than this
+BACKUP_INTERVAL_HOURS = 24
 
 icon_path = "Needs to be filled"
 colors = {
@@ -16,283 +24,49 @@ colors = {
 }
 
 
-class UpdateClientDialog(QDialog):
-    def __init__(self, database_manager, client, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("Update Client")
-        self.database_manager = database_manager
-        self.client = client
-        self.init_ui()
-
-    def init_ui(self):
-        layout = QFormLayout(self)
-
-        # input fields
-        self.first_name_input = QLineEdit(self.client.first_name, self)
-        self.last_name_input = QLineEdit(self.client.last_name, self)
-        self.email_input = QLineEdit(self.client.email, self)
-        self.phone_input = QLineEdit(self.client.phone_number, self)
-        self.address_input = QLineEdit(self.client.address, self)
-        self.notes_input = QLineEdit(self.client.notes, self)
-        self.receipts_input = QLineEdit(self.client.receipts, self)
-        layout.addRow("Vorname:", self.first_name_input)
-        layout.addRow("Nachname:", self.last_name_input)
-        layout.addRow("E-Mail:", self.email_input)
-        layout.addRow("Telefonnummer:", self.phone_input)
-        layout.addRow("Adresse:", self.address_input)
-        layout.addRow("Notizen:", self.notes_input)
-        layout.addRow("Rechnungen:", self.receipts_input)
-
-        # dialog buttons
-        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
-        self.buttons.accepted.connect(self.accept)
-        self.buttons.rejected.connect(self.reject)
-        layout.addWidget(self.buttons)
-
-    def accept(self):
-        first_name = self.first_name_input.text().strip()
-        last_name = self.last_name_input.text().strip()
-        email = self.email_input.text().strip()
-        phone = self.phone_input.text().strip()
-        address = self.address_input.text().strip()
-        notes = self.notes_input.text().strip()
-        receipts = self.receipts_input.text().strip()
-
-        if not first_name or not last_name or not email:
-            QMessageBox.warning(self, "Input Error", "Please provide both name and email.")
-            return
-        try:
-            self.database_manager.update_client(self.client.id, first_name, last_name, email, phone, address, notes, receipts)
-            QMessageBox.information(self, "Success", "Client updated successfully!")
-            super().accept()
-        except RuntimeError as e:
-            QMessageBox.critical(self, "Error", str(e))
-
+class DatabaseLoader(QThread):
+    # imports SQLAlchemy and opens (and if needed creates or upgrades) the database off the GUI thread
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    # label, rows done, rows total while a migration backfills data
+    progress = pyqtSignal(str, int, int)
 
-class SearchClientDialog(QDialog):
-    # search via client name, email, address
-    def __init__(self, database_manager, parent=None):
+    def __init__(self, db_url, parent=None):
         super().__init__(parent)
-        self.setWindowTitle("Klienten Suchen")
-        self.database_manager = database_manager
-        self.init_ui()
-
-    def init_ui(self):
-        layout = QFormLayout(self)
-
-        # input fields for search criteria
-        self.name_input = QLineEdit(self)
-        self.email_input = QLineEdit(self)
-        self.phone_input = QLineEdit(self)
-        layout.addRow("Name:", self.name_input)
-        layout.addRow("E-Mail:", self.email_input)
-        layout.addRow("Telefonnummer:", self.phone_input)
-
-        # search button
-        self.search_button = QPushButton("Suche", self)
-        self.search_button.clicked.connect(self.perform_search)
-        layout.addWidget(self.search_button)
-
-        # table to display results
-        self.results_table = QTableWidget(self)
-        self.results_table.setColumnCount(5)
-        self.results_table.setHorizontalHeaderLabels(["Vorname", "Nachname", "E-Mail", "Telefon", "Adresse"])
-        layout.addWidget(self.results_table)
-
-    def perform_search(self):
-        name = self.name_input.text().strip()
-        email = self.email_input.text().strip()
-        phone = self.phone_input.text().strip()
+        self.db_url = db_url
 
+    def run(self):
         try:
-            results = self.database_manager.search_clients(name, email, phone)
-            self.results_table.setRowCount(len(results))
-            for row, client in enumerate(results):
-                self.results_table.setItem(row, 0, QTableWidgetItem(client.first_name))
-                self.results_table.setItem(row, 1, QTableWidgetItem(client.last_name))
-                self.results_table.setItem(row, 2, QTableWidgetItem(client.email))
-                self.results_table.setItem(row, 3, QTableWidgetItem(client.phone_number))
-                self.results_table.setItem(row, 4, QTableWidgetItem(client.address))
-        except RuntimeError as e:
-            QMessageBox.critical(self, "Error", str(e))
-
-
-class AddReceiptDialog(QDialog):
-    def __init__(self, database_manager, client, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle(f"Add Receipt for {client.first_name} {client.last_name} Client ID: {client.id}")
-        self.database_manager = database_manager
-        self.client = client
-        self.init_ui()
-
-    def init_ui(self):
-        layout = QFormLayout(self)
-
-        # input fields
-        self.receipt_number_input = QLineEdit(self)
-        self.amount_input = QLineEdit(self)
-        self.date_input = QLineEdit(self)
-        layout.addRow("Receipt Number:", self.receipt_number_input)
-        layout.addRow("Amount:", self.amount_input)
-        layout.addRow("Date:", self.date_input)
-
-        # dialog buttons
-        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
-        self.buttons.accepted.connect(self.accept)
-        self.buttons.rejected.connect(self.reject)
-        layout.addWidget(self.buttons)
-
-    def accept(self):
-        receipt_number = self.receipt_number_input.text().strip()
-        amount = self.amount_input.text().strip()
-        date = self.date_input.text().strip()
-
-        if not receipt_number or not amount or not date:
-            QMessageBox.warning(self, "Input Error", "All fields are required")
-            return
+            from database_manager import DatabaseManager
+            self.loaded.emit(DatabaseManager(self.db_url, progress=self.progress.emit,
+                                             backup_dir=os.environ.get(BACKUP_DIR_ENV)))
+        except Exception as e:
+            self.failed.emit(str(e))
 
-        try:
-            self.database_manager.add_receipt(self.client.id, receipt_number, amount, date)
-            QMessageBox.information(self, "Success", "Receipt added successfully!")
-            super().accept()
-        except RuntimeError as e:
-            QMessageBox.critical(self, "Error", str(e))
 
+class BackupRunner(QThread):
+    # takes a backup off the GUI thread; the database stays usable meanwhile
+    finished_backup = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    # stage, done, total
+    progress = pyqtSignal(str, int, int)
 
-class NewClientDialog(QDialog):
-    def __init__(self, database_manager, parent=None):
+    def __init__(self, backups, parent=None):
         super().__init__(parent)
-        self.setWindowTitle("Neuen Klienten Hinzufügen")
-        self.database_manager = database_manager
-        self.init_ui()
-
-    def init_ui(self):
-        layout = QFormLayout(self)
-
-        # input fields
-        self.first_name_input = QLineEdit(self)
-        self.last_name_input = QLineEdit(self)
-        self.email_input = QLineEdit(self)
-        self.phone_number = QLineEdit(self)
-        self.address = QLineEdit(self)
-        self.notes = QLineEdit(self)
-        # requires a function to add receipts to a client.
-        layout.addRow("Vorname:", self.first_name_input)
-        layout.addRow("Nachname:", self.last_name_input)
-        layout.addRow("E-Mail:", self.email_input)
-        layout.addRow("Telefonnummer:", self.phone_number)
-        layout.addRow("Wohnadresse:", self.address)
-        layout.addRow("Notizen:", self.notes)
-
-        # Dialog buttons
-        self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, self)
-        self.buttons.accepted.connect(self.accept)
-        self.buttons.rejected.connect(self.reject)
-        layout.addWidget(self.buttons)
-
-    def accept(self):
-        first_name = self.first_name_input.text().strip()
-        last_name = self.last_name_input.text().strip()
-        email = self.email_input.text().strip()
-        phone_number = self.phone_number.text().strip()
-        address = self.address.text().strip()
-        notes = self.notes.text().strip()
-
-        if not first_name or not last_name or not email or not phone_number or not address:
-            QMessageBox.warning(self, "Input Error", f"Client: {self.name} Email: {self.email} added successfully!")
-            return
+        self.backups = backups
 
+    def run(self):
+        from backup import BackupCancelled
         try:
-            self.database_manager.add_client(first_name, last_name, email, phone_number, address, notes)
-            QMessageBox.information(self, "Success", "Client added successfully!")
-        except RuntimeError as e:
-            QMessageBox.critical(self, "Error", str(e))
-
-
-class ViewClientsDialog(QDialog):
-    def __init__(self, database_manager, parent=None):
-        super().__init__(parent)
-        self.setWindowTitle("View Clients")
-        self.database_manager = database_manager
-        self.init_ui()
-
-    def init_ui(self):
-        layout = QVBoxLayout(self)
-
-        # table widget to display clients
-        self.table = QTableWidget(self)
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(["Vorname", "Nachname", "E-Mail", "Adresse", "Telefonnummer", "Notizen"])
-        layout.addWidget(self.table)
-
-        # update and del buttons
-        self.update_button = QPushButton("Update Selected Client", self)
-        self.update_button.clicked.connect(self.update_selected_client)
-        layout.addWidget(self.update_button)
-
-        self.delete_button = QPushButton("Delete Selected Client", self)
-        self.delete_button.clicked.connect(self.delete_selected_client)
-        layout.addWidget(self.delete_button)
-
-        self.populate_table()
-
-    def populate_table(self):
-        try:
-            clients = self.database_manager.get_all_clients()
-            self.table.setRowCount(len(clients))
-
-            for row, client in enumerate(clients):
-                self.table.setItem(row, 0, QTableWidgetItem(client.first_name))
-                self.table.setItem(row, 1, QTableWidgetItem(client.last_name))
-                self.table.setItem(row, 2, QTableWidgetItem(client.email))
-                self.table.setItem(row, 3, QTableWidgetItem(client.address))
-                self.table.setItem(row, 4, QTableWidgetItem(client.phone_number))
-                self.table.setItem(row, 5, QTableWidgetItem(client.notes or "empty"))
-
-        except RuntimeError as e:
-            QMessageBox.critical(self, "Error", str(e))
-
-    def get_selected_client(self):
-        selected_row = self.table.currentRow()
-        if selected_row == -1:
-            QMessageBox.warning(self, "Selection Error", "Please select a client first")
-            return None
-
-        first_name = self.table.item(selected_row, 0).text()
-        last_name = self.table.item(selected_row, 1).text()
-        email = self.table.item(selected_row, 2).text()
-        address = self.table.item(selected_row, 3).text()
-        phone = self.table.item(selected_row, 4).text()
-        notes = self.table.item(selected_row, 5).text()
-
-        if not all([first_name, last_name, email, address, phone, notes]):
-            QMessageBox.warning(self, "Selection Error", "One or more fields are missing for the selected client.")
-            return None
-
-        return self.database_manager.get_client_by_details(first_name, last_name, email, address, phone, notes)
-
-    def update_selected_client(self):
-        client = self.get_selected_client()
-        if client:
-            dialog = UpdateClientDialog(self.database_manager, client, self)
-            if dialog.exec_():
-                self.populate_table()
-
-    def delete_selected_client(self):
-        client = self.get_selected_client()
-        if client:
-            confirm = QMessageBox.question(self, "Confirm Delete", f"Are you sure you want to delete {client.first_name} {client.last_name}?", QMessageBox.Yes | QMessageBox.No)
-            if confirm == QMessageBox.Yes:
-                try:
-                    self.database_manager.delete_client(client.id)
-                    QMessageBox.information(self, "Success", "Client deleted successfully!")
-                    self.populate_table()
-                except RuntimeError as e:
-                    QMessageBox.critical(self, "Error", str(e))
+            self.finished_backup.emit(self.backups.backup(progress=self.progress.emit))
+        except BackupCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, db_url=DATABASE_URL):
         super().__init__()
         self.setWindowTitle("Primal Art Therapy")
 
@@ -306,16 +80,25 @@ class MainWindow(QMainWindow):
         self.setGeometry(100, 100, window_width, window_height)
         self.setWindowIcon(QIcon(icon_path))  # still need an Icon
 
-        # initialize db
-        try:
-            self.database_manager = DatabaseManager("sqlite:///PrimalArtDB.db")
-            self.db_connected = True
-        except Exception as e:
-            self.db_connected = False
-            QMessageBox.critical(self, "Database Error", f"Failed to connect to database: {e}")
+        self.database_manager = None
+        self.database = None
+        self.preview_service = None
+        self.diagnostics_dialog = None
+        self.backup_runner = None
+        self.db_connected = False
+        # closing waits for the loader, a migration must not be cut off
+        self.close_pending = False
 
         self.init_ui()
 
+        # initialize db in the background
+        self.database_loader = DatabaseLoader(db_url, self)
+        self.database_loader.loaded.connect(self._database_loaded)
+        self.database_loader.failed.connect(self._database_failed)
+        self.database_loader.progress.connect(self._database_progress)
+        self.database_loader.finished.connect(self._database_loader_finished)
+        self.database_loader.start()
+
     def init_ui(self):
         # create central widget
         central_widget = QWidget(self)
@@ -325,13 +108,9 @@ class MainWindow(QMainWindow):
         # Heading
         self._heading_label(layout)
 
-        # db connection status
-        if self.db_connected:
-            self.statusBar().setStyleSheet("color: #00ff00; font-style: italic;")
-            self.statusBar().showMessage("Connected to Database")
-        else:
-            self.statusBar().setStyleSheet("color: #ff0000; font-style: italic;")
-            self.statusBar().showMessage("Failed to Connect to Database")
+        # db connection status, updated once the loader finishes
+        self.statusBar().setStyleSheet("font-style: italic;")
+        self.statusBar().showMessage("Connecting to Database...")
 
         # Add client button
         self._add_client_button(layout)
@@ -342,6 +121,14 @@ class MainWindow(QMainWindow):
         # Search clients button
         self._search_clients_button(layout)
 
+        # Backup button
+        self._backup_button(layout)
+
+        self._set_buttons_enabled(False)
+
+        # hidden diagnostics for support
+        QShortcut(QKeySequence("Ctrl+Shift+D"), self, self._open_diagnostics_dialog)
+
         # Set Styles Via CSS
         self.setStyleSheet("""
             QPushButton{
@@ -352,6 +139,33 @@ class MainWindow(QMainWindow):
          }
         """)
 
+    def _set_buttons_enabled(self, enabled):
+        for button in (self.add_client_button, self.view_clients_button, self.search_clients_button):
+            button.setEnabled(enabled)
+        self.backup_button.setEnabled(enabled and self.backup_runner is None)
+
+    def _database_loaded(self, database_manager):
+        from async_db import AsyncDatabase
+        self.database_manager = database_manager
+        # dialogs go through this, so database latency never blocks the window
+        self.database = AsyncDatabase(database_manager, parent=self)
+        self.db_connected = True
+        self.statusBar().setStyleSheet("color: #00ff00; font-style: italic;")
+        self.statusBar().showMessage("Connected to Database")
+        self._set_buttons_enabled(True)
+        if not self.close_pending and self._backup_due():
+            self._start_backup()
+
+    def _database_progress(self, label, done, total):
+        percent = done * 100 // total if total else 100
+        self.statusBar().showMessage(f"Upgrading Database: {label} ({percent}%)")
+
+    def _database_failed(self, message):
+        self.db_connected = False
+        self.statusBar().setStyleSheet("color: #ff0000; font-style: italic;")
+        self.statusBar().showMessage("Failed to Connect to Database")
+        QMessageBox.critical(self, "Database Error", f"Failed to connect to database: {message}")
+
     def _heading_label(self, layout):
         # Heading Label
         label = QLabel("Primal Art Therapy", self)
@@ -386,25 +200,114 @@ class MainWindow(QMainWindow):
         self.search_clients_button.clicked.connect(self._open_search_clients_dialog)
         layout.addWidget(self.search_clients_button, alignment=Qt.AlignCenter)
 
+    def _backup_button(self, layout):
+        self.backup_button = QPushButton("Datensicherung", self)
+        self.backup_button.clicked.connect(self._start_backup)
+        layout.addWidget(self.backup_button, alignment=Qt.AlignCenter)
+
+    def _backup_due(self):
+        # only reads the manifest names, cheap enough for the GUI thread
+        backups = self.database_manager.backups
+        if backups is None:
+            return False
+        generations = backups.generations()
+        if not generations:
+            return True
+        newest = time.mktime(time.strptime(generations[0]["created"], "%Y-%m-%dT%H:%M:%S"))
+        return time.time() - newest > BACKUP_INTERVAL_HOURS * 3600
+
+    def _start_backup(self):
+        if self.backup_runner is not None or self.database_manager is None or self.database_manager.backups is None:
+            return
+        self.backup_runner = BackupRunner(self.database_manager.backups, self)
+        self.backup_runner.finished_backup.connect(self._backup_finished)
+        self.backup_runner.failed.connect(self._backup_failed)
+        self.backup_runner.progress.connect(self._backup_progress)
+        self.backup_runner.finished.connect(self._backup_done)
+        self.backup_button.setEnabled(False)
+        self.backup_runner.start()
+
+    def _backup_progress(self, stage, done, total):
+        labels = {"snapshot": "Kopie", "chunks": "Komprimieren", "images": "Belegbilder"}
+        percent = done * 100 // total if total else 100
+        self.statusBar().showMessage(f"Datensicherung: {labels.get(stage, stage)} ({percent}%)")
+
+    def _backup_finished(self, manifest):
+        from backup import MB
+        stats = manifest["stats"]
+        self.statusBar().showMessage(
+            f"Datensicherung fertig: {manifest['size'] / MB:.1f} MB in {stats['seconds']:.1f} s ({stats['mb_s']} MB/s), "
+            f"{(stats['new_chunk_bytes'] + stats['new_image_bytes']) / MB:.1f} MB neu gespeichert"
+        )
+
+    def _backup_failed(self, message):
+        QMessageBox.warning(self, "Datensicherung", f"Die Datensicherung ist fehlgeschlagen: {message}")
+
+    def _backup_done(self):
+        self.backup_runner.deleteLater()
+        self.backup_runner = None
+        self.backup_button.setEnabled(self.db_connected)
+
+    def _database_loader_finished(self):
+        if self.close_pending:
+            self.close()
+
+    def closeEvent(self, event):
+        if self.database_loader.isRunning():
+            self.close_pending = True
+            self.statusBar().showMessage("Die Datenbank wird noch vorbereitet, das Fenster schließt danach...")
+            event.ignore()
+            return
+        # a running backup is abandoned, its partial files are removed by the runner
+        if self.backup_runner is not None:
+            self.database_manager.backups.cancel()
+            self.backup_runner.wait()
+        super().closeEvent(event)
+
     def _open_new_client_dialog(self):
-        dialog = NewClientDialog(self.database_manager, self)
+        from dialogs import NewClientDialog
+        dialog = NewClientDialog(self.database, self)
         dialog.exec_()
 
     def _open_view_clients_dialog(self):
-        dialog = ViewClientsDialog(self.database_manager, self)
+        from dialogs import ViewClientsDialog
+        from receipt_previews import ThumbnailService
+        if self.preview_service is None:
+            # shared so thumbnails stay cached between dialogs
+            self.preview_service = ThumbnailService(self.database_manager.blob_store, parent=self)
+        dialog = ViewClientsDialog(self.database, self, self.preview_service)
         dialog.exec_()
 
     def _open_search_clients_dialog(self):
-        dialog = SearchClientDialog(self.database_manager, self)
+        from dialogs import SearchClientDialog
+        dialog = SearchClientDialog(self.database, self)
         dialog.exec_()
 
+    def _open_diagnostics_dialog(self):
+        # modeless, so the window can be used while watching the numbers
+        from dialogs import DiagnosticsDialog
+        if self.diagnostics_dialog is None:
+            self.diagnostics_dialog = DiagnosticsDialog(self.database_manager, self)
+        self.diagnostics_dialog.database_manager = self.database_manager
+        self.diagnostics_dialog.refresh()
+        self.diagnostics_dialog.show()
+        self.diagnostics_dialog.raise_()
+
 
 def main():
     app = QApplication(sys.argv)  # allows CLI args
     window = MainWindow()
     window.show()
+    metrics_path = os.environ.get(METRICS_DUMP_ENV)
+    if metrics_path:
+        app.aboutToQuit.connect(lambda: _dump_metrics(window, metrics_path))
     sys.exit(app.exec_())
 
 
+def _dump_metrics(window, path):
+    from instrumentation import metrics
+    metrics.dump(path, {"caches": window.database_manager.diagnostics()} if window.database_manager else None)
+
+
 if __name__ == '__main__':
     main()
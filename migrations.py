@@ -0,0 +1,254 @@
+import argparse
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect
+
+from blob_store import move_inline_images
+
+# schema_migrations records applied versions, schema_migration_progress the last id a
+# backfill step committed, so an interrupted backfill continues where it stopped
+BOOKKEEPING = (
+    """CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS schema_migration_progress (
+        version INTEGER NOT NULL,
+        step TEXT NOT NULL,
+        last_id INTEGER NOT NULL,
+        rows_done INTEGER NOT NULL,
+        PRIMARY KEY (version, step)
+    )""",
+)
+DEFAULT_BATCH_SIZE = 1000
+
+MIGRATIONS = []
+
+
+class Migration:
+    def __init__(self, version, name, upgrade):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+
+    def __str__(self):
+        return f"{self.version:04d} {self.name}"
+
+
+def migration(version, name):
+    # registers an upgrade(context) function; released versions are never edited or renumbered,
+    # and every step must be safe to repeat because a failed migration is run again from the start
+    def register(upgrade):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, name, upgrade))
+        return upgrade
+    return register
+
+
+def head():
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+class MigrationContext:
+    # what a migration gets to work with; schema helpers skip work that is already done
+    def __init__(self, migrator, migration):
+        self.engine = migrator.engine
+        self.blob_store = migrator.blob_store
+        self.batch_size = migrator.batch_size
+        self.migration = migration
+        self.progress = migrator.progress
+
+    def columns(self, table):
+        return {column["name"] for column in inspect(self.engine).get_columns(table)}
+
+    def execute(self, sql, parameters=()):
+        with self.engine.begin() as conn:
+            return conn.exec_driver_sql(sql, parameters)
+
+    def add_column(self, table, name, column_type):
+        if name not in self.columns(table):
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def rename_column(self, table, old, new):
+        # metadata only since SQLite 3.25, no table rewrite
+        columns = self.columns(table)
+        if old in columns and new not in columns:
+            self.execute(f"ALTER TABLE {table} RENAME COLUMN {old} TO {new}")
+
+    def create_index(self, name, table, columns):
+        self.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+
+    def backfill(self, step, table, apply, where=None, batch_size=None):
+        # calls apply(conn, ids) for rows in id order, one committed transaction per batch,
+        # so readers (WAL) and other writers are only held up for a single batch
+        batch_size = batch_size or self.batch_size
+        version = self.migration.version
+        condition = f" AND ({where})" if where else ""
+        with self.engine.connect() as conn:
+            row = conn.exec_driver_sql(
+                "SELECT last_id, rows_done FROM schema_migration_progress WHERE version = ? AND step = ?", (version, step)
+            ).first()
+            last_id, done = row if row else (0, 0)
+            total = done + conn.exec_driver_sql(
+                f"SELECT count(*) FROM {table} WHERE id > ?{condition}", (last_id,)
+            ).scalar()
+
+        label = f"{self.migration}: {step}"
+        if self.progress:
+            self.progress(label, done, total)
+        while True:
+            with self.engine.begin() as conn:
+                ids = [row[0] for row in conn.exec_driver_sql(
+                    f"SELECT id FROM {table} WHERE id > ?{condition} ORDER BY id LIMIT ?", (last_id, batch_size)
+                )]
+                if not ids:
+                    break
+                apply(conn, ids)
+                last_id = ids[-1]
+                done += len(ids)
+                conn.exec_driver_sql(
+                    "INSERT INTO schema_migration_progress (version, step, last_id, rows_done) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (version, step) DO UPDATE SET last_id = excluded.last_id, rows_done = excluded.rows_done",
+                    (version, step, last_id, done)
+                )
+            if self.progress:
+                self.progress(label, done, total)
+            if len(ids) < batch_size:
+                break
+        return done
+
+
+class Migrator:
+    def __init__(self, engine, metadata, blob_store=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        self.engine = engine
+        self.metadata = metadata
+        self.blob_store = blob_store
+        self.batch_size = batch_size
+        # progress(label, rows done, rows total) during backfills
+        self.progress = progress
+
+    def applied(self):
+        with self.engine.connect() as conn:
+            tables = set(inspect(conn).get_table_names())
+            if "schema_migrations" not in tables:
+                return {}
+            return {version: applied_at for version, applied_at in conn.exec_driver_sql(
+                "SELECT version, applied_at FROM schema_migrations"
+            )}
+
+    def pending(self):
+        applied = self.applied()
+        return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+    def upgrade(self):
+        # a new database gets the current models and is stamped as up to date, an existing one
+        # (including databases older than this table) runs every migration it has not seen yet
+        with self.engine.begin() as conn:
+            fresh = not inspect(conn).get_table_names()
+            for statement in BOOKKEEPING:
+                conn.exec_driver_sql(statement)
+        if fresh:
+            self.metadata.create_all(self.engine)
+            for migration in MIGRATIONS:
+                self._record(migration)
+            return []
+
+        applied = []
+        for migration in self.pending():
+            try:
+                migration.upgrade(MigrationContext(self, migration))
+            except Exception as e:
+                raise RuntimeError(f"Migration {migration} failed: {e}")
+            self._record(migration)
+            applied.append(migration)
+        # tables added to the models since the database was created
+        self.metadata.create_all(self.engine)
+        return applied
+
+    def _record(self, migration):
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (migration.version, migration.name, datetime.now().isoformat(timespec="seconds"))
+            )
+            conn.exec_driver_sql("DELETE FROM schema_migration_progress WHERE version = ?", (migration.version,))
+
+
+@migration(1, "receipt image hash columns")
+def _receipt_image_hash(context):
+    for table in ("sales_receipts", "purchase_receipts"):
+        context.add_column(table, "receipt_image_hash", "VARCHAR(64)")
+
+
+@migration(2, "rename protocols.protcol to protocol")
+def _protocol_column(context):
+    context.rename_column("protocols", "protcol", "protocol")
+
+
+@migration(3, "move inline receipt images to the blob store")
+def _receipt_images(context):
+    if context.blob_store is None:
+        raise RuntimeError("A blob store is required to move receipt images")
+    for table in ("sales_receipts", "purchase_receipts"):
+        context.backfill(
+            table, table, lambda conn, ids, table=table: move_inline_images(conn, context.blob_store, table, ids),
+            where="receipt_image IS NOT NULL", batch_size=100
+        )
+
+
+@migration(4, "foreign key and date indexes")
+def _indexes(context):
+    context.create_index("ix_articles_published", "articles", ["published"])
+    context.create_index("ix_faq_article_id", "faq", ["article_id"])
+    context.create_index("ix_protocols_client_date", "protocols", ["client_id", "date"])
+    context.create_index("ix_protocols_date", "protocols", ["date"])
+    context.create_index("ix_product_sales_receipt_id", "product_sales", ["receipt_id"])
+    context.create_index("ix_product_sales_product_id", "product_sales", ["product_id"])
+    context.create_index("ix_sales_receipts_customer_date", "sales_receipts", ["customer_id", "date"])
+    context.create_index("ix_sales_receipts_date", "sales_receipts", ["date"])
+    context.create_index("ix_purchase_receipts_vendor_date", "purchase_receipts", ["vendor_id", "date"])
+    context.create_index("ix_purchase_receipts_date", "purchase_receipts", ["date"])
+
+
+@migration(5, "compressed protocol notes")
+def _protocol_compressed(context):
+    context.add_column("protocols", "protocol_compressed", "BLOB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or apply database schema migrations.")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from blob_store import BlobStore, default_blob_dir
+    from database_manager import Base, EngineProfile
+
+    engine = EngineProfile().create_engine(args.db)
+    migrator = Migrator(
+        engine, Base.metadata, BlobStore(default_blob_dir(engine.url.database)), args.batch_size,
+        progress=lambda label, done, total: print(f"{label}: {done}/{total}", end="\r")
+    )
+    if args.command == "status":
+        applied = migrator.applied()
+        for migration in MIGRATIONS:
+            print(f"{migration}  {applied.get(migration.version, 'pending')}")
+        return 0
+
+    try:
+        applied = migrator.upgrade()
+    except RuntimeError as e:
+        print(f"\nUpgrade failed: {e}", file=sys.stderr)
+        return 1
+    for migration in applied:
+        print(f"applied {migration}")
+    print(f"database at version {head()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
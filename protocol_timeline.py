@@ -0,0 +1,164 @@
+import argparse
+import sys
+import zlib
+from collections import namedtuple
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from instrumentation import metrics
+
+PAGE_SIZE = 50
+COMPACT_AFTER_DAYS = 365
+COMPACT_BATCH_SIZE = 500
+
+ProtocolRow = namedtuple("ProtocolRow", ["id", "client_id", "date", "note"])
+
+
+def _note(plain, compressed):
+    if plain is None and compressed is not None:
+        return zlib.decompress(compressed).decode("utf-8")
+    return plain
+
+
+def _row(row):
+    protocol_id, client_id, day, plain, compressed = row
+    return ProtocolRow(protocol_id, client_id, date.fromisoformat(day) if day else None, _note(plain, compressed))
+
+
+@metrics.instrument_class("database")
+class ProtocolTimeline:
+    # session notes per client, newest first. Entries are only ever appended; the one update
+    # allowed by the append-only trigger is compaction, which moves an old note into
+    # protocol_compressed without changing its text.
+    def __init__(self, engine):
+        self.engine = engine
+
+    def install(self):
+        with self.engine.begin() as conn:
+            for statement in self.ddl():
+                conn.execute(text(statement))
+
+    def ddl(self):
+        return [
+            """CREATE TRIGGER IF NOT EXISTS protocols_append_only BEFORE UPDATE ON protocols
+                WHEN NOT (old.protocol_compressed IS NULL AND new.protocol IS NULL AND new.protocol_compressed IS NOT NULL
+                          AND new.client_id = old.client_id AND new.date IS old.date)
+            BEGIN
+                SELECT RAISE(ABORT, 'protocol entries are append-only');
+            END""",
+        ]
+
+    def add(self, client_id, note, day=None):
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(text(
+                    "INSERT INTO protocols (client_id, protocol, date) VALUES (:client_id, :note, :date)"
+                ), {"client_id": client_id, "note": note, "date": (day or date.today()).isoformat()}).lastrowid
+        except Exception as e:
+            raise RuntimeError(f"Failed to add protocol entry: {e}")
+
+    def page(self, client_id, before=None, start=None, end=None, limit=PAGE_SIZE):
+        # one page of entries with start <= date < end, newest first; pass the returned cursor
+        # as before to get the next page, it is None after the last one. Keyset on (date, id)
+        # within the (client_id, date) index, so deep pages cost the same as the first one.
+        # Entries without a date come last, paged by id; a date range leaves them out.
+        where = ["client_id = :client_id"]
+        params = {"client_id": client_id}
+        if start is not None:
+            where.append("date >= :start")
+            params["start"] = start.isoformat()
+        if end is not None:
+            where.append("date < :end")
+            params["end"] = end.isoformat()
+        try:
+            with self.engine.connect() as conn:
+                if before is None:
+                    rows = self._select(conn, where, params, limit)
+                elif before[0] is None:
+                    rows = self._select(conn, where + ["date IS NULL", "id < :before_id"],
+                                        dict(params, before_id=before[1]), limit)
+                else:
+                    # the row value comparison is never true for a NULL date
+                    rows = self._select(conn, where + ["(date, id) < (:before_date, :before_id)"],
+                                        dict(params, before_date=before[0].isoformat(), before_id=before[1]), limit)
+                    if len(rows) < limit and start is None and end is None:
+                        rows += self._select(conn, where + ["date IS NULL"], params, limit - len(rows))
+        except Exception as e:
+            raise RuntimeError(f"Failed to load protocol entries: {e}")
+        cursor = (rows[-1].date, rows[-1].id) if len(rows) == limit else None
+        return rows, cursor
+
+    @staticmethod
+    def _select(conn, where, params, limit):
+        return [_row(row) for row in conn.execute(text(
+            "SELECT id, client_id, date, protocol, protocol_compressed FROM protocols "
+            f"WHERE {' AND '.join(where)} ORDER BY date DESC, id DESC LIMIT :limit"
+        ), dict(params, limit=limit))]
+
+    def stream(self, client_id, start=None, end=None, page_size=PAGE_SIZE):
+        # every entry in the range, page by page; no read transaction stays open between pages
+        before = None
+        while True:
+            rows, before = self.page(client_id, before, start, end, page_size)
+            yield from rows
+            if before is None:
+                return
+
+    def count(self, client_id):
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT count(*) FROM protocols WHERE client_id = :id"), {"id": client_id}).scalar()
+
+    def compact(self, older_than=None, batch_size=COMPACT_BATCH_SIZE, progress=None):
+        # zlib-compresses notes older than the cutoff, one committed batch at a time;
+        # notes that would not get smaller stay as they are
+        cutoff = (older_than or date.today() - timedelta(days=COMPACT_AFTER_DAYS)).isoformat()
+        last_id = 0
+        compacted = saved = 0
+        while True:
+            with self.engine.begin() as conn:
+                rows = conn.execute(text(
+                    "SELECT id, protocol FROM protocols WHERE id > :last_id AND date < :cutoff "
+                    "AND protocol IS NOT NULL AND protocol_compressed IS NULL ORDER BY id LIMIT :limit"
+                ), {"last_id": last_id, "cutoff": cutoff, "limit": batch_size}).all()
+                if not rows:
+                    break
+                for protocol_id, note in rows:
+                    raw = note.encode("utf-8")
+                    compressed = zlib.compress(raw, 9)
+                    if len(compressed) < len(raw):
+                        conn.execute(text(
+                            "UPDATE protocols SET protocol = NULL, protocol_compressed = :compressed WHERE id = :id"
+                        ), {"compressed": compressed, "id": protocol_id})
+                        compacted += 1
+                        saved += len(raw) - len(compressed)
+                last_id = rows[-1][0]
+            if progress:
+                progress(compacted, saved)
+        return compacted, saved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Protocol timeline maintenance.")
+    parser.add_argument("command", choices=["compact"])
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--older-than-days", type=int, default=COMPACT_AFTER_DAYS)
+    parser.add_argument("--vacuum", action="store_true", help="reclaim the freed space afterwards")
+    args = parser.parse_args(argv)
+
+    from database_manager import DatabaseManager
+
+    database_manager = DatabaseManager(args.db)
+    compacted, saved = database_manager.protocols.compact(
+        date.today() - timedelta(days=args.older_than_days),
+        progress=lambda count, size: print(f"{count} entries compressed, {size / 1024:.0f} KiB saved", end="\r")
+    )
+    print(f"\n{compacted} entries compressed, {saved / 1024:.0f} KiB saved")
+    if args.vacuum and compacted:
+        with database_manager.engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import os
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QSize, QSaveFile, QIODevice, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+THUMBNAIL_SIZE = 256
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+class PixmapCache:
+    # LRU bounded by decoded size rather than by entry count
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def cost(pixmap):
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def get(self, key):
+        pixmap = self.entries.get(key)
+        if pixmap is not None:
+            self.entries.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        if key in self.entries:
+            self.bytes -= self.cost(self.entries.pop(key))
+        self.entries[key] = pixmap
+        self.bytes += self.cost(pixmap)
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= self.cost(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+class ThumbnailSignals(QObject):
+    finished = pyqtSignal(str, QImage)
+    failed = pyqtSignal(str, str)
+
+
+class ThumbnailJob(QRunnable):
+    # loads a persisted thumbnail or decodes the scan at reduced size and persists the result;
+    # QImage is safe to use off the GUI thread, QPixmap is not
+    def __init__(self, digest, image_path, thumbnail_path, size):
+        super().__init__()
+        # owned by Python and kept in ThumbnailService.pending until its signal is handled,
+        # so the signals object outlives queued emissions
+        self.setAutoDelete(False)
+        self.digest = digest
+        self.image_path = image_path
+        self.thumbnail_path = thumbnail_path
+        self.size = size
+        self.signals = ThumbnailSignals()
+
+    def run(self):
+        if os.path.exists(self.thumbnail_path):
+            image = QImage(self.thumbnail_path)
+            if not image.isNull():
+                self.signals.finished.emit(self.digest, image)
+                return
+
+        reader = QImageReader(self.image_path)
+        original = reader.size()
+        if original.isValid():
+            # lets JPEG decode straight to the reduced size instead of full resolution
+            reader.setScaledSize(original.scaled(QSize(self.size, self.size), Qt.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull():
+            self.signals.failed.emit(self.digest, reader.errorString())
+            return
+        if image.width() > self.size or image.height() > self.size:
+            image = image.scaled(self.size, self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        os.makedirs(os.path.dirname(self.thumbnail_path), exist_ok=True)
+        output = QSaveFile(self.thumbnail_path)
+        if output.open(QIODevice.WriteOnly) and image.save(output, "PNG"):
+            output.commit()
+        else:
+            output.cancelWriting()
+        self.signals.finished.emit(self.digest, image)
+
+
+class ThumbnailService(QObject):
+    # hands out cached thumbnails and generates missing ones on a worker pool,
+    # thumbnail_ready fires on the GUI thread once a requested thumbnail is available
+    thumbnail_ready = pyqtSignal(str)
+    thumbnail_failed = pyqtSignal(str, str)
+
+    def __init__(self, blob_store, size=THUMBNAIL_SIZE, cache_bytes=CACHE_BYTES, parent=None):
+        super().__init__(parent)
+        self.blob_store = blob_store
+        self.size = size
+        self.thumbnail_dir = os.path.join(blob_store.root, "thumbnails")
+        self.cache = PixmapCache(cache_bytes)
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max(1, min(4, QThreadPool.globalInstance().maxThreadCount() - 1)))
+        self.pending = {}
+        # digests whose image is missing or undecodable, not tried again on every repaint
+        self.failed = set()
+
+    def thumbnail_path(self, digest):
+        return os.path.join(self.thumbnail_dir, digest[:2], f"{digest}.{self.size}.png")
+
+    def pixmap(self, digest):
+        # cached pixmap or None, in which case the thumbnail is requested
+        pixmap = self.cache.get(digest)
+        if pixmap is None:
+            self.request(digest)
+        return pixmap
+
+    def request(self, digest, retry=False):
+        # retry: the image has just been stored, an earlier failure no longer counts
+        if retry:
+            self.failed.discard(digest)
+        if not digest or digest in self.pending or digest in self.failed or self.cache.get(digest) is not None:
+            return
+        job = ThumbnailJob(digest, self.blob_store.path_for(digest), self.thumbnail_path(digest), self.size)
+        job.signals.finished.connect(self._finished)
+        job.signals.failed.connect(self._failed)
+        self.pending[digest] = job
+        self.thread_pool.start(job)
+
+    def _finished(self, digest, image):
+        self.pending.pop(digest, None)
+        self.cache.put(digest, QPixmap.fromImage(image))
+        self.thumbnail_ready.emit(digest)
+
+    def clear(self):
+        self.cache.clear()
+        self.failed.clear()
+
+    def _failed(self, digest, message):
+        self.pending.pop(digest, None)
+        self.failed.add(digest)
+        self.thumbnail_failed.emit(digest, message)
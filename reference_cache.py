@@ -0,0 +1,96 @@
+import threading
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+PENDING_KEY = "reference_cache_pending"
+
+# mapper and session events are global, so the listeners are registered once for all caches:
+# mapper events mark the changed names in the session, a commit invalidates them in the cache
+# of the session's engine. Nothing global keeps a cache alive.
+_names_by_model = {}
+_caches = weakref.WeakValueDictionary()
+_lock = threading.Lock()
+
+
+def _changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, set()).update(_names_by_model.get(mapper.class_, ()))
+
+
+def _committed(session):
+    names = session.info.pop(PENDING_KEY, ())
+    cache = _caches.get(session.bind) if names else None
+    if cache is not None:
+        for name in names:
+            if name in cache.versions:
+                cache.invalidate(name)
+
+
+def _rolled_back(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+event.listen(Session, "after_commit", _committed)
+event.listen(Session, "after_rollback", _rolled_back)
+
+
+class ReferenceCache:
+    # read-through cache for small, rarely changing tables (products, vendors). Every table has a
+    # version; ORM inserts, updates and deletes mark it in their session and the version is bumped
+    # when that session commits, so a rolled back change never evicts anything. Writes that bypass
+    # the ORM (raw SQL, bulk imports, other processes) have to call invalidate().
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.lock = threading.Lock()
+        self.loaders = {}
+        self.versions = {}
+        self.entries = {}
+        self.stats_by_table = {}
+        _caches[session_factory.kw["bind"]] = self
+
+    def register(self, name, model, loader):
+        # loader(session) returns the cached value, it should be immutable (tuples of rows)
+        self.loaders[name] = loader
+        self.versions[name] = 0
+        self.stats_by_table[name] = {"hits": 0, "misses": 0, "invalidations": 0}
+        with _lock:
+            if model not in _names_by_model:
+                _names_by_model[model] = set()
+                for change in ("after_insert", "after_update", "after_delete"):
+                    event.listen(model, change, _changed)
+            _names_by_model[model].add(name)
+
+    def get(self, name):
+        with self.lock:
+            version = self.versions[name]
+            entry = self.entries.get(name)
+            if entry is not None and entry[0] == version:
+                self.stats_by_table[name]["hits"] += 1
+                return entry[1]
+            self.stats_by_table[name]["misses"] += 1
+
+        session = self.session_factory()
+        try:
+            value = self.loaders[name](session)
+        finally:
+            session.close()
+
+        with self.lock:
+            # a commit during the load bumped the version, the value may already be stale
+            if self.versions[name] == version:
+                self.entries[name] = (version, value)
+        return value
+
+    def invalidate(self, name=None):
+        with self.lock:
+            for table in [name] if name else list(self.versions):
+                self.versions[table] += 1
+                self.entries.pop(table, None)
+                self.stats_by_table[table]["invalidations"] += 1
+
+    def stats(self):
+        with self.lock:
+            return {name: dict(counts, version=self.versions[name]) for name, counts in self.stats_by_table.items()}
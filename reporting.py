@@ -0,0 +1,199 @@
+import argparse
+import sys
+from datetime import date
+
+from sqlalchemy import text
+
+from instrumentation import metrics
+
+# aggregate tables are keyed by (period, category, payment_method); NULLs are stored as ''
+SOURCES = {
+    "sales": "sales_receipts",
+    "purchases": "purchase_receipts",
+}
+GRANULARITIES = {
+    # name: (period expression over a receipt row, length of the stored period)
+    "daily": ("{row}.date", 10),
+    "monthly": ("substr({row}.date, 1, 7)", 7),
+}
+TOLERANCE = 0.005
+
+
+def _table(kind, granularity):
+    return f"{kind}_{granularity}_totals"
+
+
+def _period(value, length):
+    return value.isoformat()[:length] if isinstance(value, date) else value
+
+
+@metrics.instrument_class("database")
+class ReportingEngine:
+    # revenue, VAT and expense rollups answered from trigger-maintained aggregate tables
+    def __init__(self, engine):
+        self.engine = engine
+
+    def install(self):
+        with self.engine.begin() as conn:
+            existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for statement in self.ddl():
+                conn.execute(text(statement))
+            if any(_table(kind, granularity) not in existing for kind in SOURCES for granularity in GRANULARITIES):
+                self._rebuild(conn)
+
+    def ddl(self):
+        statements = []
+        for kind, source in SOURCES.items():
+            for granularity in GRANULARITIES:
+                table = _table(kind, granularity)
+                statements.append(f"""CREATE TABLE IF NOT EXISTS {table} (
+                    period TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    payment_method TEXT NOT NULL,
+                    receipt_count INTEGER NOT NULL,
+                    total_amount REAL NOT NULL,
+                    tax_amount REAL NOT NULL,
+                    PRIMARY KEY (period, category, payment_method)
+                ) WITHOUT ROWID""")
+
+            def apply(row, sign):
+                lines = []
+                for granularity, (expression, _) in GRANULARITIES.items():
+                    table = _table(kind, granularity)
+                    period = expression.format(row=row)
+                    lines.append(f"""INSERT INTO {table} (period, category, payment_method, receipt_count, total_amount, tax_amount)
+                        VALUES ({period}, coalesce({row}.category, ''), coalesce({row}.payment_method, ''), {sign}1,
+                                {sign}coalesce({row}.total_amount, 0), {sign}coalesce({row}.tax_amount, 0))
+                        ON CONFLICT (period, category, payment_method) DO UPDATE SET
+                            receipt_count = receipt_count + excluded.receipt_count,
+                            total_amount = total_amount + excluded.total_amount,
+                            tax_amount = tax_amount + excluded.tax_amount;""")
+                    if sign == "-":
+                        lines.append(f"""DELETE FROM {table} WHERE period = {period}
+                            AND category = coalesce({row}.category, '') AND payment_method = coalesce({row}.payment_method, '')
+                            AND receipt_count = 0;""")
+                return "\n".join(lines)
+
+            statements.append(f"CREATE TRIGGER IF NOT EXISTS {source}_totals_ai AFTER INSERT ON {source} BEGIN\n{apply('new', '+')}\nEND")
+            statements.append(f"CREATE TRIGGER IF NOT EXISTS {source}_totals_ad AFTER DELETE ON {source} BEGIN\n{apply('old', '-')}\nEND")
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {source}_totals_au "
+                f"AFTER UPDATE OF date, category, payment_method, total_amount, tax_amount ON {source} BEGIN\n"
+                f"{apply('old', '-')}\n{apply('new', '+')}\nEND"
+            )
+        return statements
+
+    def _fresh_totals(self, kind, granularity):
+        expression, _ = GRANULARITIES[granularity]
+        return (
+            f"SELECT {expression.format(row='r')} AS period, coalesce(r.category, '') AS category, "
+            "coalesce(r.payment_method, '') AS payment_method, count(*) AS receipt_count, "
+            "coalesce(sum(r.total_amount), 0) AS total_amount, coalesce(sum(r.tax_amount), 0) AS tax_amount "
+            f"FROM {SOURCES[kind]} r GROUP BY 1, 2, 3"
+        )
+
+    def rebuild(self):
+        with self.engine.begin() as conn:
+            self._rebuild(conn)
+
+    def _rebuild(self, conn):
+        for kind in SOURCES:
+            for granularity in GRANULARITIES:
+                table = _table(kind, granularity)
+                conn.execute(text(f"DELETE FROM {table}"))
+                conn.execute(text(f"INSERT INTO {table} {self._fresh_totals(kind, granularity)}"))
+
+    def verify(self):
+        # compares every aggregate row against a full recomputation, returns the differences
+        mismatches = []
+        with self.engine.connect() as conn:
+            for kind in SOURCES:
+                for granularity in GRANULARITIES:
+                    table = _table(kind, granularity)
+                    stored = {tuple(row[:3]): tuple(row[3:]) for row in conn.execute(text(f"SELECT * FROM {table}"))}
+                    fresh = {tuple(row[:3]): tuple(row[3:]) for row in conn.execute(text(self._fresh_totals(kind, granularity)))}
+                    for key in stored.keys() | fresh.keys():
+                        a, b = stored.get(key), fresh.get(key)
+                        if a is None or b is None or a[0] != b[0] or abs(a[1] - b[1]) > TOLERANCE or abs(a[2] - b[2]) > TOLERANCE:
+                            mismatches.append((table, key, a, b))
+        return mismatches
+
+    def _rollup(self, kind, group_by, start=None, end=None, granularity=None):
+        # start inclusive, end exclusive; whole-month ranges are answered from the monthly table
+        if granularity is None:
+            month_aligned = (start is None or start.day == 1) and (end is None or end.day == 1)
+            granularity = "monthly" if month_aligned else "daily"
+        _, length = GRANULARITIES[granularity]
+        where, params = [], {}
+        if start is not None:
+            where.append("period >= :start")
+            params["start"] = _period(start, length)
+        if end is not None:
+            where.append("period < :end")
+            params["end"] = _period(end, length)
+        sql = (
+            f"SELECT {group_by} AS bucket, sum(receipt_count), sum(total_amount), sum(tax_amount) "
+            f"FROM {_table(kind, granularity)}"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + " GROUP BY bucket ORDER BY bucket"
+        )
+        with self.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(text(sql), params)]
+
+    def revenue(self, start=None, end=None, period="month"):
+        # (period, receipt count, total, tax) per day, month or year
+        if period == "day":
+            return self._rollup("sales", "period", start, end, "daily")
+        length = {"month": 7, "year": 4}[period]
+        return self._rollup("sales", f"substr(period, 1, {length})", start, end)
+
+    def by_category(self, start=None, end=None, kind="sales"):
+        return self._rollup(kind, "category", start, end)
+
+    def by_payment_method(self, start=None, end=None, kind="sales"):
+        return self._rollup(kind, "payment_method", start, end)
+
+    def expenses_by_category(self, start=None, end=None):
+        return self.by_category(start, end, kind="purchases")
+
+    def vat_summary(self, start=None, end=None):
+        # VAT collected on sales minus input VAT paid on purchases
+        output_tax = sum(row[3] for row in self._rollup("sales", "''", start, end))
+        input_tax = sum(row[3] for row in self._rollup("purchases", "''", start, end))
+        return {"output_tax": output_tax, "input_tax": input_tax, "payable": output_tax - input_tax}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Revenue and tax reports.")
+    parser.add_argument("command", choices=["rebuild", "verify", "summary"])
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    parser.add_argument("--year", type=int, default=date.today().year)
+    args = parser.parse_args(argv)
+
+    from database_manager import DatabaseManager
+
+    reports = DatabaseManager(args.db).reports
+    if args.command == "rebuild":
+        reports.rebuild()
+        print("aggregates rebuilt")
+    elif args.command == "verify":
+        mismatches = reports.verify()
+        for table, key, stored, fresh in mismatches:
+            print(f"{table} {key}: stored {stored}, expected {fresh}")
+        print(f"{len(mismatches)} mismatches")
+        return 1 if mismatches else 0
+    else:
+        start, end = date(args.year, 1, 1), date(args.year + 1, 1, 1)
+        print("Umsatz pro Monat")
+        for month, count, total, tax in reports.revenue(start, end):
+            print(f"  {month}  {count:5d} Belege  {total:12.2f}  USt {tax:10.2f}")
+        print("Ausgaben nach Kategorie")
+        for category, count, total, tax in reports.expenses_by_category(start, end):
+            print(f"  {category or '-':<20} {total:12.2f}  VSt {tax:10.2f}")
+        vat = reports.vat_summary(start, end)
+        print(f"USt {vat['output_tax']:.2f} - VSt {vat['input_tax']:.2f} = Zahllast {vat['payable']:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,493 @@
+import argparse
+import json
+import sys
+import time
+import uuid
+import zipfile
+import zlib
+
+from sqlalchemy import text, LargeBinary
+from sqlalchemy.exc import IntegrityError
+
+from instrumentation import metrics
+
+FORMAT = 1
+FETCH_BATCH = 500
+# local: a row changed on both machines keeps the local version, remote: the incoming one wins;
+# the conflict is recorded either way
+POLICIES = ("local", "remote")
+# entries never change after they are written; the only update, compaction, is a local matter
+APPEND_ONLY = {"protocols"}
+# (text column, compressed column) of rows whose text may have been compacted, see protocol_timeline.py
+COMPRESSED = {"protocols": ("protocol", "protocol_compressed")}
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def split_key(key):
+    origin, origin_id = key.rsplit(":", 1)
+    return origin, int(origin_id)
+
+
+def _chunks(items):
+    for start in range(0, len(items), FETCH_BATCH):
+        yield items[start:start + FETCH_BATCH]
+
+
+def _ids(batch):
+    return ", ".join(str(int(row_id)) for row_id in batch)
+
+
+@metrics.instrument_class("database")
+class SyncLog:
+    # row-level change capture for syncing machines through delta files. Triggers append
+    # (table, row id, operation, source) to change_log; a delta carries the current state of every
+    # row changed since the sequence number the peer acknowledged, so its size follows the number
+    # of changes, not the size of the database. Rows are identified across machines by
+    # "<site>:<id on that site>", rows that came from a peer are mapped in sync_rows.
+    def __init__(self, engine, metadata, blob_store):
+        self.engine = engine
+        self.blob_store = blob_store
+        # parents before children
+        self.tables = [table.name for table in metadata.sorted_tables]
+        # synced columns: everything but the primary key and BLOBs (legacy inline images, compacted notes)
+        self.columns = {table.name: [column.name for column in table.columns
+                                     if not column.primary_key and not isinstance(column.type, LargeBinary)]
+                        for table in metadata.sorted_tables}
+        self.foreign_keys = {table.name: {fk.parent.name: fk.column.table.name for fk in table.foreign_keys}
+                             for table in metadata.sorted_tables}
+        self.unique_columns = {table.name: [column.name for column in table.columns if column.unique]
+                               for table in metadata.sorted_tables}
+
+    def install(self):
+        with self.engine.begin() as conn:
+            for statement in self.ddl():
+                conn.execute(text(statement))
+            conn.execute(text("INSERT OR IGNORE INTO sync_state (id, site) VALUES (1, :site)"), {"site": uuid.uuid4().hex[:12]})
+
+    def ddl(self):
+        statements = [
+            """CREATE TABLE IF NOT EXISTS sync_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                site TEXT NOT NULL,
+                applying TEXT NOT NULL DEFAULT ''
+            )""",
+            """CREATE TABLE IF NOT EXISTS change_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                op TEXT NOT NULL,
+                source TEXT NOT NULL DEFAULT ''
+            )""",
+            "CREATE INDEX IF NOT EXISTS ix_change_log_row ON change_log(table_name, row_id, seq)",
+            """CREATE TABLE IF NOT EXISTS sync_rows (
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                origin TEXT NOT NULL,
+                origin_id INTEGER NOT NULL,
+                PRIMARY KEY (table_name, row_id)
+            )""",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_sync_rows_origin ON sync_rows(table_name, origin, origin_id)",
+            """CREATE TABLE IF NOT EXISTS sync_peers (
+                site TEXT PRIMARY KEY,
+                acked INTEGER NOT NULL DEFAULT 0,
+                received INTEGER NOT NULL DEFAULT 0,
+                last_sync TEXT
+            )""",
+            """CREATE TABLE IF NOT EXISTS sync_conflicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                peer TEXT NOT NULL,
+                table_name TEXT NOT NULL,
+                row_key TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                local TEXT,
+                remote TEXT,
+                kept TEXT NOT NULL,
+                detected_at TEXT NOT NULL,
+                resolved INTEGER NOT NULL DEFAULT 0
+            )""",
+        ]
+        # source is the peer whose delta is being applied, '' for changes made on this machine
+        for table in self.tables:
+            for suffix, event, op, row in (("ai", "INSERT", "I", "new"), ("au", "UPDATE", "U", "new"), ("ad", "DELETE", "D", "old")):
+                if event == "UPDATE" and table in APPEND_ONLY:
+                    continue
+                statements.append(
+                    f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_{suffix} AFTER {event} ON {table} BEGIN
+                        INSERT INTO change_log (table_name, row_id, op, source)
+                        SELECT '{table}', {row}.id, '{op}', applying FROM sync_state;
+                    END"""
+                )
+        return statements
+
+    def site(self):
+        with self.engine.connect() as conn:
+            return self._site(conn)
+
+    def _site(self, conn):
+        return conn.execute(text("SELECT site FROM sync_state WHERE id = 1")).scalar()
+
+    def peers(self):
+        with self.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(text("SELECT site, acked, received, last_sync FROM sync_peers ORDER BY site"))]
+
+    def _peer(self, conn, peer):
+        conn.execute(text("INSERT OR IGNORE INTO sync_peers (site) VALUES (:site)"), {"site": peer})
+        return conn.execute(text("SELECT acked, received FROM sync_peers WHERE site = :site"), {"site": peer}).one()
+
+    def _keys(self, conn, table, ids, site):
+        # {local id: global key}
+        keys = {row_id: f"{site}:{row_id}" for row_id in ids}
+        for batch in _chunks(sorted(keys)):
+            for row_id, origin, origin_id in conn.execute(text(
+                f"SELECT row_id, origin, origin_id FROM sync_rows WHERE table_name = :table AND row_id IN ({_ids(batch)})"
+            ), {"table": table}):
+                keys[row_id] = f"{origin}:{origin_id}"
+        return keys
+
+    def _local_ids(self, conn, table, keys, site):
+        # {global key: local id}, None for rows never seen here
+        by_origin = {}
+        for key in keys:
+            origin, origin_id = split_key(key)
+            by_origin.setdefault(origin, set()).add(origin_id)
+        ids = {}
+        for origin, origin_ids in by_origin.items():
+            for batch in _chunks(sorted(origin_ids)):
+                mapped = dict(conn.execute(text(
+                    f"SELECT origin_id, row_id FROM sync_rows WHERE table_name = :table AND origin = :origin AND origin_id IN ({_ids(batch)})"
+                ), {"table": table, "origin": origin}).all())
+                for origin_id in batch:
+                    ids[f"{origin}:{origin_id}"] = mapped.get(origin_id, origin_id if origin == site else None)
+        return ids
+
+    def _existing(self, conn, table, ids):
+        # the ids whose rows are still there
+        found = set()
+        for batch in _chunks(sorted(ids)):
+            found.update(row_id for row_id, in conn.execute(text(f"SELECT id FROM {table} WHERE id IN ({_ids(batch)})")))
+        return found
+
+    def _changed_since(self, conn, table, ids, ack, peer):
+        # the rows changed here since the peer last saw this database's changes
+        changed = set()
+        for batch in _chunks(sorted(ids)):
+            changed.update(row_id for row_id, in conn.execute(text(
+                f"SELECT DISTINCT row_id FROM change_log WHERE table_name = :table AND row_id IN ({_ids(batch)}) "
+                "AND seq > :ack AND source != :peer"
+            ), {"table": table, "ack": ack, "peer": peer}))
+        return changed
+
+    def _read_rows(self, conn, table, ids):
+        # {id: {column: value}} with compacted text restored
+        columns = self.columns[table]
+        select = ["id"] + columns + ([COMPRESSED[table][1]] if table in COMPRESSED else [])
+        rows = {}
+        for batch in _chunks(ids):
+            for row in conn.execute(text(f"SELECT {', '.join(select)} FROM {table} WHERE id IN ({_ids(batch)})")):
+                values = dict(zip(select, row))
+                row_id = values.pop("id")
+                if table in COMPRESSED:
+                    plain, compressed = COMPRESSED[table]
+                    packed = values.pop(compressed)
+                    if values[plain] is None and packed is not None:
+                        values[plain] = zlib.decompress(packed).decode("utf-8")
+                rows[row_id] = values
+        return rows
+
+    def export(self, path, peer, full=False):
+        # writes the delta for peer to a zip file: manifest.json, changes.jsonl in parent-first
+        # order (deletes children first) and the receipt images the rows reference.
+        # full exports every row, for setting up an empty database on a new machine.
+        with self.engine.connect() as conn, conn.begin():
+            site = self._site(conn)
+            if peer == site:
+                raise ValueError("A database can not sync with itself")
+            acked, received = self._peer(conn, peer)
+            until = conn.execute(text("SELECT coalesce(max(seq), 0) FROM change_log")).scalar()
+            # table -> (ids to upsert, ids to delete)
+            changed = {table: (set(), set()) for table in self.tables}
+            if full:
+                for table in self.tables:
+                    changed[table][0].update(row_id for row_id, in conn.execute(text(f"SELECT id FROM {table}")))
+            else:
+                # latest operation per row; the peer's own changes are not sent back to it
+                for table, row_id, op, _ in conn.execute(text(
+                    "SELECT table_name, row_id, op, max(seq) FROM change_log WHERE seq > :acked AND source != :peer "
+                    "GROUP BY table_name, row_id"
+                ), {"acked": acked, "peer": peer}):
+                    if table not in changed:
+                        continue
+                    changed[table][1 if op == "D" else 0].add(row_id)
+
+            count = 0
+            blobs = set()
+            manifest = {"format": FORMAT, "from": site, "to": peer, "since": 0 if full else acked, "until": until,
+                        "ack": received, "full": full, "created": _now()}
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                with archive.open("changes.jsonl", "w") as changes:
+                    for table in self.tables:
+                        foreign_keys = self.foreign_keys[table]
+                        for ids in _chunks(sorted(changed[table][0])):
+                            rows = self._read_rows(conn, table, ids)
+                            keys = self._keys(conn, table, rows, site)
+                            parents = {column: self._keys(conn, parent, {values[column] for values in rows.values()} - {None}, site)
+                                       for column, parent in foreign_keys.items()}
+                            # rows deleted after being logged are missing, a delete follows for them
+                            for row_id, values in sorted(rows.items()):
+                                for column in foreign_keys:
+                                    if values[column] is not None:
+                                        values[column] = parents[column][values[column]]
+                                if values.get("receipt_image_hash"):
+                                    blobs.add(values["receipt_image_hash"])
+                                changes.write(self._line(table, keys[row_id], "upsert", values))
+                                count += 1
+                    for table in reversed(self.tables):
+                        keys = self._keys(conn, table, changed[table][1], site)
+                        for row_id in sorted(keys):
+                            changes.write(self._line(table, keys[row_id], "delete", None))
+                            count += 1
+                for digest in sorted(blobs):
+                    if self.blob_store.exists(digest):
+                        # scans are compressed already
+                        archive.write(self.blob_store.path_for(digest), f"blobs/{digest}", zipfile.ZIP_STORED)
+                manifest["rows"] = count
+                manifest["blobs"] = len(blobs)
+                archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+        return manifest
+
+    @staticmethod
+    def _line(table, key, op, values):
+        return (json.dumps({"table": table, "key": key, "op": op, "row": values}, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def apply(self, path, prefer="local"):
+        # applies a delta from a peer in one transaction and returns counts of what happened
+        if prefer not in POLICIES:
+            raise ValueError(f"Unknown conflict policy: {prefer}")
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read("manifest.json"))
+            if manifest.get("format") != FORMAT:
+                raise ValueError(f"Unsupported delta format: {manifest.get('format')}")
+            # images first, a row must never point to an image that is not there
+            for name in archive.namelist():
+                if name.startswith("blobs/") and not self.blob_store.exists(name[len("blobs/"):]):
+                    with archive.open(name) as blob:
+                        self.blob_store.put_stream(blob)
+
+            stats = {"applied": 0, "unchanged": 0, "conflicts": 0}
+            with self.engine.begin() as conn:
+                site = self._site(conn)
+                peer = manifest["from"]
+                if manifest["to"] != site:
+                    raise ValueError(f"Delta is for {manifest['to']}, this database is {site}")
+                self._peer(conn, peer)
+                # changes captured while applying are tagged with the peer and never sent back to it
+                conn.execute(text("UPDATE sync_state SET applying = :peer"), {"peer": peer})
+                with archive.open("changes.jsonl") as changes:
+                    for table, batch in self._batches(changes):
+                        for outcome in self._apply_batch(conn, site, peer, manifest["ack"], table, batch, prefer):
+                            stats[outcome] += 1
+                conn.execute(text(
+                    "UPDATE sync_peers SET acked = max(acked, :ack), received = max(received, :until), last_sync = :now "
+                    "WHERE site = :site"
+                ), {"ack": manifest["ack"], "until": manifest["until"], "now": _now(), "site": peer})
+                conn.execute(text("UPDATE sync_state SET applying = ''"))
+        return stats
+
+    def _batches(self, changes):
+        # consecutive changes of one table, up to FETCH_BATCH of them
+        table, batch = None, []
+        for line in changes:
+            change = json.loads(line)
+            if change["table"] not in self.tables:
+                raise ValueError(f"Unknown table in delta: {change['table']}")
+            if batch and (change["table"] != table or len(batch) == FETCH_BATCH):
+                yield table, batch
+                batch = []
+            table = change["table"]
+            batch.append(change)
+        if batch:
+            yield table, batch
+
+    def _apply_batch(self, conn, site, peer, ack, table, batch, prefer):
+        # looks up the batch's rows, their parents and their local changes in a few queries
+        ids = self._local_ids(conn, table, [change["key"] for change in batch], site)
+        parents = {}
+        for column, parent in self.foreign_keys[table].items():
+            parent_ids = self._local_ids(conn, parent, {change["row"][column] for change in batch
+                                                        if change["row"] and change["row"][column] is not None}, site)
+            # a parent deleted here is as good as unknown, the child becomes a conflict
+            existing = self._existing(conn, parent, [row_id for row_id in parent_ids.values() if row_id is not None])
+            parents[column] = {key: row_id if row_id in existing else None for key, row_id in parent_ids.items()}
+        known = [row_id for row_id in ids.values() if row_id is not None]
+        rows = self._read_rows(conn, table, known)
+        changed = self._changed_since(conn, table, known, ack, peer)
+        # new key mappings are written together at the end; the keys of a batch are distinct
+        mappings = []
+        for change in batch:
+            local_id = ids[change["key"]]
+            yield self._apply_change(conn, site, peer, change, prefer, local_id, rows.get(local_id), local_id in changed,
+                                     parents, mappings)
+        if mappings:
+            conn.execute(text(
+                "INSERT OR REPLACE INTO sync_rows (table_name, row_id, origin, origin_id) VALUES (:table, :id, :origin, :origin_id)"
+            ), mappings)
+
+    def _apply_change(self, conn, site, peer, change, prefer, local_id, local, changed_here, parents, mappings):
+        table, key, remote = change["table"], change["key"], change["row"]
+
+        if change["op"] == "delete":
+            if local is None:
+                return "unchanged"
+            if changed_here:
+                self._conflict(conn, peer, table, key, "changed here, deleted there", local, None, prefer)
+                if prefer == "local":
+                    return "conflicts"
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f"DELETE FROM {table} WHERE id = :id"), {"id": local_id})
+            except IntegrityError:
+                # rows added here still refer to it, e.g. a protocol entered after the other machine deleted the client
+                self._conflict(conn, peer, table, key, "deleted there, still referred to here", local, None, "local")
+                return "conflicts"
+            return "conflicts" if changed_here else "applied"
+
+        values = dict(remote)
+        for column in self.foreign_keys[table]:
+            if values[column] is not None:
+                values[column] = parents[column][values[column]]
+                if values[column] is None:
+                    self._conflict(conn, peer, table, key, f"{column} refers to a row that does not exist here", None, remote, "local")
+                    return "conflicts"
+
+        if local is None and local_id is not None:
+            # known here, but deleted; a stale copy must not bring it back unnoticed
+            self._conflict(conn, peer, table, key, "deleted here, changed there", None, remote, prefer)
+            if prefer == "remote":
+                self._insert(conn, site, table, key, values, mappings, remap=True)
+            return "conflicts"
+        if local is None and not self.unique_columns[table]:
+            self._insert(conn, site, table, key, values, mappings)
+            return "applied"
+        if local is None:
+            try:
+                with conn.begin_nested():
+                    self._insert(conn, site, table, key, values, mappings)
+                return "applied"
+            except IntegrityError:
+                # the same row entered on both machines (unique e-mail or phone): treat them as one
+                local_id = self._find_unique(conn, table, values)
+                if local_id is None:
+                    raise
+                self._map(site, table, local_id, key, mappings)
+                local = self._read_rows(conn, table, [local_id])[local_id]
+                changed_here = True
+
+        if local == values or table in APPEND_ONLY:
+            return "unchanged"
+        if changed_here:
+            self._conflict(conn, peer, table, key, "changed on both machines", local, remote, prefer)
+            if prefer == "local":
+                return "conflicts"
+        assignments = ", ".join(f"{column} = :{column}" for column in values)
+        conn.execute(text(f"UPDATE {table} SET {assignments} WHERE id = :id"), dict(values, id=local_id))
+        return "conflicts" if changed_here else "applied"
+
+    def _insert(self, conn, site, table, key, values, mappings, remap=False):
+        columns = list(values)
+        row_id = conn.execute(text(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + column for column in columns)})"
+        ), values).lastrowid
+        if remap:
+            conn.execute(text("DELETE FROM sync_rows WHERE table_name = :table AND origin = :origin AND origin_id = :id"),
+                         dict(zip(("origin", "id"), split_key(key)), table=table))
+        self._map(site, table, row_id, key, mappings)
+        return row_id
+
+    @staticmethod
+    def _map(site, table, row_id, key, mappings):
+        origin, origin_id = split_key(key)
+        if origin != site or origin_id != row_id:
+            mappings.append({"table": table, "id": row_id, "origin": origin, "origin_id": origin_id})
+
+    def _find_unique(self, conn, table, values):
+        for column in self.unique_columns[table]:
+            row_id = conn.execute(text(f"SELECT id FROM {table} WHERE {column} = :value"), {"value": values.get(column)}).scalar()
+            if row_id is not None:
+                return row_id
+        return None
+
+    def _conflict(self, conn, peer, table, key, reason, local, remote, kept):
+        conn.execute(text(
+            "INSERT INTO sync_conflicts (peer, table_name, row_key, reason, local, remote, kept, detected_at) "
+            "VALUES (:peer, :table, :key, :reason, :local, :remote, :kept, :now)"
+        ), {"peer": peer, "table": table, "key": key, "reason": reason, "kept": kept, "now": _now(),
+            "local": json.dumps(local, ensure_ascii=False) if local is not None else None,
+            "remote": json.dumps(remote, ensure_ascii=False) if remote is not None else None})
+
+    def conflicts(self, include_resolved=False):
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(text(
+                "SELECT id, peer, table_name, row_key, reason, local, remote, kept, detected_at, resolved FROM sync_conflicts "
+                + ("" if include_resolved else "WHERE resolved = 0 ") + "ORDER BY id"
+            ))]
+
+    def resolve(self, conflict_id):
+        with self.engine.begin() as conn:
+            conn.execute(text("UPDATE sync_conflicts SET resolved = 1 WHERE id = :id"), {"id": conflict_id})
+
+    def prune(self):
+        # drops log entries every peer has acknowledged; returns how many
+        with self.engine.begin() as conn:
+            acked = conn.execute(text("SELECT min(acked) FROM sync_peers")).scalar()
+            if not acked:
+                return 0
+            return conn.execute(text("DELETE FROM change_log WHERE seq <= :acked"), {"acked": acked}).rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Delta sync between practice machines.")
+    parser.add_argument("--db", default="sqlite:///PrimalArtDB.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="site id, peers and pending log entries")
+    export = commands.add_parser("export", help="write the changes a peer has not acknowledged yet")
+    export.add_argument("peer", help="site id of the other machine, see status there")
+    export.add_argument("path")
+    export.add_argument("--full", action="store_true", help="every row, to set up an empty database")
+    apply = commands.add_parser("apply", help="apply a delta written by a peer")
+    apply.add_argument("path")
+    apply.add_argument("--prefer", choices=POLICIES, default="local", help="which side wins a conflict")
+    conflicts = commands.add_parser("conflicts", help="list unresolved conflicts")
+    conflicts.add_argument("--resolve", type=int, nargs="*", default=[], help="mark these conflicts as resolved")
+    commands.add_parser("prune", help="drop log entries every peer has acknowledged")
+    args = parser.parse_args(argv)
+
+    from database_manager import DatabaseManager
+
+    database_manager = DatabaseManager(args.db)
+    sync = database_manager.sync
+    if args.command == "status":
+        print(f"site {sync.site()}")
+        for site, acked, received, last_sync in sync.peers():
+            print(f"  peer {site}: acknowledged up to {acked}, received up to {received}, last sync {last_sync or '-'}")
+    elif args.command == "export":
+        manifest = sync.export(args.path, args.peer, args.full)
+        print(f"{manifest['rows']} rows and {manifest['blobs']} images for {args.peer} written to {args.path}")
+    elif args.command == "apply":
+        stats = database_manager.apply_sync(args.path, args.prefer)
+        print(f"{stats['applied']} applied, {stats['unchanged']} unchanged, {stats['conflicts']} conflicts")
+    elif args.command == "conflicts":
+        for conflict_id in args.resolve:
+            sync.resolve(conflict_id)
+        for conflict in sync.conflicts():
+            print(f"#{conflict['id']} {conflict['table_name']} {conflict['row_key']}: {conflict['reason']}, "
+                  f"kept {conflict['kept']}\n    here:  {conflict['local']}\n    there: {conflict['remote']}")
+    elif args.command == "prune":
+        print(f"{sync.prune()} log entries removed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())